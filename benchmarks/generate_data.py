@@ -0,0 +1,204 @@
+## 성능 측정용 가상 NICU 자료 생성
+## py benchmarks/generate_data.py 10000 --out-dir benchmarks/data/10000
+##
+## 혈액배양 n건 기준으로 다음 파일을 만듦
+##  - 혈액배양.xlsx: 날짜·시간 형식이 섞여 있고 "2025-03-08 075844"처럼 깨진 시간 포함
+##  - 입퇴실.xlsx: 재입실 환자, 퇴실일 없는(재실 중) 구간, "M/3d" 형식의 성별/나이 결합 컬럼
+##  - KONIS.xlsx: KONIS WRAP 등록환자 (환자번호 포함)
+##  - KONIS_WHO.xlsx: KONIS WRAP 등록 증례 (환자번호 없음, ID 추정용)
+##  - 재실_YYYYMM.xlsx: 월별 일일 재실 명단 (환자 × 날짜 컬럼)
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from konis_export import to_xlsx_bytes
+
+PERIOD_START = pd.Timestamp("2025-01-01")
+PERIOD_DAYS = 365
+PATHOGENS = ["S. aureus", "S. epidermidis", "E. coli", "K. pneumoniae", "E. faecalis", "C. albicans", "No growth"]
+WARDS = ["NICU", "NR", "PICU", "6W", "신생아실"]
+
+
+# 날짜+시간을 여러 병원 양식으로 표시 (일부는 깨진 시간 형식)
+def mixed_datetimes(values, rng):
+    values = pd.Series(values)
+    styles = rng.choice(6, size=len(values), p=[0.35, 0.2, 0.15, 0.1, 0.1, 0.1])
+    text = np.select(
+        [styles == 0, styles == 1, styles == 2, styles == 3, styles == 4],
+        [
+            values.dt.strftime("%Y-%m-%d %H:%M"),
+            values.dt.strftime("%Y/%m/%d %H:%M:%S"),
+            values.dt.strftime("%Y-%m-%d %H%M%S"),  # "2025-03-08 075844"
+            values.dt.strftime("%Y-%m-%d %H:%M%S"),  # "2025-03-08 07:5844"
+            values.dt.strftime("%Y-%m-%d"),
+        ],
+        default="",
+    ).astype(object)
+    # 나머지는 엑셀 날짜 셀 그대로
+    native = styles == 5
+    text[native] = values[native].astype(object).to_numpy()
+    return text
+
+
+def make_patients(n_patients, rng):
+    ids = pd.Series(rng.choice(10**8, size=n_patients, replace=False)).map("{:08d}".format)
+    # 첫 입실(기간 시작 30일 전부터) 이전에 출생
+    birth = PERIOD_START - pd.to_timedelta(rng.integers(31, 150, size=n_patients), unit="D")
+    return pd.DataFrame({
+        "환자번호": ids.to_numpy(),
+        "성별": rng.choice(["M", "F"], size=n_patients),
+        "생년월일": birth,
+    })
+
+
+# 중환자실 입퇴실: 환자마다 1~4번 입실 (재입실 포함), 마지막 구간 일부는 퇴실일 없음
+def make_icu(patients, n_episodes, rng):
+    owner = rng.integers(0, len(patients), size=n_episodes)
+    start = rng.integers(-30, PERIOD_DAYS, size=n_episodes)
+    stay = rng.integers(0, 60, size=n_episodes)
+    icu = pd.DataFrame({
+        "pos": owner,
+        "in_day": PERIOD_START + pd.to_timedelta(start, unit="D") + pd.to_timedelta(rng.integers(0, 1440, size=n_episodes), unit="min"),
+        "stay": stay,
+    }).sort_values(["pos", "in_day"], kind="stable")
+    # 같은 환자의 다음 입실 전에 퇴실
+    next_in = icu.groupby("pos")["in_day"].shift(-1)
+    out_day = icu["in_day"] + pd.to_timedelta(icu["stay"], unit="D")
+    out_day = out_day.where(next_in.isna() | (out_day < next_in), next_in - pd.Timedelta(days=1))
+    still_in = next_in.isna().to_numpy() & (rng.random(len(icu)) < 0.05)
+
+    pat = patients.iloc[icu["pos"].to_numpy()].reset_index(drop=True)
+    age_days = (icu["in_day"].dt.normalize().to_numpy() - pat["생년월일"].to_numpy()).astype("timedelta64[D]").astype(int)
+    out_text = mixed_datetimes(out_day.to_numpy(), rng)
+    out_text[still_in] = None
+    return pd.DataFrame({
+        "환자번호": pat["환자번호"].to_numpy(),
+        "입실일시": mixed_datetimes(icu["in_day"].to_numpy(), rng),
+        "퇴실일시": out_text,
+        "성별/나이": pat["성별"].to_numpy() + "/" + pd.Series(age_days).astype(str).to_numpy() + "d",
+        "생년월일": pat["생년월일"].dt.strftime("%Y-%m-%d").to_numpy(),
+    }), icu.assign(out_day=out_day.to_numpy())
+
+
+# 혈액배양: 대부분 입실 기간 중, 일부는 입실 전후 또는 입실 기록이 없는 환자
+def make_cultures(patients, episodes, n_cultures, rng):
+    pick = rng.integers(0, len(episodes), size=n_cultures)
+    ep = episodes.iloc[pick].reset_index(drop=True)
+    span = (ep["out_day"] - ep["in_day"]).dt.days.clip(lower=0).to_numpy()
+    offset = (rng.random(n_cultures) * (span + 8)).astype(int) - 3
+    when = ep["in_day"].dt.normalize() + pd.to_timedelta(offset, unit="D") + pd.to_timedelta(rng.integers(0, 1440, size=n_cultures), unit="min")
+    pos = ep["pos"].to_numpy().copy()
+    # 5%는 중환자실 입실 기록이 없는 환자
+    outside = rng.random(n_cultures) < 0.05
+    pos[outside] = rng.integers(0, len(patients), size=outside.sum())
+    pat = patients.iloc[pos].reset_index(drop=True)
+    ids = pat["환자번호"].to_numpy().copy()
+    ids[outside] = pd.Series(rng.choice(10**8, size=outside.sum())).map("X{:08d}".format).to_numpy()
+    return pd.DataFrame({
+        "환자번호": ids,
+        "시행일시": mixed_datetimes(when.to_numpy(), rng),
+        "미생물명": rng.choice(PATHOGENS, size=n_cultures),
+        "병동": rng.choice(WARDS, size=n_cultures),
+        "성별": pat["성별"].to_numpy(),
+        "생년월일": pat["생년월일"].dt.strftime("%Y%m%d").to_numpy(),
+    }), when
+
+
+# KONIS WRAP 등록: 혈액배양 일부를 골라 감염발생일(배양일 0~2일 전)로 등록
+def make_konis(cultures, when, patients, episodes, n_cases, rng):
+    pick = rng.choice(len(cultures), size=min(n_cases, len(cultures)), replace=False)
+    onset = (when.iloc[pick].dt.normalize() - pd.to_timedelta(rng.integers(0, 3, size=len(pick)), unit="D")).reset_index(drop=True)
+    lcbi = rng.choice(["LCBI 1", "LCBI 2", "LCBI1", "2"], size=len(pick))
+    bsi = pd.DataFrame({
+        "환자번호": cultures["환자번호"].to_numpy()[pick],
+        "감염발생일": onset.dt.strftime("%Y-%m-%d").to_numpy(),
+        "병원체명": cultures["미생물명"].to_numpy()[pick],
+        "LCBI종류": lcbi,
+    })
+
+    # ID 추정용 증례 파일: 환자번호 대신 증례코드, 성별·생년월일·입원일로 찾아야 함
+    info = patients.set_index("환자번호")
+    known = bsi["환자번호"].isin(info.index).to_numpy()
+    first_in = episodes.groupby("pos")["in_day"].min()
+    pos = pd.Series(np.arange(len(patients)), index=patients["환자번호"])
+    case = bsi[known].reset_index(drop=True)
+    who = pd.DataFrame({
+        "증례코드": [f"C{i:06d}" for i in range(len(case))],
+        "생년월일": info.loc[case["환자번호"], "생년월일"].dt.strftime("%Y-%m-%d").to_numpy(),
+        "성별": info.loc[case["환자번호"], "성별"].to_numpy(),
+        "중환자실입원일": first_in.reindex(pos[case["환자번호"]].to_numpy()).dt.strftime("%Y-%m-%d").to_numpy(),
+        "감염발생일": case["감염발생일"].to_numpy(),
+        "LCBI종류": case["LCBI종류"].to_numpy(),
+        "병원체명1": case["병원체명"].to_numpy(),
+    })
+    return bsi, who
+
+
+# 월별 일일 재실 명단: 환자 × 날짜 컬럼("2025.01.01(수)"), 재실이면 "1"
+def make_census(n_patients, rng):
+    ids = pd.Series(rng.choice(10**8, size=n_patients, replace=False)).map("{:08d}".format).to_numpy()
+    days = pd.date_range(PERIOD_START, periods=PERIOD_DAYS)
+    present = np.zeros((n_patients, PERIOD_DAYS), dtype=bool)
+    for _ in range(3):
+        start = rng.integers(-20, PERIOD_DAYS, size=n_patients)
+        stay = rng.integers(1, 40, size=n_patients)
+        cols = np.arange(PERIOD_DAYS)
+        present |= (cols >= start[:, None]) & (cols < (start + stay)[:, None])
+
+    months = {}
+    weekday = "월화수목금토일"
+    for month, positions in pd.Series(np.arange(PERIOD_DAYS)).groupby(days.month):
+        frame = {"순번": np.arange(1, n_patients + 1), "등록번호": ids, "성명": ["홍길동"] * n_patients}
+        for pos in positions:
+            day = days[pos]
+            frame[f"{day:%Y.%m.%d}({weekday[day.weekday()]})"] = np.where(present[:, pos], "1", "")
+        months[f"{days[positions.iloc[0]]:%Y%m}"] = pd.DataFrame(frame)
+    return months
+
+
+# 혈액배양 n건 기준 전체 자료 → {파일 이름: DataFrame}
+def generate(n, seed=0):
+    rng = np.random.default_rng(seed)
+    patients = make_patients(max(n // 4, 10), rng)
+    icu, episodes = make_icu(patients, max(n // 2, 10), rng)
+    cultures, when = make_cultures(patients, episodes, n, rng)
+    bsi, who = make_konis(cultures, when, patients, episodes, max(n // 20, 5), rng)
+    files = {"혈액배양": cultures, "입퇴실": icu, "KONIS": bsi, "KONIS_WHO": who}
+    for month, census in make_census(max(n // PERIOD_DAYS, 5), rng).items():
+        files[f"재실_{month}"] = census
+    return files
+
+
+# 파일로 저장 (xlsx 또는 csv) → {파일 이름: 경로}
+def write_files(files, out_dir, fmt="xlsx"):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name, df in files.items():
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "csv":
+            df.to_csv(path, index=False, encoding="utf-8-sig")
+        else:
+            with open(path, "wb") as f:
+                f.write(to_xlsx_bytes(df))
+        paths[name] = path
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="성능 측정용 가상 NICU 자료 생성")
+    parser.add_argument("rows", type=int, help="혈액배양 건수")
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--format", default="xlsx", choices=["xlsx", "csv"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for name, path in write_files(generate(args.rows, args.seed), args.out_dir, args.format).items():
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
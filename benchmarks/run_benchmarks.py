@@ -0,0 +1,200 @@
+## 규모별 성능 측정 (혈액배양 매칭 / 감염환자 ID 추정 / 세브란스 입퇴실일 계산)
+## py benchmarks/run_benchmarks.py --sizes 1000 10000
+##
+## 크기마다 benchmarks/data/<n>_<형식>에 가상 자료를 만들고(이미 있으면 재사용) 세 화면과 같은 엔진을 단계별로 실행
+##  - 단계: read(파일 읽기) → parse(날짜 처리) → merge(병합) → konis/estimate/classify(분류) → export(xlsx 저장)
+##  - --trace-memory: 단계별 최대 메모리(tracemalloc)도 기록
+##  - 결과는 benchmarks/results/results.csv에 누적하고, 직전 버전(git 커밋)과 단계별 시간을 비교해 출력
+##  - 1,000,000건은 xlsx 생성·읽기만으로 수십 분 걸리므로 --input-format csv로 먼저 확인하는 것을 권장
+
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import konis_census
+from generate_data import generate, write_files
+from konis_utils import open_upload, clear_upload_cache, clear_transform_cache, timed_stage, memory_tracing
+from konis_census import read_census_files, combine_months, find_admission_blocks, label_census_episodes
+from konis_export import export_bytes
+from konis_pipeline import (match_cultures, estimate_ids, write_outputs,
+                            CULTURE_SOURCE, ICU_SOURCE, BSI_SOURCE, KONIS_SOURCE)
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results", "results.csv")
+
+# 가상 자료(generate_data.py)의 컬럼에 맞춘 프로필
+MATCHER_PROFILE = {
+    "culture_id": "환자번호", "culture_date": "시행일시", "culture_ward": "병동", "culture_result": "미생물명",
+    "icu_id": "환자번호", "icu_in": "입실일시", "icu_out": "퇴실일시",
+    "bsi_id": "환자번호", "bsi_date": "감염발생일", "bsi_pathogen": "병원체명", "bsi_lcbi": "LCBI종류",
+    "birth_source": CULTURE_SOURCE, "birth_id": "환자번호", "birth_col": "생년월일",
+    "gender_source": ICU_SOURCE, "gender_id": "환자번호",
+    "gender_combined_col": "성별/나이", "gender_delimiter": "/", "gender_position": "앞",
+}
+WHO_PROFILE = {
+    "caseno": "증례코드", "dob": "생년월일", "gender": "성별", "icu_date": "중환자실입원일", "infection_date": "감염발생일",
+    "icu_id": "환자번호", "icu_in": "입실일시", "icu_out": "퇴실일시",
+    "culture_id": "환자번호", "culture_date": "시행일시", "culture_result": "미생물명",
+    "birth_source": ICU_SOURCE, "birth_id": "환자번호", "birth_col": "생년월일",
+    "gender_source": ICU_SOURCE, "gender_id": "환자번호",
+    "gender_combined_col": "성별/나이", "gender_delimiter": "/", "gender_position": "앞",
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# 크기별 입력 파일 준비 (없으면 생성) → {파일 이름: 경로}
+def prepare_data(n, fmt, seed):
+    out_dir = os.path.join(DATA_DIR, f"{n}_{fmt}")
+    names = os.listdir(out_dir) if os.path.isdir(out_dir) else []
+    if not any(name.startswith("혈액배양.") for name in names):
+        started = time.perf_counter()
+        write_files(generate(n, seed), out_dir, fmt)
+        print(f"  자료 생성 {n:,}건 ({fmt}): {time.perf_counter() - started:.1f}초", file=sys.stderr)
+    return {os.path.splitext(name)[0]: os.path.join(out_dir, name) for name in sorted(os.listdir(out_dir))}
+
+
+# 캐시를 비워 매번 처음 실행과 같은 조건으로 측정
+def clear_caches():
+    clear_upload_cache()
+    clear_transform_cache()
+    konis_census._census_cache.clear()
+
+
+def run_matcher(paths, out_dir):
+    timings = []
+    files = {CULTURE_SOURCE: open_upload(paths["혈액배양"]), ICU_SOURCE: open_upload(paths["입퇴실"]),
+             BSI_SOURCE: open_upload(paths["KONIS"])}
+    outcome = match_cultures(files, MATCHER_PROFILE, timings)
+    with timed_stage(timings, "export") as stage:
+        write_outputs(outcome, out_dir, "Excel (.xlsx)", prefix="bench")
+        stage["rows"] = len(outcome["result"])
+    return timings, len(outcome["result"])
+
+
+def run_who(paths, out_dir):
+    timings = []
+    files = {KONIS_SOURCE: open_upload(paths["KONIS_WHO"]), ICU_SOURCE: open_upload(paths["입퇴실"]),
+             CULTURE_SOURCE: open_upload(paths["혈액배양"])}
+    final = estimate_ids(files, WHO_PROFILE, timings)
+    with timed_stage(timings, "export") as stage:
+        export_bytes(final, "Excel (.xlsx)")
+        stage["rows"] = len(final)
+    return timings, len(final)
+
+
+# 세브란스 입퇴실일 계산기와 같은 순서 (증분 모드 제외)
+def run_severance(paths, out_dir):
+    timings = []
+    files = []
+    for name in sorted(name for name in paths if name.startswith("재실_")):
+        with open(paths[name], "rb") as f:
+            files.append((os.path.basename(paths[name]), f.read()))
+    with timed_stage(timings, "read") as stage:
+        months = [part for _, part, error in read_census_files(files, "등록번호", "1") if error is None]
+        stage["rows"] = sum(len(part[0]) for part in months)
+    with timed_stage(timings, "merge") as stage:
+        ids, dates, present = combine_months(months)
+        stage["rows"] = len(ids)
+    with timed_stage(timings, "classify") as stage:
+        result = label_census_episodes(find_admission_blocks(ids, dates, present, "등록번호"), dates, "등록번호")
+        stage["rows"] = len(result)
+    with timed_stage(timings, "export") as stage:
+        export_bytes(result, "Excel (.xlsx)", sheet_name="입퇴원내역")
+        stage["rows"] = len(result)
+    return timings, len(result)
+
+
+APPS = {"matcher": run_matcher, "who": run_who, "severance": run_severance}
+
+
+# 크기 하나에 대해 세 작업 실행 → 결과 행 목록 (trace_memory: 단계별 최대 메모리도 측정, 시간은 늘어남)
+def run_size(n, fmt, seed, apps, trace_memory=False):
+    paths = prepare_data(n, fmt, seed)
+    out_dir = os.path.join(DATA_DIR, f"{n}_{fmt}_out")
+    rows = []
+    for app in apps:
+        clear_caches()
+        started = time.perf_counter()
+        with memory_tracing(trace_memory):
+            timings, result_rows = APPS[app](paths, out_dir)
+        timings.append({"stage": "total", "seconds": time.perf_counter() - started, "rows": result_rows})
+        for record in timings:
+            rows.append({"app": app, "size": n, "input_format": fmt, "trace_memory": trace_memory,
+                         "stage": record["stage"], "seconds": round(record["seconds"], 4),
+                         "rows": record.get("rows"), "peak_mb": record.get("peak_mb")})
+        print(f"  {app:<10} {n:>9,}건  {timings[-1]['seconds']:8.2f}초  (결과 {result_rows:,}행)", file=sys.stderr)
+    return rows
+
+
+# 이번 결과와 직전 버전(다른 커밋) 결과를 단계별로 비교
+def compare_with_previous(current, history):
+    revision = current["revision"].iloc[0]
+    keys = ["app", "size", "input_format", "trace_memory", "stage"]
+    previous = history[history["revision"] != revision]
+    if previous.empty:
+        return None
+    last_run = previous[previous["run_at"] == previous["run_at"].max()]
+    table = current[keys + ["seconds"]].merge(
+        last_run[keys + ["seconds", "revision"]], on=keys, how="left", suffixes=("", "_prev"))
+    table["ratio"] = (table["seconds"] / table["seconds_prev"]).round(2)
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="규모별 성능 측정 (가상 NICU 자료)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="혈액배양 건수 목록")
+    parser.add_argument("--apps", nargs="+", default=list(APPS), choices=list(APPS))
+    parser.add_argument("--input-format", default="xlsx", choices=["xlsx", "csv"], help="입력 파일 형식")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="단계별 최대 메모리도 측정 (tracemalloc, 시간 비교는 같은 설정끼리만)")
+    parser.add_argument("--results", default=RESULTS_PATH, help="결과를 누적할 CSV 파일")
+    args = parser.parse_args(argv)
+
+    run_at = datetime.now().isoformat(timespec="seconds")
+    rows = []
+    for n in args.sizes:
+        rows += run_size(n, args.input_format, args.seed, args.apps, args.trace_memory)
+
+    current = pd.DataFrame(rows)
+    current.insert(0, "run_at", run_at)
+    current.insert(1, "revision", git_revision())
+    current["python"] = platform.python_version()
+    current["pandas"] = pd.__version__
+
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    history = pd.read_csv(args.results, dtype={"revision": str}) if os.path.exists(args.results) else current.iloc[:0]
+    if "trace_memory" not in history:
+        # 메모리 측정 기능 이전에 쌓인 결과
+        history["trace_memory"] = False
+    table = compare_with_previous(current, history)
+    pd.concat([history, current], ignore_index=True).to_csv(args.results, index=False)
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        if table is None:
+            print(current[["app", "size", "stage", "seconds", "rows", "peak_mb"]].to_string(index=False))
+        else:
+            print(table.to_string(index=False))
+    print(f"→ {args.results}")
+
+
+if __name__ == "__main__":
+    main()
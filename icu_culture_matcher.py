@@ -3,47 +3,15 @@
 
 import pandas as pd
 import streamlit as st
-from datetime import datetime
-import io
 from collections import Counter
-import re
-
-# 날짜 자동 인식
-def fix_time_format(val):
-    val_str = str(val)
-    
-    # 시간 정보가 붙은 형식에서 잘못된 6자리 숫자만 시간으로 고치기
-    # 예: "2025-03-08 075844" 또는 "2025-03-08 07:5844" → "2025-03-08 07:58:44"
-    match = re.match(r'(.*\s)(\d{2}):?(\d{2})(\d{2})$', val_str)
-    if match:
-        return f"{match.group(1)}{match.group(2)}:{match.group(3)}:{match.group(4)}"
-    
-    # 혹시 그냥 6자리 숫자만 있는 경우에도 대응
-    match2 = re.match(r'(\d{2})(\d{2})(\d{2})$', val_str)
-    if match2:
-        return f"{match2.group(1)}:{match2.group(2)}:{match2.group(3)}"
-    
-    return val_str
-    
-def parse_dates_safe(series):
-    known_formats = [
-        "%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y", "%d/%m/%Y",
-        "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M", "%Y-%m-%d %H%M",
-        "%Y/%m/%d %H%M", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"
-    ]
-    def try_parse(val):
-        if pd.isna(val): return pd.NaT
-        val = fix_time_format(val)  # 👈 여기 추가
-        for fmt in known_formats:
-            try:
-                return datetime.strptime(str(val), fmt)
-            except:
-                continue
-        try:
-            return pd.to_datetime(val, errors='coerce')
-        except:
-            return pd.NaT
-    return series.apply(try_parse)
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from konis_utils import read_columns, read_upload_columns, copy_upload, timed_stage, stage_table, page_rows, page_count, PREVIEW_PAGE_SIZES
+from konis_jobs import start_job, wait_job, cancel_job, job_running, job_progress, store_stages, MATCH_STAGES, JOB_DONE, JOB_FAILED
+from konis_store import STORE_PATH, STORE_SITE
+from konis_sessions import put_result, get_result, drop_result, session_bytes, SESSION_IDLE_MINUTES
+from konis_export import available_formats
+from konis_pipeline import (match_cultures, result_view, export_view, filter_result, dump_profile, RESULT_VIEWS, REMARK_LABELS,
+                            CULTURE_SOURCE, ICU_SOURCE, BSI_SOURCE, INFO_SOURCE)
 
 # 초성 추출 함수
 def get_initials(hangul_string):
@@ -96,59 +64,60 @@ bsi_file = st.file_uploader("🚨 KONIS WRAP 등록환자 파일 (optional)", ty
 info_file = st.file_uploader("📄 추가 환자정보 파일 (optional)", type=["xlsx"], help="혈액배양, 중환자실 파일에 생년월일 또는 성별 정보가 없는 경우에만 필요")
 
 if icu_file and culture_file:
-    icu_df = pd.read_excel(icu_file, dtype=str)
-    culture_df = pd.read_excel(culture_file, dtype=str)
-    bsi_df = pd.read_excel(bsi_file, dtype=str) if bsi_file else pd.DataFrame()
-    info_df = pd.read_excel(info_file, dtype=str) if info_file else pd.DataFrame()
+    # 1단계: 컬럼명(첫 행)만 읽어서 컬럼 선택 화면 구성
+    icu_cols = read_columns(icu_file)
+    culture_cols = read_columns(culture_file)
+    bsi_cols = read_columns(bsi_file) if bsi_file else pd.Index([])
+    info_cols = read_columns(info_file) if info_file else pd.Index([])
 
     st.subheader("🧫 혈액배양 파일 컬럼 선택")
-    culture_id = st.selectbox("🆔 환자 ID", culture_df.columns, index=culture_df.columns.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], culture_df.columns) or culture_df.columns[0]))
+    culture_id = st.selectbox("🆔 환자 ID", culture_cols, index=culture_cols.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], culture_cols) or culture_cols[0]))
     use_ward_col = st.checkbox("❔ 시행병동 정보가 없습니다", value=False)
     use_ward_col = not use_ward_col
     if use_ward_col:
-        culture_ward = st.selectbox("🚼 병동(시행부서)", culture_df.columns, index=culture_df.columns.get_loc(find_column(["병동", "부서"], culture_df.columns) or culture_df.columns[0]))
-    culture_date = st.selectbox("📅 혈액배양 의뢰일", culture_df.columns, index=culture_df.columns.get_loc(find_column(["시행일", "채취일", "검사일","접수일"], culture_df.columns) or culture_df.columns[0]))
+        culture_ward = st.selectbox("🚼 병동(시행부서)", culture_cols, index=culture_cols.get_loc(find_column(["병동", "부서"], culture_cols) or culture_cols[0]))
+    culture_date = st.selectbox("📅 혈액배양 의뢰일", culture_cols, index=culture_cols.get_loc(find_column(["시행일", "채취일", "검사일","접수일"], culture_cols) or culture_cols[0]))
     use_result_col = st.checkbox("❔ 분리균 정보가 없습니다", value=False)
     use_result_col = not use_result_col
     if use_result_col:
-        culture_result = st.selectbox("🦠 혈액배양 결과(분리균) 컬럼", culture_df.columns, index=culture_df.columns.get_loc(find_column(["미생물명","병원체","미생물","결과"], culture_df.columns) or culture_df.columns[0]))
+        culture_result = st.selectbox("🦠 혈액배양 결과(분리균) 컬럼", culture_cols, index=culture_cols.get_loc(find_column(["미생물명","병원체","미생물","결과"], culture_cols) or culture_cols[0]))
 
-    if not bsi_df.empty:
+    if bsi_file:
         st.markdown("### 🚨 KONIS WRAP 등록환자 컬럼 선택")
-        bsi_id_col = st.selectbox("🆔 환자 ID", bsi_df.columns,
-            index=bsi_df.columns.get_loc(find_column(["환자번호", "병록번호", "추정ID","patientid", "patient_id"], bsi_df.columns) or bsi_df.columns[0])
+        bsi_id_col = st.selectbox("🆔 환자 ID", bsi_cols,
+            index=bsi_cols.get_loc(find_column(["환자번호", "병록번호", "추정ID","patientid", "patient_id"], bsi_cols) or bsi_cols[0])
         )
-        bsi_date = st.selectbox("📅 감염발생일", bsi_df.columns,
-            index=bsi_df.columns.get_loc(find_column(["감염발생일", "일자", "검사일", "date"], bsi_df.columns) or bsi_df.columns[0])
+        bsi_date = st.selectbox("📅 감염발생일", bsi_cols,
+            index=bsi_cols.get_loc(find_column(["감염발생일", "일자", "검사일", "date"], bsi_cols) or bsi_cols[0])
         )
-        bsi_pathogen = st.selectbox("🦠 병원체명", bsi_df.columns,
-            index=bsi_df.columns.get_loc(find_column(["미생물명","병원체", "미생물","결과"], bsi_df.columns) or bsi_df.columns[0])
+        bsi_pathogen = st.selectbox("🦠 병원체명", bsi_cols,
+            index=bsi_cols.get_loc(find_column(["미생물명","병원체", "미생물","결과"], bsi_cols) or bsi_cols[0])
         )
         use_lcbi_col = st.checkbox("❔ LCBI 종류 정보가 없습니다", value=False)
         use_lcbi_col = not use_lcbi_col
         if use_lcbi_col:
-            bsi_lcbi = st.selectbox("LCBI 종류", bsi_df.columns,
-                index=bsi_df.columns.get_loc(find_column(["LCBI"], bsi_df.columns) or bsi_df.columns[0])
+            bsi_lcbi = st.selectbox("LCBI 종류", bsi_cols,
+                index=bsi_cols.get_loc(find_column(["LCBI"], bsi_cols) or bsi_cols[0])
             )
 
     st.subheader("🧸 중환자실 파일 컬럼 선택")
-    icu_id = st.selectbox("🆔 환자 ID 컬럼", icu_df.columns, index=icu_df.columns.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], icu_df.columns) or icu_df.columns[0]))
-    icu_in = st.selectbox("📅 입실일", icu_df.columns, index=icu_df.columns.get_loc(find_column(["입실"], icu_df.columns) or icu_df.columns[0]))
-    icu_out = st.selectbox("📅 퇴실일", icu_df.columns, index=icu_df.columns.get_loc(find_column(["퇴실"], icu_df.columns) or icu_df.columns[0]))
+    icu_id = st.selectbox("🆔 환자 ID 컬럼", icu_cols, index=icu_cols.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], icu_cols) or icu_cols[0]))
+    icu_in = st.selectbox("📅 입실일", icu_cols, index=icu_cols.get_loc(find_column(["입실"], icu_cols) or icu_cols[0]))
+    icu_out = st.selectbox("📅 퇴실일", icu_cols, index=icu_cols.get_loc(find_column(["퇴실"], icu_cols) or icu_cols[0]))
 
 
 
-    # 병합에 사용할 전체 후보 파일
+    # 병합에 사용할 전체 후보 파일 (파일, 컬럼명)
     all_column_sources = {
-        "중환자실 파일": icu_df,
-        "혈액배양 파일": culture_df
+        "중환자실 파일": (icu_file, icu_cols),
+        "혈액배양 파일": (culture_file, culture_cols)
     }
 
-    if not bsi_df.empty:
-        all_column_sources["BSI 파일"] = bsi_df
+    if bsi_file:
+        all_column_sources["BSI 파일"] = (bsi_file, bsi_cols)
     
-    if not info_df.empty:
-        all_column_sources["추가정보 파일"] = info_df
+    if info_file:
+        all_column_sources["추가정보 파일"] = (info_file, info_cols)
 
     # 항상 "혈액배양 파일"을 첫 번째로 보이도록 재정렬
     all_column_options = ["혈액배양 파일"] + [k for k in all_column_sources.keys() if k != "혈액배양 파일"]
@@ -158,9 +127,9 @@ if icu_file and culture_file:
     birth_unavailable = st.checkbox("❔ 생년월일 정보가 없습니다", value=False)
     if not birth_unavailable:
         birth_source = st.selectbox("📁 생년월일이 있는 파일", all_column_options, key="birth_src", index=0)
-        birth_df = all_column_sources[birth_source]
-        birth_id_col = st.selectbox("🆔 환자 ID 컬럼", birth_df.columns, key="birth_id", index=birth_df.columns.get_loc(find_column(["환자번호", "병록번호", "patientid"], birth_df.columns) or birth_df.columns[0]))
-        birth_col = st.selectbox("📅 생년월일 컬럼", birth_df.columns, key="birth_col", index=birth_df.columns.get_loc(find_column(["생년월일", "birthdate", "dob"], birth_df.columns) or birth_df.columns[0]))
+        birth_cols = all_column_sources[birth_source][1]
+        birth_id_col = st.selectbox("🆔 환자 ID 컬럼", birth_cols, key="birth_id", index=birth_cols.get_loc(find_column(["환자번호", "병록번호", "patientid"], birth_cols) or birth_cols[0]))
+        birth_col = st.selectbox("📅 생년월일 컬럼", birth_cols, key="birth_col", index=birth_cols.get_loc(find_column(["생년월일", "birthdate", "dob"], birth_cols) or birth_cols[0]))
 
     #st.markdown("---")
     #st.markdown("### 👶 이름 정보")
@@ -172,283 +141,158 @@ if icu_file and culture_file:
     st.markdown("---")
     st.markdown("### 👦👧 성별 정보")
     gender_source = st.selectbox("📁 성별이 있는 파일", all_column_options, key="gender_src", index=0)
-    gender_df = all_column_sources[gender_source]
-    gender_id_col = st.selectbox("🆔 환자 ID 컬럼", gender_df.columns, key="gender_id", index=gender_df.columns.get_loc(find_column(["환자번호", "병록번호", "patientid"], gender_df.columns) or gender_df.columns[0]))
+    gender_file, gender_cols = all_column_sources[gender_source]
+    gender_id_col = st.selectbox("🆔 환자 ID 컬럼", gender_cols, key="gender_id", index=gender_cols.get_loc(find_column(["환자번호", "병록번호", "patientid"], gender_cols) or gender_cols[0]))
 
     use_combined = st.checkbox("성별이 다른 정보(예: 나이)와 하나의 컬럼에 함께 있음")
     if use_combined:
-        combined_col = st.selectbox("📑 결합된 컬럼명", gender_df.columns, key="combined_col", index=gender_df.columns.get_loc(find_column(["성별/나이", "S/A", "S|A"], gender_df.columns) or gender_df.columns[0]))
-        detected_delim = detect_delimiter(gender_df[combined_col])
+        combined_col = st.selectbox("📑 결합된 컬럼명", gender_cols, key="combined_col", index=gender_cols.get_loc(find_column(["성별/나이", "S/A", "S|A"], gender_cols) or gender_cols[0]))
+        detected_delim = detect_delimiter(read_upload_columns(gender_file, [combined_col])[combined_col])
         delimiter = st.text_input("🔹 구분자 (예: /)", value=detected_delim)
         position = st.radio("🔹 성별은 구분자를 기준으로 어디에 있나요?", ["앞", "뒤"], horizontal=True)
     else:
-        gender_col = st.selectbox("성별 컬럼", gender_df.columns, key="gender_col", index=gender_df.columns.get_loc(find_column(["성별", "gender", "sex"], gender_df.columns) or gender_df.columns[0]))
-
-    if st.button("🔁 매칭 실행"):
-        # 날짜 처리
-        icu_df[icu_in] = parse_dates_safe(icu_df[icu_in])
-        icu_df[icu_out] = parse_dates_safe(icu_df[icu_out])
-        culture_df[culture_date] = parse_dates_safe(culture_df[culture_date])
-
-        # ICU 데이터 병합
-        merged = culture_df.merge(
-            icu_df[[icu_id, icu_in, icu_out]],
-            left_on=culture_id, right_on=icu_id, how='left'
-        )
-
-        # 캘린더 데이 범위 계산
-        merged['culture_date_day'] = merged[culture_date].dt.date
-        merged['icu_in_day'] = merged[icu_in].dt.date
-        merged['icu_out_day'] = merged[icu_out].dt.date
-        merged['icu_day_start'] = merged['icu_in_day'] + pd.Timedelta(days=2)
-        merged['icu_day_end'] = merged['icu_out_day'] + pd.Timedelta(days=1)
-
-        merged = merged.drop_duplicates(subset=[culture_id, culture_date, culture_result] if use_result_col else [culture_id, culture_date])
-        merged['surv_window'] = None
-
-
-        # 1. 입실일 없는 경우 → 입퇴실일 확인
-        merged.loc[merged['icu_in_day'].isna(), 'surv_window'] = "시행부서 확인"
-
+        gender_col = st.selectbox("성별 컬럼", gender_cols, key="gender_col", index=gender_cols.get_loc(find_column(["성별", "gender", "sex"], gender_cols) or gender_cols[0]))
+
+    # 화면에서 선택한 컬럼 매핑 (명령줄 실행용 프로필과 같은 형식)
+    profile = {
+        "culture_id": culture_id,
+        "culture_date": culture_date,
+        "culture_ward": culture_ward if use_ward_col else None,
+        "culture_result": culture_result if use_result_col else None,
+        "icu_id": icu_id,
+        "icu_in": icu_in,
+        "icu_out": icu_out,
+        "gender_source": gender_source,
+        "gender_id": gender_id_col,
+        "gender_col": None if use_combined else gender_col,
+        "gender_combined_col": combined_col if use_combined else None,
+    }
+    if use_combined:
+        profile.update(gender_delimiter=delimiter, gender_position=position)
+    if bsi_file:
+        profile.update(bsi_id=bsi_id_col, bsi_date=bsi_date, bsi_pathogen=bsi_pathogen,
+                       bsi_lcbi=bsi_lcbi if use_lcbi_col else None)
+    if not birth_unavailable:
+        profile.update(birth_source=birth_source, birth_id=birth_id_col, birth_col=birth_col)
 
-        # 2. 감시기간 포함 (icu_day_start ≤ culture_date_day ≤ icu_day_end or icu_day_end isna)
-        condition_matched = (
-            (merged['icu_day_start'].notna()) &
-            (merged['culture_date_day'] >= merged['icu_day_start']) &
-            (
-                (merged['culture_date_day'] <= merged['icu_day_end']) |
-                (merged['icu_day_end'].isna())
-            )
-        )
-        merged.loc[condition_matched, 'surv_window'] = None  # matched → 비고 없음
+    st.download_button("💾 컬럼 설정 저장 (명령줄 실행용 프로필)", data=dump_profile(profile),
+                       file_name="matcher_profile.json", mime="application/json")
 
-        # 3. 감시기간 이전 (culture_date_day < icu_day_start) → 감시기간 이전
-        condition_before = (
-            merged['icu_in_day'].notna() &
-            (merged['culture_date_day'] >= merged['icu_in_day']) &
-            (merged['culture_date_day'] < merged['icu_day_start'])
-        )
-        merged.loc[condition_before, 'surv_window'] = "감시기간 이전"
+    profile_stages = st.sidebar.checkbox("⏱️ 단계별 소요시간·메모리 측정", key="profile_stages",
+                                        help="처리 단계마다 걸린 시간, 행 수, 최대 메모리 사용량을 표시합니다 (측정하는 동안 처리가 조금 느려집니다)")
+    # 로컬 저장소는 한 기관 전용 서버(KONIS_STORE_PATH, KONIS_STORE_SITE 설정)에서만 사용
+    use_store = bool(STORE_PATH and STORE_SITE) and st.sidebar.checkbox(
+        "💾 로컬 저장소 사용", key="use_store",
+        help=f"올린 입실 구간·혈액배양·KONIS 등록·성별·생년월일을 이 서버의 로컬 저장소({STORE_SITE})에 누적하고, "
+             "조사기간 이전 입실 구간처럼 이번에 올리지 않은 기록을 저장소에서 불러와 함께 매칭합니다")
 
-        # 4. 감시기간 이후 (culture_date_day > icu_day_end) → 감시기간 이후
-        condition_after = (
-            merged['icu_day_end'].notna() &
-            (merged['culture_date_day'] > merged['icu_day_end'])
-        )
-        merged.loc[condition_after, 'surv_window'] = "감시기간 이후"
-
-        # matched: 비고가 None인 것
-        matched = merged[merged['surv_window'].isna()]
-
-        # unmatched: 나머지 비고가 있는 행
-        unmatched = merged[merged['surv_window'].notna()]
-
-        # result = matched + unmatched로 culture_df의 모든 데이터 유지
-        result = pd.concat([matched, unmatched], ignore_index=True, sort=False)
-
-
-        # 이름, 성별 병합 전에 중복가능성 있는 열 제거
-        gender_col_name = gender_col if not use_combined else combined_col
-        #for col in [name_col, "이름", gender_col_name, "성별"]:
-        #    if col in result.columns:
-        #        result.drop(columns=[col], inplace=True)
-        
-        # 이름 초성 변환 병합
-        #name_df = name_df[[name_id_col, name_col]].copy()
-        #name_df = name_df.drop_duplicates(subset=[name_id_col], keep="last") ## 마지막 이름을 남김
-        #name_df['name_initial'] = name_df[name_col].apply(get_initials)
-        #result = result.merge(name_df[[name_id_col, 'name_initial']], left_on=culture_id, right_on=name_id_col, how='left')
-
-        # 성별 병합     
-        if use_combined:
-            comb_df = gender_df[[gender_id_col, combined_col]].copy()
-            comb_df = comb_df.drop_duplicates(subset=[gender_id_col])
-            if position == "앞":
-                comb_df['gender'] = comb_df[combined_col].str.split(delimiter).str[0]
-            else:
-                comb_df['gender'] = comb_df[combined_col].str.split(delimiter).str[-1]
-            result = result.merge(comb_df[[gender_id_col, 'gender']], left_on=culture_id, right_on=gender_id_col, how='left')
+    # 매칭은 서버 공용 프로세스 풀에서 실행 (위젯을 바꿔 화면이 다시 그려져도 작업은 이어짐, 진행 중인 이전 작업은 취소)
+    session = get_script_run_ctx().session_id
+    if st.button("🔁 매칭 실행"):
+        files = {CULTURE_SOURCE: culture_file, ICU_SOURCE: icu_file, BSI_SOURCE: bsi_file, INFO_SOURCE: info_file}
+        if job_running(st.session_state.get("match_job")):
+            cancel_job(st.session_state["match_job"])
+        st.session_state["match_job"] = start_job(match_cultures, {name: copy_upload(file) for name, file in files.items()},
+                                                  {**profile, "site": STORE_SITE} if use_store else profile,
+                                                  session=session, trace_memory=profile_stages,
+                                                  stages=store_stages(MATCH_STAGES) if use_store else MATCH_STAGES,
+                                                  store=STORE_PATH if use_store else None)
+
+    # 진행 상황 (1초마다 갱신, 작업이 끝나면 결과를 session_state로 옮기고 화면 전체를 다시 그림)
+    @st.fragment(run_every=1.0)
+    def show_match_job():
+        job = st.session_state["match_job"]
+        if job_running(job):
+            fraction, text = job_progress(job)
+            st.progress(fraction, text=text)
+            if st.button("⏹️ 작업 취소", disabled=job["cancel_event"].is_set()):
+                cancel_job(job)
+            return
+
+        del st.session_state["match_job"]
+        if job["status"] == JOB_DONE:
+            # 결과는 세션 결과 보관소에 한 번만 보관 (외부/내부 타당도 조사용 표는 필요할 때 만듦)
+            outcome = job["result"]
+            put_result(session, "match", outcome["result"])
+            drop_result(session, "match_payloads")
+            st.session_state["match_warnings"] = outcome["warnings"]
+            st.session_state["match_summary"] = outcome["summary"]
+            st.session_state["preview_page"] = 1
+            st.session_state["stage_timings"] = list(job["timings"])
+            st.session_state["matching_done"] = True
+        elif job["status"] == JOB_FAILED:
+            st.session_state["match_notice"] = f"❌ 매칭 중 오류가 발생했습니다: {job['error']}"
         else:
-            gender_df = gender_df.drop_duplicates(subset=[gender_id_col])
-            gender_df = gender_df[[gender_id_col, gender_col]].rename(columns={gender_col: 'gender'})
-            result = result.merge(gender_df, left_on=culture_id, right_on=gender_id_col, how='left')
-
-        # 생년월일 병합 (선택적)
-        birth_column_success = False ## 기본값 설정
-        if not birth_unavailable:
-            for col in [birth_col, "생년월일"]:
-                if col in result.columns:
-                    result.drop(columns=[col], inplace=True)               
-            try:
-                birth_df = birth_df[[birth_id_col, birth_col]].copy()
-                birth_df = birth_df.drop_duplicates(subset=[birth_id_col])
-
-                # 문자열 길이 기준 필터 (길이 8 이상이 50% 이상이어야 함)
-                str_lengths = birth_df[birth_col].astype(str).str.len()
-                long_enough_ratio = (str_lengths >= 8).mean()
-
-                if long_enough_ratio < 0.5:
-                    st.warning("❌ 선택한 생년월일 컬럼의 값 대부분이 날짜 형식이 아닙니다. 컬럼 선택을 다시 확인해 주세요.")
-                else:
-                    # 날짜로 파싱 시도
-                    parsed_birth = parse_dates_safe(birth_df[birth_col])
-                    valid_ratio = parsed_birth.notna().mean()
-
-                    if valid_ratio < 0.5:
-                        st.warning("⚠️ 생년월일 컬럼의 값 중 다수가 날짜로 변환되지 않았습니다. 일부 정보가 누락되었을 수 있습니다.")
-                    else:
-                        birth_df[birth_col] = parsed_birth
-                        result = result.merge(birth_df, left_on=culture_id, right_on=birth_id_col, how='left')
-                        result.rename(columns={birth_col: "dob"}, inplace=True)
-                        birth_column_success = birth_col in result.columns ## boolean
-
-            except Exception as e:
-                st.warning(f"⚠️ 생년월일 병합에 실패했습니다: {e}")
-
-        # KONIS 등록여부 병합
-        if not bsi_df.empty and 'bsi_id_col' in locals():
-            bsi_df[bsi_date]=parse_dates_safe(bsi_df[bsi_date]).dt.date
-            bsi_col=[bsi_id_col, bsi_date, bsi_pathogen]
-            if use_lcbi_col: 
-                bsi_col+=[bsi_lcbi]
-            bsi_df=bsi_df[bsi_col]
-
-            # 성별, 생년월일 기준 병합
-            result2 = []
-            for i, row in result.iterrows():
-                id, cult_d = row[culture_id], pd.to_datetime(row[culture_date]).date()
-                candidates = bsi_df[
-                    (bsi_df[bsi_id_col] == id) &
-                    (bsi_df[bsi_date] <= cult_d) & ## 감염발생일 이후에 컬처 시행
-                    (bsi_df[bsi_date] + pd.Timedelta(days=2) >= cult_d) ## 감염발생일 2일 이내 컬처 시행
-                ]
-                top3_candidates = candidates.drop_duplicates().head(3)
-                top3_date = pd.to_datetime(top3_candidates[bsi_date], errors='coerce').dt.strftime("%y%m%d")
-                top3_pathogen = top3_candidates[bsi_pathogen]
-                
-                if use_lcbi_col:
-                    top3_lcbi=top3_candidates[bsi_lcbi]
-                    top3_lcbi=top3_lcbi.astype(str).str.extract(r'(\d+)')[0] 
-                    top3_lcbi=top3_lcbi.where(top3_lcbi.notna(), "") 
-                    top3_lcbi=top3_lcbi.apply(lambda x: f"LCBI {x}" if x else "")
-                else: 
-                    top3_lcbi = pd.Series([""] * len(top3_candidates))
-                
-                triplets = zip(top3_date, top3_pathogen, top3_lcbi)
-                formatted = [f"{d} {p} {l}" for d, p, l in triplets]
-                final_string = " OR ".join(formatted)
-                result2.append({"row_origin":i+1, 
-                                "KONIS_reported": "Y" if top3_candidates.shape[0]>0 else "N", ##boolean
-                                "KONIS_detail": final_string})
-
-            konis_df = pd.DataFrame(result2)
-            result = pd.concat([result, konis_df[["KONIS_reported","KONIS_detail"]]], axis=1)
-
-        # 날짜 포맷을 yyyy-mm-dd로 통일
-        date_cols = [icu_in, icu_out, culture_date]
-        if not birth_unavailable:
-            date_cols.append("dob")
-
-        for col in date_cols:
-            if col in result:
-                result[col] = pd.to_datetime(result[col], errors="coerce").dt.strftime("%Y-%m-%d")
-
-        result = result.drop_duplicates(subset=[culture_id, culture_date, culture_result] if use_result_col else [culture_id, culture_date])        
-
-        # 기존 "비고" 컬럼이 존재하면 삭제
-        # 비고 컬럼 추가: NICU/신생아 포함 + ICU 입실정보가 없는 경우
-        if "비고" in result.columns:
-            result.drop(columns=["비고"], inplace=True)            
-
-        if use_ward_col and 'culture_ward' in locals() and culture_ward:
-            result.loc[
-                result[culture_ward].str.contains("NICU|NR|신생아", na=False) & result[icu_in].isna(),
-                "surv_window"
-            ] = "입퇴실일 확인"
-
-
-        # 정렬 및 일련번호
-        surv_window_sort = {
-            None: 0,
-            "입퇴실일 확인": 1,
-            "감시기간 이전": 2,
-            "감시기간 이후": 3
-        }
-        result["order_sort"] = result["surv_window"].map(surv_window_sort)
-
-        # 정렬 및 일련번호
-        result_sorted = result.sort_values(
-            by=["order_sort", culture_date, icu_in],
-            ascending=[True, True, True],
-            na_position="last"
-        ).drop(columns=["order_sort"])
-        result_sorted.insert(0, "No", range(1, len(result_sorted) + 1))
+            st.session_state["match_notice"] = "⏹️ 매칭 작업을 취소했습니다."
+        st.rerun()
 
+    if "match_job" in st.session_state:
+        show_match_job()
+    if "match_notice" in st.session_state:
+        st.info(st.session_state.pop("match_notice"))
 
-    
-        # 환자ID를 문자열로 강제 변환
-        result_sorted[culture_id] = result_sorted[culture_id].astype(str)
-        
-        # 결측 컬럼 처리
-        if use_result_col and 'culture_result' in locals() and culture_result:
-            result_sorted["culture_result2"]=result_sorted[culture_result]
-        else: 
-            result_sorted["culture_result2"]=None
-
-        if use_ward_col and 'culture_ward' in locals() and culture_ward:
-            result_sorted["culture_ward2"]=result_sorted[culture_ward]
-        else: 
-            result_sorted["culture_ward2"]=None           
-       
-        column_rename_map = {
-            "No": "번호",
-            culture_id: "등록번호_ID",
-            #"name_initial": "이름_초성",
-            "gender": "성별",
-            "dob": "생년월일",
-            icu_in: "입실일",
-            icu_out: "퇴실일",
-            culture_date: "혈액배양 의뢰일",
-            "culture_result2": "혈액배양 분리균",
-            "KONIS_reported": "KONIS WRAP 등록여부",
-            "KONIS_detail": "KONIS WRAP 상세내용",
-            "culture_ward2": "혈액배양 시행병동",
-            "surv_window": "비고"
-        }
-
-        for col in column_rename_map.keys():
-            if col not in result_sorted.columns:
-                result_sorted[col] = ""
-
-        # 필요한 컬럼만 선택
-        export_df = result_sorted[list(column_rename_map.keys())].rename(columns=column_rename_map) # 기본(외부 타당도 조사용)
-        export_df2 = export_df.copy()
-        insert_loc = export_df2.columns.get_loc("혈액배양 분리균") + 1
-        export_df2.insert(insert_loc, "BSI 분류", "") # 내부 타당도 조사용
-        
-        st.session_state["export_df1"] = export_df  
-        st.session_state["export_df2"] = export_df2  
-        st.session_state["matching_done"] = True
+    match_result = get_result(session, "match") if st.session_state.get("matching_done", False) else None
+    if st.session_state.get("matching_done", False) and match_result is None:
+        st.session_state["matching_done"] = False
+        st.info(f"⌛ {SESSION_IDLE_MINUTES:g}분 이상 사용하지 않아 매칭 결과를 삭제했습니다. 매칭을 다시 실행해 주세요.")
 
     if st.session_state.get("matching_done", False):
+        for message in st.session_state.get("match_warnings", []):
+            st.warning(message)
         st.success("✅ 매칭 완료! 결과 미리보기")
-        st.dataframe(st.session_state["export_df1"], use_container_width=True, hide_index=True)
+
+        # 건수 요약 (매칭할 때 계산해 둔 값)
+        for col, (label, count) in zip(st.columns(len(st.session_state["match_summary"])),
+                                       st.session_state["match_summary"].items()):
+            col.metric(label, f"{count:,}")
+
+        # 미리보기: 비고·KONIS WRAP 등록여부로 거른 결과에서 한 쪽만 화면에 보냄 (전체 결과는 다운로드 파일로 확인)
+        filter_col1, filter_col2, size_col, page_col = st.columns([3, 2, 1, 1])
+        remarks = filter_col1.multiselect("비고", REMARK_LABELS, default=REMARK_LABELS, key="preview_remarks")
+        konis_values = [value for value in ["Y", "N"] if value in match_result["KONIS WRAP 등록여부"].cat.categories]
+        konis = filter_col2.multiselect("KONIS WRAP 등록여부", konis_values, default=konis_values, key="preview_konis")
+        page_size = size_col.selectbox("쪽당 행 수", PREVIEW_PAGE_SIZES, index=1, key="preview_page_size")
+        shown = filter_result(match_result, remarks if len(remarks) < len(REMARK_LABELS) else None,
+                              konis if len(konis) < len(konis_values) else None)
+        pages = page_count(shown, page_size)
+        # 거르기·쪽당 행 수를 바꿔 쪽 수가 줄면 입력값을 마지막 쪽으로 (입력란은 max_value를 넘는 값을 받지 않음)
+        if st.session_state.get("preview_page", 1) > pages:
+            st.session_state["preview_page"] = pages
+        page = page_col.number_input("쪽", min_value=1, max_value=pages, step=1, key="preview_page")
+        page_df, page, pages = page_rows(shown, page, page_size)
+        st.dataframe(result_view(page_df), use_container_width=True, hide_index=True)
+        first = (page - 1) * page_size
+        st.caption(f"{len(shown):,}건 중 {first + min(len(page_df), 1):,}–{first + len(page_df):,}번째 ({page}/{pages}쪽)")
         #st.dataframe(export_df, use_container_width=True)
 
+        export_format = st.radio("📄 다운로드 파일 형식", available_formats(), horizontal=True,
+                                 help="결과가 큰 경우 CSV 또는 Parquet 형식이 더 빠르고 가볍습니다")
+
+        # 다운로드 파일은 매칭 결과·형식마다 한 번만 생성 (새 매칭 실행 시 다시 생성, 두 파일을 공용 프로세스 풀에서 함께 만듦)
+        payloads = get_result(session, "match_payloads") or {}
+        if export_format not in payloads:
+            with st.spinner("다운로드 파일을 만드는 중..."), timed_stage(st.session_state["stage_timings"], "export") as stage:
+                jobs = {view: start_job(export_view, match_result, view, export_format, session=session)
+                        for view in RESULT_VIEWS}
+                payloads[export_format] = {view: wait_job(job) for view, job in jobs.items()}
+                stage["rows"] = len(match_result)
+            put_result(session, "match_payloads", payloads)
+        data1, ext, mime = payloads[export_format]["external"]
+        data2, _, _ = payloads[export_format]["internal"]
+
         # 다운로드 버튼 1
-        output1 = io.BytesIO()
-        with pd.ExcelWriter(output1, engine="openpyxl") as writer:
-            st.session_state["export_df1"].astype({"등록번호_ID": str}).to_excel(writer, index=False)
-        output1.seek(0)
-        st.download_button("📥 결과 다운로드 - 외부 타당도 조사용 (.xlsx)", data=output1,
-                           file_name="matched_result_external.xlsx",
-                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
-
-        output2 = io.BytesIO()
-        with pd.ExcelWriter(output2, engine="openpyxl") as writer:
-            st.session_state["export_df2"].astype({"등록번호_ID": str}).to_excel(writer, index=False)
-        output2.seek(0)
-        st.download_button("📥 결과 다운로드 - 내부 타당도 조사용 (.xlsx)", data=output2,
-                           file_name="matched_result_internal.xlsx",
-                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        st.download_button(f"📥 결과 다운로드 - 외부 타당도 조사용 (.{ext})", data=data1,
+                           file_name=f"matched_result_external.{ext}",
+                           mime=mime)
+
+
+        st.download_button(f"📥 결과 다운로드 - 내부 타당도 조사용 (.{ext})", data=data2,
+                           file_name=f"matched_result_internal.{ext}",
+                           mime=mime)
+        st.caption(f"이 화면에 보관 중인 결과·다운로드 파일: {session_bytes(session) / 1024 ** 2:.1f}MB "
+                   f"({SESSION_IDLE_MINUTES:g}분 동안 사용하지 않으면 삭제)")
+
+        # 단계별 소요시간·메모리 (사이드바에서 측정을 켠 경우)
+        if profile_stages and st.session_state.get("stage_timings"):
+            with st.expander("⏱️ 단계별 소요시간·메모리"):
+                st.dataframe(stage_table(st.session_state["stage_timings"]), hide_index=True)
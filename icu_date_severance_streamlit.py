@@ -2,7 +2,11 @@
 import streamlit as st
 import pandas as pd
 import re
-import io
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from konis_utils import read_columns, timed_stage, memory_tracing, stage_table
+from konis_census import (read_census_files, combine_months, find_admission_blocks, label_census_episodes,
+                          load_census_state, dump_census_state, update_census_episodes)
+from konis_export import available_formats, export_bytes
 
 st.title("환자 입퇴실일 계산기 (세브란스 양식)")
 st.markdown(
@@ -38,91 +42,91 @@ if uploaded_files:
     uploaded_files = sorted(uploaded_files, key=lambda f: extract_year_month(f.name))
 
     # 첫 번째 파일로부터 id 변수 후보 탐색
-    first_df = pd.read_excel(uploaded_files[0])
+    first_cols = read_columns(uploaded_files[0])
     col_candidates = ["연구등록번호", "등록번호", "환자ID", "환자번호", "병록번호","번호","id", "patientid"]
-    default_id_col = find_column(col_candidates, first_df.columns)
+    default_id_col = find_column(col_candidates, first_cols)
 
     # Streamlit에서 사용자 지정 받기
     st.markdown("### 🆔 환자 식별자 컬럼 선택")
     id_column = st.selectbox(
         "환자 식별자에 해당하는 컬럼을 선택하세요:",
-        options=first_df.columns.tolist(),
-        index=first_df.columns.get_loc(default_id_col) if default_id_col in first_df.columns else 0
+        options=first_cols.tolist(),
+        index=first_cols.get_loc(default_id_col) if default_id_col in first_cols else 0
     )
     adm_yn = st.text_input("입원으로 간주할 값을 입력하세요 (예: 1, Y, 입원 등)", value="1")
 
-    all_long = []
-    for file in uploaded_files:
-        filename = file.name
-        try:
-            df = pd.read_excel(file, dtype=str)
-            # 날짜 컬럼: "2025.02.01(토)" 형식
-            date_cols = [col for col in df.columns if re.match(r"\d{4}\.\d{2}\.\d{2}", str(col))]
-            df_long = df.melt(
-                id_vars=[id_column],
-                value_vars=date_cols,
-                var_name="날짜",
-                value_name="재실여부"
+    # 증분 모드: 지난번에 내려받은 상태 파일(입퇴실 구간)을 올리고 이번 달만 읽어서 이어 붙임
+    # 상태 파일은 사용자가 내려받아 보관 (서버에는 저장하지 않음)
+    incremental = st.checkbox("🔗 이전 결과에 이어서 계산 (증분 모드)",
+                              help="이전 달까지 계산해 내려받은 상태 파일을 올리면, 새로 올린 달만 읽어 경계에 걸친 구간을 이어 붙입니다")
+    state_file = None
+    if incremental:
+        state_file = st.file_uploader("이전 상태 파일 (없으면 이번에 올린 파일부터 계산)", type=["json"], key="census_state_file")
+
+    profile_stages = st.sidebar.checkbox("⏱️ 단계별 소요시간·메모리 측정", key="profile_stages",
+                                        help="처리 단계마다 걸린 시간, 행 수, 최대 메모리 사용량을 표시합니다 (측정하는 동안 처리가 조금 느려집니다)")
+    timings = []
+
+    # 월별 파일을 서버 공용 프로세스 풀에서 동시에 읽어 환자 × 날짜 재실 행렬로 변환 (환자 ID와 날짜 컬럼만 읽음)
+    with memory_tracing(profile_stages), timed_stage(timings, "read") as stage:
+        files = [(file.name, file.getvalue()) for file in uploaded_files]
+        months = []
+        for filename, part, error in read_census_files(files, id_column, adm_yn, session=get_script_run_ctx().session_id):
+            if error is not None:
+                st.error(f"{filename} 처리 중 오류 발생: {error}")
+            else:
+                months.append(part)
+        stage["rows"] = sum(len(part[0]) for part in months)
+
+    # 2. 통합 및 정렬 (환자 ID 순, 날짜 순)
+    with memory_tracing(profile_stages), timed_stage(timings, "merge") as stage:
+        ids, dates, present = combine_months(months)
+        stage["rows"] = len(ids)
+
+    # 3~4. 입원 블록 구분 및 입퇴실일 계산 (증분 모드에서는 저장된 구간에 이번 달 구간을 이어 붙임)
+    with memory_tracing(profile_stages), timed_stage(timings, "classify") as stage:
+        if state_file is not None:
+            state = load_census_state(state_file.getvalue(), id_column)
+            try:
+                result, period, skipped = update_census_episodes(state, ids, dates, present, id_column)
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
+            if skipped:
+                st.info(f"상태 파일에 이미 있는 기간의 {skipped}일은 건너뛰었습니다.")
+        else:
+            result = find_admission_blocks(ids, dates, present, id_column)
+            period = (pd.Timestamp(dates.min()), pd.Timestamp(dates.max()))
+        if incremental:
+            st.download_button(
+                label=f"💾 상태 파일 다운로드 ({period[0]:%Y-%m-%d} ~ {period[1]:%Y-%m-%d}, "
+                      f"마지막 날까지 이어지는 구간 {(result['퇴실일'] == period[1]).sum()}개)",
+                data=dump_census_state(id_column, result, period),
+                file_name=f"icu_census_state_{period[1]:%Y%m}.json",
+                mime="application/json",
+                help="다음 달 계산 때 이 파일을 이전 상태 파일로 올리면 새 달만 읽어서 이어 계산합니다"
             )
-            # 날짜 문자열 변환 ("2025.02.01(토)" → datetime)
-            df_long["날짜"] = pd.to_datetime(df_long["날짜"].str.extract(r"(\d{4}\.\d{2}\.\d{2})")[0], format="%Y.%m.%d")
-            df_long["재실여부"] = (df_long["재실여부"].astype(str).str.strip() == adm_yn.strip()).astype(int)
-            all_long.append(df_long)
-        except Exception as e:
-            st.error(f"{filename} 처리 중 오류 발생: {e}")
-
-    # 2. 통합 및 정렬
-    df_all = pd.concat(all_long, ignore_index=True)
-    df_all = df_all.sort_values([id_column, "날짜"])
-    min_date = pd.to_datetime(df_all["날짜"]).min()
-    max_date = pd.to_datetime(df_all["날짜"]).max()
-
-    # 3. 입원 블록 구분
-    def assign_block(df):
-        df = df.copy()
-        df["prev"] = df["재실여부"].shift(fill_value=0)
-        df["new_block"] = (df["재실여부"] == 1) & (df["prev"] == 0)
-        df["block_id"] = df["new_block"].cumsum()
-        return df
-
-    df_grouped = df_all.groupby([id_column]).apply(assign_block).reset_index(drop=True)
-
-    # 4. 입퇴실일 계산
-    result = (
-        df_grouped[df_grouped["재실여부"] == 1]
-        .groupby([id_column, "block_id"])
-        .agg(입실일=("날짜", "min"), 퇴실일=("날짜", "max"))
-        .reset_index()
-        .sort_values([id_column, "입실일"])
-    )
 
-    result["입실일_dt"] = pd.to_datetime(result["입실일"])
-    result["퇴실일_dt"] = pd.to_datetime(result["퇴실일"])
-    result["비고"] = ""
-    result.loc[result["입실일_dt"] == result["퇴실일_dt"], "비고"] = "당일 입퇴실"
-    result.loc[result["입실일_dt"] == min_date, "비고"] = "입실일 확인 필요"
-    result.loc[result["퇴실일_dt"] == max_date, "비고"] = "퇴실일 확인 필요"
-
-    # 5. 컬럼 정리 및 출력
-    result = result[[id_column, "입실일", "퇴실일", "비고"]]
-    result["입실일"] = result["입실일"].dt.strftime('%Y-%m-%d')
-    result["퇴실일"] = result["퇴실일"].dt.strftime('%Y' \
-    '-%m-%d')
+        # 5. 비고 표시, 컬럼 정리 및 출력 (기간 첫날·마지막 날 기준)
+        result = label_census_episodes(result, pd.DatetimeIndex(period), id_column)
+        stage["rows"] = len(result)
     st.success(f"총 {result.shape[0]}개의 입퇴원 구간이 감지되었습니다.")
     st.dataframe(result, hide_index=True)
 
     # 6. 다운로드
-    # 엑셀 형식으로 다운로드용 파일 생성
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        result.to_excel(writer, index=False, sheet_name='입퇴원내역')
-
-    output.seek(0)  # 
-    processed_data = output.getvalue()
+    export_format = st.radio("📄 다운로드 파일 형식", available_formats(), horizontal=True)
+    with memory_tracing(profile_stages), timed_stage(timings, "export") as stage:
+        processed_data, ext, mime = export_bytes(result, export_format, sheet_name='입퇴원내역')
+        stage["rows"] = len(result)
 
     st.download_button(
-        label="입퇴실일 Excel 다운로드 (.xlsx)",
+        label=f"입퇴실일 다운로드 (.{ext})",
         data=processed_data,
-        file_name="입퇴실일_결과.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        file_name=f"입퇴실일_결과.{ext}",
+        mime=mime
     )
+
+    # 단계별 소요시간·메모리 (사이드바에서 측정을 켠 경우)
+    if profile_stages:
+        with st.expander("⏱️ 단계별 소요시간·메모리"):
+            st.dataframe(stage_table(timings), hide_index=True)
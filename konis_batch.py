@@ -0,0 +1,163 @@
+## 여러 기관 일괄 실행 (혈액배양 매칭 + 감염환자 ID 추정)
+## py konis_batch.py manifest.json [--workers 4]
+##
+## manifest.json 예시 (파일 경로는 manifest 파일 위치 기준)
+## {
+##   "out_dir": "batch_results",
+##   "format": "xlsx",
+##   "sites": [
+##     {"site": "A병원",
+##      "matcher": {"culture": "A/혈액배양.xlsx", "icu": "A/입퇴실.xlsx", "bsi": "A/KONIS.xlsx", "profile": "A/matcher_profile.json"},
+##      "who": {"konis": "A/KONIS.xlsx", "icu": "A/입퇴실.xlsx", "culture": "A/혈액배양.xlsx", "profile": "A/who_profile.json"}}
+##   ]
+## }
+##
+## 작업마다 단계별 소요시간·행 수(--trace-memory: 최대 메모리 포함)를 out_dir/batch_log.jsonl에 JSON 한 줄씩 추가
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from konis_utils import open_upload, timed_stage, memory_tracing, stage_log_line
+from konis_export import EXPORT_FORMATS, export_bytes, format_label
+from konis_pipeline import (match_cultures, estimate_ids, load_profile, write_outputs, DEFAULT_WHO_PROFILE,
+                            CULTURE_SOURCE, ICU_SOURCE, BSI_SOURCE, INFO_SOURCE, KONIS_SOURCE)
+
+# manifest 항목 → 입력 파일 구분
+MATCHER_INPUTS = {"culture": CULTURE_SOURCE, "icu": ICU_SOURCE, "bsi": BSI_SOURCE, "info": INFO_SOURCE}
+WHO_INPUTS = {"konis": KONIS_SOURCE, "icu": ICU_SOURCE, "culture": CULTURE_SOURCE}
+
+SUMMARY_COLUMNS = ["기관", "작업", "상태", "결과 행 수", "감시기간 내", "KONIS 등록", "ID 추정", "소요시간(초)", "출력 파일", "오류"]
+# 요약 표의 건수 컬럼 (해당 없는 작업·실패한 작업은 빈 값, 정수로 표시)
+COUNT_COLUMNS = ["결과 행 수", "감시기간 내", "KONIS 등록", "ID 추정"]
+
+
+# 기관 이름을 폴더 이름으로 쓸 수 있게 정리
+def site_folder(site):
+    return re.sub(r'[\\/:*?"<>|]', "_", str(site)).strip() or "site"
+
+
+def _open_inputs(spec, inputs, base_dir):
+    return {name: open_upload(os.path.join(base_dir, spec[key])) for key, name in inputs.items() if spec.get(key)}
+
+
+# 기관 하나의 작업 하나 실행 (프로세스 풀 작업 단위라 모듈 최상위 함수로 둠)
+# 오류가 나도 예외를 밖으로 던지지 않고 요약 행에 기록해서 다른 기관 실행에 영향이 없도록 함
+# 단계별 기록은 row["stages"]로 함께 돌려줌 (실패한 경우 실패 직전 단계까지)
+def run_site_task(site, task, spec, base_dir, out_dir, fmt_label, trace_memory=False):
+    row = {"기관": site, "작업": task, "상태": "성공", "stages": []}
+    timings = row["stages"]
+    started = time.perf_counter()
+    try:
+        site_dir = os.path.join(out_dir, site_folder(site))
+        if task == "matcher":
+            with memory_tracing(trace_memory):
+                outcome = match_cultures(_open_inputs(spec, MATCHER_INPUTS, base_dir),
+                                         load_profile(os.path.join(base_dir, spec["profile"])), timings)
+                with timed_stage(timings, "export") as stage:
+                    paths = write_outputs(outcome, site_dir, fmt_label)
+                    stage["rows"] = len(outcome["result"])
+            result = outcome["result"]
+            row.update({
+                "결과 행 수": len(result),
+                "감시기간 내": int((result["비고"].isna() | (result["비고"] == "")).sum()),
+                "KONIS 등록": int((result["KONIS WRAP 등록여부"] == "Y").sum()),
+                "오류": " / ".join(outcome["warnings"]),
+            })
+        else:
+            with memory_tracing(trace_memory):
+                final = estimate_ids(_open_inputs(spec, WHO_INPUTS, base_dir),
+                                     load_profile(os.path.join(base_dir, spec["profile"]), DEFAULT_WHO_PROFILE), timings)
+                with timed_stage(timings, "export") as stage:
+                    os.makedirs(site_dir, exist_ok=True)
+                    data, ext, _ = export_bytes(final, fmt_label)
+                    paths = [os.path.join(site_dir, f"NICU_감염환자자료_ids.{ext}")]
+                    with open(paths[0], "wb") as f:
+                        f.write(data)
+                    stage["rows"] = len(final)
+            row.update({"결과 행 수": len(final), "ID 추정": int((final["추정ID"] != "").sum())})
+        row["출력 파일"] = "; ".join(paths)
+    except Exception as e:
+        row.update({"상태": "실패", "오류": f"{type(e).__name__}: {e}"})
+        traceback.print_exc(file=sys.stderr)
+    row["소요시간(초)"] = round(time.perf_counter() - started, 2)
+    return row
+
+
+# manifest 읽기 → (기준 폴더, 설정)
+def load_manifest(path):
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if not manifest.get("sites"):
+        raise ValueError("manifest에 sites 항목이 없습니다")
+    return os.path.dirname(os.path.abspath(path)), manifest
+
+
+# 모든 기관·작업을 프로세스 풀에서 동시에 실행하고 요약 표를 반환
+# log_path가 있으면 작업이 끝날 때마다 단계별 기록을 JSON 한 줄로 추가
+def run_batch(manifest, base_dir, out_dir, fmt_label, workers=None, log_path=None, trace_memory=False):
+    tasks = [(site["site"], task, site[task]) for site in manifest["sites"] for task in ["matcher", "who"] if site.get(task)]
+    run_at = datetime.now().isoformat(timespec="seconds")
+    rows = []
+    if log_path:
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_site_task, site, task, spec, base_dir, out_dir, fmt_label, trace_memory): (site, task)
+                   for site, task, spec in tasks}
+        for future in as_completed(futures):
+            site, task = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                # 작업 프로세스 자체가 중단된 경우 (메모리 부족 등)
+                row = {"기관": site, "작업": task, "상태": "실패", "오류": f"{type(e).__name__}: {e}"}
+            print(f"[{row['상태']}] {site} {task} ({row.get('소요시간(초)', '-')}초)", file=sys.stderr)
+            if log_path:
+                with open(log_path, "a", encoding="utf-8") as log:
+                    log.write(stage_log_line(row.get("stages", []), run_at=run_at, site=site, task=task,
+                                             status=row["상태"], seconds=row.get("소요시간(초)"), error=row.get("오류")) + "\n")
+            rows.append(row)
+
+    order = {(site, task): i for i, (site, task, _) in enumerate(tasks)}
+    rows.sort(key=lambda row: order[(row["기관"], row["작업"])])
+    return pd.DataFrame(rows).reindex(columns=SUMMARY_COLUMNS).astype({col: "Int64" for col in COUNT_COLUMNS})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="여러 기관의 혈액배양 매칭·감염환자 ID 추정 일괄 실행")
+    parser.add_argument("manifest", help="기관별 입력 파일과 프로필 목록 (JSON)")
+    parser.add_argument("--workers", type=int, help="동시에 실행할 프로세스 수 (기본: CPU 수)")
+    parser.add_argument("--out-dir", help="결과 저장 폴더 (manifest의 out_dir보다 우선)")
+    parser.add_argument("--format", choices=[ext for ext, _ in EXPORT_FORMATS.values()], help="결과 파일 형식 (기본: xlsx)")
+    parser.add_argument("--log", help="단계별 기록(JSON 한 줄씩)을 추가할 파일 (기본: 결과 폴더의 batch_log.jsonl)")
+    parser.add_argument("--trace-memory", action="store_true", help="단계별 최대 메모리도 기록 (처리가 느려짐)")
+    args = parser.parse_args(argv)
+
+    base_dir, manifest = load_manifest(args.manifest)
+    out_dir = args.out_dir or os.path.join(base_dir, manifest.get("out_dir", "batch_results"))
+    fmt_label = format_label(args.format or manifest.get("format", "xlsx"))
+
+    started = time.perf_counter()
+    log_path = args.log or os.path.join(out_dir, "batch_log.jsonl")
+    summary = run_batch(manifest, base_dir, out_dir, fmt_label, args.workers, log_path, args.trace_memory)
+    data, ext, _ = export_bytes(summary, fmt_label, sheet_name="요약")
+    summary_path = os.path.join(out_dir, f"batch_summary.{ext}")
+    os.makedirs(out_dir, exist_ok=True)
+    with open(summary_path, "wb") as f:
+        f.write(data)
+
+    failed = int((summary["상태"] == "실패").sum())
+    print(f"완료: {len(summary) - failed}건 성공, {failed}건 실패, 전체 {time.perf_counter() - started:.1f}초 → {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+## 일별 재실 명단(센서스)에서 중환자실 입퇴실 구간 계산
+
+import hashlib
+import io
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from konis_jobs import start_job, wait_job
+
+# 날짜 컬럼명 형식: "2025.02.01(토)"
+DATE_COLUMN_PATTERN = r"(\d{4}\.\d{2}\.\d{2})"
+
+# 재실 행렬을 기억해 둘 파일 수 (Streamlit 재실행 때 다시 읽지 않음)
+CENSUS_CACHE_SIZE = 64
+
+
+# 날짜 컬럼명 → 날짜
+def column_dates(date_cols):
+    return pd.to_datetime(pd.Series(date_cols, dtype=str).str.extract(DATE_COLUMN_PATTERN)[0],
+                          format="%Y.%m.%d").to_numpy()
+
+
+# 월별 파일(환자 × 날짜 컬럼)을 재실 여부 행렬로 변환 → (환자 ID, 날짜, 환자 × 날짜 bool 행렬)
+# 셀 값은 고유값 단위로 한 번만 비교하고, 같은 환자가 여러 행에 있으면 하루라도 재실이면 재실
+def presence_matrix(df, id_column, date_cols, adm_yn):
+    df = df[df[id_column].notna()]
+    codes, uniques = pd.factorize(df[date_cols].to_numpy(dtype=object).ravel(), use_na_sentinel=True)
+    hit = np.array([str(val).strip() == adm_yn.strip() for val in uniques] + [str(np.nan) == adm_yn.strip()])
+    present = hit[codes].reshape(len(df), len(date_cols))
+
+    present = pd.DataFrame(present, index=df[id_column].to_numpy()).groupby(level=0, sort=False).max()
+    return present.index.to_numpy(), column_dates(date_cols), present.to_numpy()
+
+
+# 여러 달의 재실 행렬을 환자 ID 기준으로 합쳐 하나의 행렬로 (환자 ID 순, 날짜 순)
+def combine_months(parts):
+    ids = pd.Index(np.concatenate([part[0] for part in parts])).unique().sort_values()
+    dates = np.unique(np.concatenate([part[1] for part in parts]))
+    present = np.zeros((len(ids), len(dates)), dtype=bool)
+    for part_ids, part_dates, part_present in parts:
+        rows = ids.get_indexer(part_ids)
+        cols = np.searchsorted(dates, part_dates)
+        present[np.ix_(rows, cols)] |= part_present
+    return ids.to_numpy(), dates, present
+
+
+# 연속 재실 구간(입원 블록) 찾기
+# 환자 × 날짜 행렬의 양 끝에 빈 날을 붙이고 날짜 방향 차분으로 구간 시작(+1)과 종료 다음날(-1) 위치를 찾음
+# (argwhere 결과는 환자 순 → 날짜 순이라 시작과 종료가 같은 순서로 짝지어짐)
+def find_admission_blocks(ids, dates, present, id_column):
+    edges = np.diff(np.pad(present.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    starts = np.argwhere(edges == 1)
+    ends = np.argwhere(edges == -1)
+    return pd.DataFrame({
+        id_column: ids[starts[:, 0]],
+        "입실일": dates[starts[:, 1]],
+        "퇴실일": dates[ends[:, 1] - 1],
+    })
+
+
+# 입퇴실 구간에 비고 표시 후 출력 형태로 (dates: 전체 계산 기간의 날짜)
+# 기간 첫날 입실 / 마지막 날 퇴실인 구간은 앞뒤 달 자료가 없어 확인 필요
+def label_census_episodes(episodes, dates, id_column):
+    min_date = pd.Timestamp(dates.min())
+    max_date = pd.Timestamp(dates.max())
+    result = episodes.copy()
+    result["비고"] = ""
+    result.loc[result["입실일"] == result["퇴실일"], "비고"] = "당일 입퇴실"
+    result.loc[result["입실일"] == min_date, "비고"] = "입실일 확인 필요"
+    result.loc[result["퇴실일"] == max_date, "비고"] = "퇴실일 확인 필요"
+
+    result = result[[id_column, "입실일", "퇴실일", "비고"]]
+    result["입실일"] = result["입실일"].dt.strftime('%Y-%m-%d')
+    result["퇴실일"] = result["퇴실일"].dt.strftime('%Y-%m-%d')
+    return result
+
+
+# 센서스 파일 하나를 읽어 재실 행렬로 변환 (공용 프로세스 풀 작업 단위라 모듈 최상위 함수로 둠)
+# 환자 ID와 날짜 컬럼만 읽음
+def read_census_file(data, filename, id_column, adm_yn):
+    def usecols(col):
+        return col == id_column or re.match(DATE_COLUMN_PATTERN, str(col)) is not None
+
+    if filename.lower().endswith(".csv"):
+        df = pd.read_csv(io.BytesIO(data), dtype=str, usecols=usecols)
+    else:
+        df = pd.read_excel(io.BytesIO(data), dtype=str, usecols=usecols)
+    date_cols = [col for col in df.columns if col != id_column]
+    return presence_matrix(df, id_column, date_cols, adm_yn)
+
+
+_census_cache = OrderedDict()
+_census_lock = threading.Lock()
+
+
+# 월별 센서스 파일 여러 개를 서버 공용 프로세스 풀(konis_jobs)에서 동시에 읽기
+# files: [(파일명, 파일 내용)] → 같은 순서로 [(파일명, 재실 행렬 또는 None, 오류 또는 None)]
+# session: 공용 풀 대기열 순서를 나눌 세션 ID (동시 실행 수는 풀 크기 POOL_WORKERS로 제한)
+# 이미 읽은 파일(내용, ID 컬럼, 재실 표시값이 같음)은 캐시에서 가져오고, 새로 읽을 파일이 하나뿐이면 현재 프로세스에서 읽음
+def read_census_files(files, id_column, adm_yn, session=None):
+    keys = [(hashlib.sha256(data).hexdigest(), id_column, adm_yn) for _, data in files]
+    results = {}
+    with _census_lock:
+        for key in keys:
+            if key in _census_cache:
+                _census_cache.move_to_end(key)
+                results[key] = (_census_cache[key], None)
+
+    misses = {key: (filename, data) for key, (filename, data) in zip(keys, files) if key not in results}
+    if len(misses) > 1:
+        jobs = {key: start_job(read_census_file, data, filename, id_column, adm_yn, session=session)
+                for key, (filename, data) in misses.items()}
+        for key, job in jobs.items():
+            try:
+                results[key] = (wait_job(job), None)
+            except Exception as e:
+                results[key] = (None, e)
+    else:
+        for key, (filename, data) in misses.items():
+            try:
+                results[key] = (read_census_file(data, filename, id_column, adm_yn), None)
+            except Exception as e:
+                results[key] = (None, e)
+
+    with _census_lock:
+        for key in misses:
+            part, error = results[key]
+            if error is None:
+                _census_cache[key] = part
+        while len(_census_cache) > CENSUS_CACHE_SIZE:
+            _census_cache.popitem(last=False)
+
+    return [(filename, *results[key]) for key, (filename, _) in zip(keys, files)]
+
+
+# 증분 모드 상태 읽기 (data: 사용자가 내려받아 두었다가 다시 올린 상태 파일 내용)
+# → {"episodes": 입퇴실 구간, "period": (첫날, 마지막 날)}
+def load_census_state(data, id_column):
+    state = json.loads(data)
+    episodes = pd.DataFrame(state["episodes"], columns=[id_column, "입실일", "퇴실일"])
+    episodes[id_column] = episodes[id_column].astype(object)
+    episodes["입실일"] = pd.to_datetime(episodes["입실일"], format="%Y-%m-%d")
+    episodes["퇴실일"] = pd.to_datetime(episodes["퇴실일"], format="%Y-%m-%d")
+    start, end = pd.to_datetime(state["period"], format="%Y-%m-%d")
+    return {"episodes": episodes, "period": (start, end)}
+
+
+# 증분 모드 상태 파일 내용 (JSON bytes, 화면에서 내려받아 다음 달 계산 때 다시 올림)
+# 전체 입퇴실 구간과 계산 기간, 기간 마지막 날까지 이어지는(다음 달과 이어 붙일) 구간 수
+def dump_census_state(id_column, episodes, period):
+    def day(values):
+        return pd.Series(values).dt.strftime("%Y-%m-%d").tolist()
+
+    state = {
+        "id_column": id_column,
+        "period": day(list(period)),
+        "open_episodes": int((episodes["퇴실일"] == period[1]).sum()),
+        "episodes": [list(row) for row in zip(episodes[id_column].tolist(), day(episodes["입실일"]), day(episodes["퇴실일"]))],
+    }
+    return json.dumps(state, ensure_ascii=False).encode("utf-8")
+
+
+# 앞 기간의 구간과 바로 다음 날부터 시작하는 뒤 기간의 구간을 경계에서 이어 붙이기
+# 앞 기간 마지막 날(last_day)까지 재실한 구간과 뒤 기간 첫날에 시작한 구간만 환자 ID로 맞춰 하나로 합침
+def stitch_episodes(before, after, id_column, last_day):
+    open_rows = before[before["퇴실일"] == last_day]
+    next_rows = after[after["입실일"] == last_day + pd.Timedelta(days=1)]
+    joined = open_rows.reset_index().merge(next_rows.reset_index(), on=id_column, suffixes=("_before", "_after"))
+    merged = pd.DataFrame({
+        id_column: joined[id_column],
+        "입실일": joined["입실일_before"],
+        "퇴실일": joined["퇴실일_after"],
+    })
+    return pd.concat([before.drop(index=joined["index_before"]), after.drop(index=joined["index_after"]), merged],
+                     ignore_index=True)
+
+
+# 증분 모드: 저장된 구간에 이번에 읽은 달의 구간을 이어 붙임 (ids, dates, present: 이번에 읽은 달의 재실 행렬)
+# 이번 파일 중 저장된 기간 앞뒤의 날짜만 구간을 계산하고, 기간 경계에 걸린 구간만 이어 붙임
+# (이미 저장된 기간의 날짜는 건너뜀, 저장된 기간과 이어지지 않는 날짜가 있으면 ValueError)
+# → (입퇴실 구간, (첫날, 마지막 날), 건너뛴 날짜 수)
+def update_census_episodes(state, ids, dates, present, id_column):
+    start, end = state["period"]
+    episodes = state["episodes"]
+    earlier = dates < np.datetime64(start)
+    later = dates > np.datetime64(end)
+    if (earlier.any() and pd.Timestamp(dates[earlier].max()) + pd.Timedelta(days=1) != start) or \
+            (later.any() and pd.Timestamp(dates[later].min()) != end + pd.Timedelta(days=1)):
+        raise ValueError(f"상태 파일 기간({start:%Y-%m-%d} ~ {end:%Y-%m-%d})과 이어지지 않는 날짜가 있습니다. "
+                         "사이에 빠진 달의 파일을 함께 올려 주세요.")
+    if earlier.any():
+        before = find_admission_blocks(ids, dates[earlier], present[:, earlier], id_column)
+        episodes = stitch_episodes(before, episodes, id_column, start - pd.Timedelta(days=1))
+        start = pd.Timestamp(dates[earlier].min())
+    if later.any():
+        after = find_admission_blocks(ids, dates[later], present[:, later], id_column)
+        episodes = stitch_episodes(episodes, after, id_column, end)
+        end = pd.Timestamp(dates[later].max())
+    episodes = episodes.sort_values([id_column, "입실일"], kind="stable", ignore_index=True)
+    return episodes, (start, end), int((~earlier & ~later).sum())
@@ -0,0 +1,82 @@
+## 결과 파일 내보내기 (xlsx / csv / parquet)
+
+import io
+from importlib.util import find_spec
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# 화면에 보이는 형식 이름 → (확장자, MIME)
+EXPORT_FORMATS = {
+    "Excel (.xlsx)": ("xlsx", XLSX_MIME),
+    "CSV (.csv)": ("csv", "text/csv"),
+    "Parquet (.parquet)": ("parquet", "application/octet-stream"),
+}
+
+# parquet 저장에는 pyarrow 또는 fastparquet이 필요
+PARQUET_AVAILABLE = find_spec("pyarrow") is not None or find_spec("fastparquet") is not None
+
+
+# 확장자(xlsx, csv, parquet) → 형식 이름
+def format_label(ext):
+    for label, (fmt_ext, _) in EXPORT_FORMATS.items():
+        if fmt_ext == ext:
+            return label
+    raise ValueError(f"지원하지 않는 파일 형식입니다: {ext}")
+
+
+# 선택 가능한 다운로드 형식
+def available_formats():
+    return [label for label, (ext, _) in EXPORT_FORMATS.items() if ext != "parquet" or PARQUET_AVAILABLE]
+
+
+# DataFrame을 엑셀(.xlsx) 파일 내용(bytes)으로 변환
+# openpyxl write-only 모드로 행을 순서대로 흘려 쓰기 때문에 셀 객체 전체를 메모리에 두지 않음
+def to_xlsx_bytes(df, sheet_name="Sheet1"):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+
+    header_font = Font(bold=True)
+    header = []
+    for col in df.columns:
+        cell = WriteOnlyCell(ws, value=str(col))
+        cell.font = header_font
+        header.append(cell)
+    ws.append(header)
+
+    # 결측값(NaN, NaT, None)은 빈 셀로
+    columns = [df.iloc[:, i].astype(object).where(df.iloc[:, i].notna(), None) for i in range(df.shape[1])]
+    for row in zip(*columns):
+        ws.append(row)
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# CSV (엑셀에서 한글이 깨지지 않도록 BOM 포함 UTF-8)
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+
+# Parquet (문자열 컬럼은 문자열 타입으로 통일해서 저장)
+def to_parquet_bytes(df):
+    object_cols = {col: "string" for col, dtype in df.dtypes.items() if dtype == object}
+    output = io.BytesIO()
+    df.astype(object_cols).to_parquet(output, index=False)
+    return output.getvalue()
+
+
+# 선택한 형식으로 변환 → (파일 내용, 확장자, MIME)
+def export_bytes(df, fmt_label, sheet_name="Sheet1"):
+    ext, mime = EXPORT_FORMATS[fmt_label]
+    if ext == "csv":
+        data = to_csv_bytes(df)
+    elif ext == "parquet":
+        data = to_parquet_bytes(df)
+    else:
+        data = to_xlsx_bytes(df, sheet_name=sheet_name)
+    return data, ext, mime
@@ -0,0 +1,267 @@
+## 매칭 작업을 서버 공용 프로세스 풀에서 실행 (Streamlit 화면이 멈추지 않고, 위젯 변경으로 재실행되어도 작업이 이어짐)
+##
+## job = start_job(match_cultures, files, profile, session=세션 ID, stages=MATCH_STAGES)
+## st.session_state["match_job"] = job   # 재실행 사이에 작업 상태 보관
+## job_progress(job) → (진행률 0~1, 안내 문구) / cancel_job(job) / job["status"], job["result"]
+##
+## 한 서버의 모든 사용자가 프로세스 풀 하나(최대 POOL_WORKERS개 동시 실행)를 함께 씀
+##  - 무거운 pandas 처리(파일 읽기, 날짜 처리, 병합, 파일 만들기)가 Streamlit 서버 프로세스의 GIL을 잡지 않음
+##  - 빈 자리가 없으면 대기열에 넣고("queued"), 실행 중인 작업이 적고 오래 차례를 받지 못한 세션부터
+##    하나씩 꺼내 한 사용자가 풀을 독차지하지 않음
+
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from konis_utils import memory_tracing
+
+# 동시에 실행할 최대 프로세스 수 (환경변수 KONIS_POOL_WORKERS로 변경)
+POOL_WORKERS = int(os.environ.get("KONIS_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+# 작업 상태
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# 화면에 표시할 단계 이름
+STAGE_LABELS = {
+    "read": "파일 읽기",
+    "keys": "환자 ID 정리",
+    "parse": "날짜 처리",
+    "store": "로컬 저장소 동기화",
+    "merge": "병합",
+    "konis": "KONIS 등록여부 확인",
+    "classify": "결과 정리",
+    "estimate": "ID 추정",
+    "export": "파일 만들기",
+}
+
+# 엔진별 단계 순서 (진행률 계산용)
+MATCH_STAGES = ["read", "keys", "parse", "merge", "konis", "classify"]
+ESTIMATE_STAGES = ["read", "keys", "parse", "merge", "estimate"]
+
+
+# 로컬 저장소를 쓰는 작업의 단계 순서 (날짜 처리 다음에 저장소 동기화)
+def store_stages(stages):
+    position = stages.index("parse") + 1
+    return stages[:position] + ["store"] + stages[position:]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# 단계 기록 list (작업 프로세스 안에서 사용)
+# 단계가 끝나 기록이 추가될 때마다 서버 쪽 진행 상황(progress)에도 복사하고,
+# 취소 요청을 확인해 다음 단계로 넘어가지 않음
+class _JobTimings(list):
+    def __init__(self, cancel_event, progress):
+        super().__init__()
+        self.cancel_event = cancel_event
+        self.progress = progress
+
+    def append(self, record):
+        super().append(record)
+        self.progress.append(record)
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+
+# 작업 프로세스에서 실행 (프로세스 풀 작업 단위라 모듈 최상위 함수로 둠) → (결과, 단계 기록)
+# 단계 순서를 지정한 작업만 func(..., timings=...)로 단계를 기록
+def _run_in_worker(func, args, kwargs, cancel_event, progress, record_stages, trace_memory):
+    if cancel_event.is_set():
+        raise JobCancelled()
+    timings = _JobTimings(cancel_event, progress)
+    with memory_tracing(trace_memory):
+        if record_stages:
+            result = func(*args, timings=timings, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+    return result, list(timings)
+
+
+_pool = None
+_manager = None
+_waiting = OrderedDict()  # 세션 → 대기 중인 작업 deque
+_running = 0
+_session_running = Counter()  # 세션 → 실행 중인 작업 수
+_session_served = {}  # 세션 → 마지막으로 작업을 꺼낸 순번
+_served = 0
+_lock = threading.RLock()
+
+
+# 공용 프로세스 풀 (처음 작업을 넣을 때 생성, 작업 프로세스가 비정상 종료되어 풀이 깨지면 다시 생성)
+# Streamlit 서버는 여러 스레드가 도는 프로세스라 fork 대신 spawn으로 작업 프로세스를 만듦
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=get_context("spawn"))
+    return _pool
+
+
+# 작업 프로세스와 진행 상황·취소 요청을 주고받을 공유 객체 관리자
+def _get_manager():
+    global _manager
+    if _manager is None:
+        _manager = get_context("spawn").Manager()
+    return _manager
+
+
+# 다음에 작업을 꺼낼 세션: 실행 중인 작업이 가장 적은 세션 (같으면 마지막으로 차례를 받은 지 오래된 세션)
+def _next_session(waiting, running, served):
+    return min(waiting, key=lambda session: (running[session], served.get(session, -1)))
+
+
+# 빈 자리만큼 대기열에서 작업을 꺼내 실행
+def _dispatch():
+    global _served
+    with _lock:
+        while _running < POOL_WORKERS and _waiting:
+            session = _next_session(_waiting, _session_running, _session_served)
+            queue = _waiting[session]
+            job = queue.popleft()
+            if not queue:
+                del _waiting[session]
+            if job["status"] == JOB_QUEUED:
+                _served += 1
+                _session_served[session] = _served
+                _submit(job)
+
+
+def _submit(job):
+    global _running, _pool
+    call = job.pop("call")
+    try:
+        future = _get_pool().submit(_run_in_worker, *call, job["cancel_event"], job["timings"],
+                                    bool(job["stages"]), job["trace_memory"])
+    except BrokenProcessPool:
+        _pool = None
+        future = _get_pool().submit(_run_in_worker, *call, job["cancel_event"], job["timings"],
+                                    bool(job["stages"]), job["trace_memory"])
+    job.update(status=JOB_RUNNING, started=time.time())
+    _running += 1
+    _session_running[job["session"]] += 1
+    future.add_done_callback(lambda future: _finish(job, future))
+
+
+def _finish(job, future):
+    global _running, _pool
+    try:
+        result, timings = future.result()
+        job.update(result=result, timings=timings, status=JOB_DONE)
+    except JobCancelled:
+        job.update(timings=list(job["timings"]), status=JOB_CANCELLED)
+    except BrokenProcessPool as e:
+        with _lock:
+            _pool = None
+        job.update(timings=list(job["timings"]), error=e, status=JOB_FAILED)
+    except Exception as e:
+        job.update(timings=list(job["timings"]), error=e, status=JOB_FAILED)
+    job["finished"] = time.time()
+    job["done_event"].set()
+    with _lock:
+        _running -= 1
+        _session_running[job["session"]] -= 1
+        if not _session_running[job["session"]]:
+            del _session_running[job["session"]]
+            if job["session"] not in _waiting:
+                _session_served.pop(job["session"], None)
+    _dispatch()
+
+
+# 엔진 함수(func(..., timings=...))를 공용 프로세스 풀 대기열에 넣음 → 작업 정보 dict
+# 인자와 결과는 작업 프로세스로 복사되므로 pickle 가능한 값이어야 함 (업로드 파일은 copy_upload로 복사해서 전달)
+# session: 대기열 순서를 나눌 세션 ID / stages: 진행률 계산에 쓸 단계 순서 (없으면 timings를 넘기지 않음)
+# trace_memory: 단계별 최대 메모리도 기록
+def start_job(func, *args, session=None, stages=(), trace_memory=False, **kwargs):
+    with _lock:
+        manager = _get_manager()
+        job = {
+            "status": JOB_QUEUED,
+            "session": session,
+            "stages": list(stages),
+            "timings": manager.list(),
+            "cancel_event": manager.Event(),
+            "done_event": threading.Event(),
+            "trace_memory": trace_memory,
+            "call": (func, args, kwargs),
+            "result": None,
+            "error": None,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+        }
+        _waiting.setdefault(session, deque()).append(job)
+    _dispatch()
+    return job
+
+
+# 작업이 끝날 때까지 기다려 결과 반환 (실패하면 작업의 예외를 그대로 발생)
+def wait_job(job):
+    job["done_event"].wait()
+    if job["status"] == JOB_FAILED:
+        raise job["error"]
+    if job["status"] == JOB_CANCELLED:
+        raise JobCancelled()
+    return job["result"]
+
+
+# 취소 요청 (대기 중이면 바로 취소, 실행 중이면 진행 중인 단계가 끝나면 중단)
+def cancel_job(job):
+    with _lock:
+        job["cancel_event"].set()
+        if job["status"] == JOB_QUEUED:
+            job.update(status=JOB_CANCELLED, finished=time.time())
+            job.pop("call", None)
+            job["done_event"].set()
+
+
+def job_running(job):
+    return job is not None and job["status"] in (JOB_QUEUED, JOB_RUNNING)
+
+
+# 대기 중인 작업의 순번 (1 = 다음 차례), 지금 실행 중인 작업이 끝나지 않는다고 보고 _dispatch와 같은 순서로 셈
+def queue_position(job):
+    with _lock:
+        waiting = {session: deque(queued for queued in queue if queued["status"] == JOB_QUEUED)
+                   for session, queue in _waiting.items()}
+        running = Counter(_session_running)
+        served = dict(_session_served)
+        tick = _served
+    waiting = {session: queue for session, queue in waiting.items() if queue}
+    position = 0
+    while waiting:
+        session = _next_session(waiting, running, served)
+        position += 1
+        if waiting[session].popleft() is job:
+            return position
+        running[session] += 1
+        tick += 1
+        served[session] = tick
+        if not waiting[session]:
+            del waiting[session]
+    return None
+
+
+# 진행률과 안내 문구 (끝난 단계 수 / 전체 단계 수, 지금 진행 중인 단계 또는 대기 순번)
+def job_progress(job):
+    if job["status"] == JOB_QUEUED:
+        waited = time.time() - job["submitted"]
+        return 0.0, f"대기 중: 앞선 작업이 끝나면 시작합니다 ({queue_position(job) or '-'}번째) … {waited:.0f}초"
+    done = len(job["timings"])
+    total = max(len(job["stages"]), done, 1)
+    elapsed = (job["finished"] or time.time()) - (job["started"] or job["submitted"])
+    if job["status"] != JOB_RUNNING:
+        return 1.0, f"{elapsed:.1f}초"
+    current = job["stages"][done] if done < len(job["stages"]) else None
+    label = STAGE_LABELS.get(current, current or "마무리")
+    if job["cancel_event"].is_set():
+        label += " (취소 중)"
+    return done / total, f"{min(done + 1, total)}/{total} 단계: {label} … {elapsed:.0f}초"
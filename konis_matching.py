@@ -0,0 +1,189 @@
+## 매칭 단계별 계산 함수 (Streamlit 화면 코드와 분리)
+
+import numpy as np
+import pandas as pd
+
+# 감염발생일 이후 혈액배양을 시행한 기간 (일)
+KONIS_WINDOW_DAYS = 2
+# 한 혈액배양에 표시할 KONIS 등록 후보 수
+KONIS_TOP_N = 3
+
+
+# "LCBI 1" 형식으로 표시 (숫자가 없으면 빈칸)
+def format_lcbi(series):
+    lcbi = series.astype(str).str.extract(r'(\d+)')[0]
+    lcbi = lcbi.where(lcbi.notna(), "")
+    return lcbi.where(lcbi == "", "LCBI " + lcbi)
+
+
+# KONIS 등록여부 병합
+# 환자 ID가 같고 감염발생일 ≤ 혈액배양 의뢰일 ≤ 감염발생일 + 2일인 등록 건을
+# 환자 ID 기준 병합 한 번으로 찾고, 등록 파일 순서대로 최대 3건을 "OR"로 연결
+def match_konis_registrations(result, bsi_df, culture_id, culture_date,
+                              bsi_id_col, bsi_date, bsi_pathogen, bsi_lcbi=None):
+    bsi_col = [bsi_id_col, bsi_date, bsi_pathogen] + ([bsi_lcbi] if bsi_lcbi else [])
+    bsi = bsi_df[bsi_col].drop_duplicates().reset_index(drop=True)
+    bsi = pd.DataFrame({
+        "key_id": bsi[bsi_id_col],
+        "bsi_day": pd.to_datetime(bsi[bsi_date], errors="coerce"),
+        "bsi_order": bsi.index,
+        "detail": (
+            pd.to_datetime(bsi[bsi_date], errors="coerce").dt.strftime("%y%m%d").astype(str) + " "
+            + bsi[bsi_pathogen].astype(str) + " "
+            + (format_lcbi(bsi[bsi_lcbi]) if bsi_lcbi else "")
+        ),
+    })
+    bsi = bsi[bsi["key_id"].notna() & bsi["bsi_day"].notna()]
+
+    # 같은 (ID, 의뢰일) 조합은 한 번만 계산
+    keys = pd.DataFrame({
+        "key_id": result[culture_id].to_numpy(),
+        "culture_day": pd.to_datetime(result[culture_date], errors="coerce").dt.normalize().to_numpy(),
+    })
+    distinct = keys.drop_duplicates().dropna()
+
+    pairs = distinct.merge(bsi, on="key_id", how="inner")
+    pairs = pairs[
+        (pairs["bsi_day"] <= pairs["culture_day"]) &  ## 감염발생일 이후에 컬처 시행
+        (pairs["bsi_day"] + pd.Timedelta(days=KONIS_WINDOW_DAYS) >= pairs["culture_day"])  ## 감염발생일 2일 이내 컬처 시행
+    ]
+    pairs = pairs.sort_values(["key_id", "culture_day", "bsi_order"], kind="stable")
+    top = pairs.groupby(["key_id", "culture_day"], sort=False).head(KONIS_TOP_N)
+    detail = top.groupby(["key_id", "culture_day"], sort=False)["detail"].agg(" OR ".join)
+
+    found = keys.merge(detail.reset_index(), on=["key_id", "culture_day"], how="left")["detail"]
+    return pd.DataFrame({
+        "KONIS_reported": found.notna().map({True: "Y", False: "N"}).to_numpy(),
+        "KONIS_detail": found.fillna("").to_numpy(),
+    }, index=result.index)
+
+
+# 감염환자 기록지 ID 추정
+# 성별, 생년월일, 중환자실 입원일이 같고 감염발생일 ≤ 혈액배양 시행일 ≤ 감염발생일 + 2일인
+# 혈액배양을 세 값을 키로 하는 병합 한 번으로 찾음
+# 증례마다 (ID, 분리균) 후보를 최대 3개까지, 후보가 없으면 빈 행 하나를 반환
+def estimate_case_ids(cases, merged3, caseno, gender1, dob1, date_icu1, date_infection,
+                      birth_col, id3, result_culture):
+    keys = ["key_gender", "key_dob", "key_icu"]
+    left = pd.DataFrame({
+        "case_pos": range(len(cases)),
+        "key_gender": cases[gender1].to_numpy(),
+        "key_dob": cases[dob1].to_numpy(),
+        "key_icu": cases[date_icu1].to_numpy(),
+        "infection_day": pd.to_datetime(cases[date_infection], errors="coerce").to_numpy(),
+    })
+    right = pd.DataFrame({
+        "cand_pos": range(len(merged3)),
+        "key_gender": merged3["gender"].to_numpy(),
+        "key_dob": merged3[birth_col].to_numpy(),
+        "key_icu": merged3["icu_in_day"].to_numpy(),
+        "culture_day": pd.to_datetime(merged3["culture_date_day"], errors="coerce").to_numpy(),
+        "추정ID": merged3[id3].to_numpy(),
+        "추정ID분리균": merged3[result_culture].to_numpy(),
+    })
+    # 결측 키는 어떤 값과도 일치하지 않음 (성별은 파일마다 범주가 달라 문자열로 비교, 날짜는 datetime64 그대로)
+    left = left.dropna(subset=keys).astype({"key_gender": object})
+    right = right.dropna(subset=keys).astype({"key_gender": object})
+
+    pairs = left.merge(right, on=keys, how="inner")
+    pairs = pairs[
+        (pairs["culture_day"] >= pairs["infection_day"]) &
+        (pairs["culture_day"] <= pairs["infection_day"] + pd.Timedelta(days=KONIS_WINDOW_DAYS))
+    ]
+    pairs = pairs.sort_values(["case_pos", "cand_pos"], kind="stable")
+    pairs = pairs.drop_duplicates(subset=["case_pos", "추정ID", "추정ID분리균"])
+    top = pairs.groupby("case_pos", sort=False).head(KONIS_TOP_N)[["case_pos", "추정ID", "추정ID분리균"]]
+
+    result = pd.DataFrame({"case_pos": range(len(cases)), caseno: cases[caseno].to_numpy()})
+    result = result.merge(top, on="case_pos", how="left")
+    missing = ~result["case_pos"].isin(top["case_pos"])
+    # 추정ID는 환자 코드(정수)라 빈 문자열을 넣기 전에 object로 바꿈 (후보 없는 증례는 빈 값)
+    result = result.astype({"추정ID": object, "추정ID분리균": object})
+    result.loc[missing, ["추정ID", "추정ID분리균"]] = ""
+    return result.drop(columns=["case_pos"])
+
+
+# 감시기간: 입실 2일째(입실일 + 2일)부터 퇴실 다음날(퇴실일 + 1일)까지
+SURV_START_DAYS = 2
+SURV_END_DAYS = 1
+
+# (환자 코드, 날짜) 정렬 키에서 환자 코드 하나가 차지하는 날짜 범위
+_DAY_SPAN = 10_000_000
+
+
+# (환자 코드, 날짜)를 하나의 정수 정렬 키로 변환
+def _patient_day_key(codes, days):
+    day_number = days.to_numpy().astype("datetime64[D]").astype(np.int64)
+    return codes * _DAY_SPAN + np.where(pd.isna(days).to_numpy(), 0, day_number + _DAY_SPAN // 2)
+
+
+# 혈액배양별 중환자실 입실 구간 배정
+# 환자별로 입실일 순으로 정렬한 입실 구간에서 의뢰일 직전 입실 구간을 이진 탐색으로 찾아
+# 혈액배양마다 관련 입실 구간 하나만 붙임 (혈액배양 × 입실 구간 전체 병합을 만들지 않음)
+#  - 직전 입실 구간 또는 그 앞 구간의 감시기간 안 → 비고 없음
+#  - 직전 입실 구간의 감시기간 시작 전 → 감시기간 이전
+#  - 직전 입실 구간의 감시기간 종료 후 → 감시기간 이후
+#  - 첫 입실 전에 시행 → 첫 입실 구간, 감시기간 이전
+#  - 입실 기록 없음 → 시행부서 확인
+def assign_icu_episodes(culture_df, icu_df, culture_id, culture_date, icu_id, icu_in, icu_out):
+    episodes = icu_df[[icu_id, icu_in, icu_out]].copy()
+    episodes["in_day"] = pd.to_datetime(episodes[icu_in], errors="coerce").dt.normalize()
+    episodes["out_day"] = pd.to_datetime(episodes[icu_out], errors="coerce").dt.normalize()
+    episodes = episodes[episodes[icu_id].notna() & episodes["in_day"].notna()]
+
+    # 환자 ID를 두 파일 공통의 정수 코드로 바꾸고 (코드, 입실일) 순으로 정렬
+    codes, _ = pd.factorize(pd.concat([culture_df[culture_id], episodes[icu_id]], ignore_index=True))
+    culture_code = codes[:len(culture_df)]
+    episodes["code"] = codes[len(culture_df):]
+    episodes = episodes.sort_values(["code", "in_day", "out_day"], kind="stable").reset_index(drop=True)
+    # 끝에 빈 구간 하나를 두어 "구간 없음"(-1)도 같은 방식으로 조회
+    sentinel = len(episodes)
+    episodes.loc[sentinel, "code"] = -1
+    episodes["code"] = episodes["code"].astype(np.int64)
+
+    ep_code = episodes["code"].to_numpy()
+    ep_start = (episodes["in_day"] + pd.Timedelta(days=SURV_START_DAYS)).to_numpy()
+    ep_end = (episodes["out_day"] + pd.Timedelta(days=SURV_END_DAYS)).to_numpy()
+    ep_key = _patient_day_key(ep_code[:sentinel], episodes["in_day"][:sentinel])
+
+    culture_day = pd.to_datetime(culture_df[culture_date], errors="coerce").dt.normalize()
+    c_day = culture_day.to_numpy()
+    has_day = culture_day.notna().to_numpy()
+    c_key = _patient_day_key(culture_code, culture_day)
+
+    def same_patient(pos):
+        pos = np.where((pos >= 0) & (pos < sentinel), pos, sentinel)
+        return np.where((ep_code[pos] == culture_code) & (culture_code >= 0), pos, sentinel)
+
+    # 의뢰일 이전 마지막 입실 구간, 그 앞 구간, 환자의 첫 입실 구간
+    last = same_patient(np.searchsorted(ep_key, c_key, side="right") - 1)
+    last = np.where(has_day, last, sentinel)
+    prev = np.where(last < sentinel, same_patient(last - 1), sentinel)
+    first = same_patient(np.searchsorted(ep_key, culture_code * _DAY_SPAN, side="left"))
+
+    def in_window(pos):
+        return (pos < sentinel) & (c_day >= ep_start[pos]) & ((c_day <= ep_end[pos]) | pd.isna(ep_end[pos]))
+
+    matched_last = in_window(last)
+    matched_prev = in_window(prev) & ~matched_last
+    chosen = np.select([matched_last, matched_prev, last < sentinel], [last, prev, last], default=first)
+
+    surv_window = np.full(len(culture_df), None, dtype=object)
+    surv_window[first == sentinel] = "시행부서 확인"
+    before = (last < sentinel) & ~matched_last & ~matched_prev & (c_day < ep_start[last])
+    after = (last < sentinel) & ~matched_last & ~matched_prev & ~before
+    surv_window[before | ((last == sentinel) & (first < sentinel) & has_day)] = "감시기간 이전"
+    surv_window[after] = "감시기간 이후"
+
+    picked = episodes.iloc[chosen].reset_index(drop=True)
+    merged = culture_df.reset_index(drop=True)
+    for col in dict.fromkeys([icu_id, icu_in, icu_out]):
+        if col != culture_id:
+            merged[col] = picked[col].to_numpy()
+    merged["culture_date_day"] = c_day
+    merged["icu_in_day"] = picked["in_day"].to_numpy()
+    merged["icu_out_day"] = picked["out_day"].to_numpy()
+    merged["icu_day_start"] = ep_start[chosen]
+    merged["icu_day_end"] = ep_end[chosen]
+    merged["surv_window"] = surv_window
+    return merged
@@ -0,0 +1,657 @@
+## 혈액배양 - 중환자실 입퇴실 매칭 / 감염환자 ID 추정 엔진 (Streamlit 화면과 명령줄에서 함께 사용)
+## py konis_pipeline.py --culture 혈액배양.xlsx --icu 입퇴실.xlsx --profile profile.json --out-dir 결과
+
+import argparse
+import json
+import os
+import sys
+import pandas as pd
+
+from konis_utils import (parse_dates_native, parse_days_native, native_date_kinds, format_dates, split_gender, read_columns,
+                         read_upload_columns, open_upload, timed_stage, to_days, normalize_ids, encode_ids, restore_ids)
+from konis_matching import match_konis_registrations, assign_icu_episodes, estimate_case_ids, KONIS_WINDOW_DAYS
+from konis_store import (open_store, upsert_patient_genders, upsert_patient_births, upsert_icu_episodes, upsert_cultures,
+                         upsert_konis_registrations, load_patients, load_icu_episodes, load_cultures, load_konis_registrations)
+from konis_export import EXPORT_FORMATS, export_bytes, format_label
+
+# 입력 파일 구분 (화면에 보이는 파일 이름과 같음)
+CULTURE_SOURCE = "혈액배양 파일"
+ICU_SOURCE = "중환자실 파일"
+BSI_SOURCE = "BSI 파일"
+INFO_SOURCE = "추가정보 파일"
+KONIS_SOURCE = "KONIS WRAP 파일"
+
+# 매칭 결과 표 종류 (외부 타당도 조사용 / 내부 타당도 조사용)
+RESULT_VIEWS = ["external", "internal"]
+
+# 컬럼 매핑 프로필 기본값 (None: 해당 정보 없음)
+#  - birth_col이 없으면 생년월일 없이 매칭
+#  - gender_combined_col이 있으면 gender_delimiter 기준 앞/뒤(gender_position)에서 성별을 분리
+#  - site: 기관 코드 (로컬 저장소를 쓸 때 필수, 저장소의 자료를 기관별로 나눔)
+DEFAULT_PROFILE = {
+    "culture_id": None, "culture_date": None, "culture_ward": None, "culture_result": None,
+    "icu_id": None, "icu_in": None, "icu_out": None,
+    "bsi_id": None, "bsi_date": None, "bsi_pathogen": None, "bsi_lcbi": None,
+    "birth_source": CULTURE_SOURCE, "birth_id": None, "birth_col": None,
+    "gender_source": CULTURE_SOURCE, "gender_id": None, "gender_col": None,
+    "gender_combined_col": None, "gender_delimiter": "/", "gender_position": "앞",
+    "site": None,
+}
+REQUIRED_KEYS = ["culture_id", "culture_date", "icu_id", "icu_in", "icu_out", "gender_id"]
+
+# 감염환자 ID 추정 프로필 기본값 (KONIS WRAP 파일: 증례코드~감염발생일, 생년월일·성별은 중환자실/혈액배양 파일 중 선택)
+DEFAULT_WHO_PROFILE = {
+    "caseno": None, "dob": None, "gender": None, "icu_date": None, "infection_date": None,
+    "icu_id": None, "icu_in": None, "icu_out": None,
+    "culture_id": None, "culture_date": None, "culture_result": None,
+    "birth_source": ICU_SOURCE, "birth_id": None, "birth_col": None,
+    "gender_source": ICU_SOURCE, "gender_id": None, "gender_col": None,
+    "gender_combined_col": None, "gender_delimiter": "/", "gender_position": "앞",
+    "site": None,
+}
+WHO_REQUIRED_KEYS = ["caseno", "dob", "gender", "icu_date", "infection_date", "icu_id", "icu_in", "icu_out",
+                     "culture_id", "culture_date", "culture_result", "birth_id", "birth_col", "gender_id"]
+
+# KONIS WRAP 파일에 있으면 결과에 함께 표시할 컬럼
+WHO_OPTIONAL_COLUMNS = ['재태연령(주)', '재태연령(일)', '출생체중', 'LCBI종류', '병원체명1', '병원체명2']
+
+# 비고 정렬 순서
+SURV_WINDOW_ORDER = {
+    None: 0,
+    "입퇴실일 확인": 1,
+    "감시기간 이전": 2,
+    "감시기간 이후": 3
+}
+
+# 로컬 저장소에서 불러올 입실 구간: 첫 혈액배양 의뢰일보다 이 기간(일) 앞선 구간까지 (환경변수 KONIS_STORE_LOOKBACK_DAYS로 변경)
+STORE_LOOKBACK_DAYS = int(os.environ.get("KONIS_STORE_LOOKBACK_DAYS", "365"))
+
+# 결과 미리보기 요약·필터에 쓰는 비고 구분 (비고가 비어 있으면 감시기간 내)
+IN_WINDOW_LABEL = "감시기간 내"
+REMARK_LABELS = [IN_WINDOW_LABEL, "감시기간 이전", "감시기간 이후", "입퇴실일 확인", "시행부서 확인"]
+
+
+# 프로필 읽기 (JSON, 기본값과 합쳐 반환)
+def load_profile(path, defaults=DEFAULT_PROFILE):
+    with open(path, encoding="utf-8") as f:
+        profile = json.load(f)
+    unknown = [key for key in profile if key not in defaults]
+    if unknown:
+        raise ValueError(f"프로필에 알 수 없는 항목이 있습니다: {', '.join(unknown)}")
+    return {**defaults, **profile}
+
+
+# 프로필을 JSON 문자열로 (화면에서 저장용 다운로드)
+def dump_profile(profile, defaults=DEFAULT_PROFILE):
+    return json.dumps({key: profile.get(key, defaults[key]) for key in defaults}, ensure_ascii=False, indent=2)
+
+
+# 프로필 확인 (필수 컬럼, 파일 구분, 로컬 저장소를 쓰면 기관 코드)
+def check_profile(files, profile, required=REQUIRED_KEYS, store=None):
+    missing = [key for key in required if not profile[key]]
+    if store and not (profile["site"] and str(profile["site"]).strip()):
+        missing.append("site")
+    if not (profile["gender_col"] or profile["gender_combined_col"]):
+        missing.append("gender_col")
+    if missing:
+        raise ValueError(f"프로필에 필수 컬럼이 없습니다: {', '.join(missing)}")
+    for key in ["gender_source"] + (["birth_source"] if profile["birth_col"] else []):
+        if not files.get(profile[key]):
+            raise ValueError(f"{key}에 해당하는 파일이 없습니다: {profile[key]}")
+
+
+# 생년월일 컬럼 확인용: 길이 8 이상인 값(엑셀 날짜 셀 포함)의 비율
+# 숫자 셀은 날짜 일련번호일 수 있어도 세지 않음 (출생체중 등 숫자 컬럼을 잘못 고른 경우)
+def _date_like_ratio(values):
+    str_lengths = values.astype(str).str.len()
+    is_datetime, _ = native_date_kinds(values)
+    return ((str_lengths >= 8).to_numpy() | is_datetime).mean()
+
+
+# 저장소 조회용 환자 ID 목록 (환자 코드 → 정리한 환자 ID, 중복 제외)
+def _store_patients(codes, id_labels):
+    return normalize_ids(restore_ids(codes.dropna().drop_duplicates(), id_labels))
+
+
+# 저장소에서 불러온 행에 이번 실행의 환자 코드(code)를 붙임 (업로드에 없는 환자는 <NA>)
+def _store_codes(loaded, id_labels):
+    lookup = pd.Series(range(len(id_labels)), index=normalize_ids(pd.Series(id_labels, dtype=object)).to_numpy())
+    return loaded.assign(code=pd.array(lookup.reindex(loaded["patient_id"]).to_numpy(), dtype="Int64"))
+
+
+# 저장소에서 불러온 행 중 이번 실행에 추가할 행: 업로드에 있는 환자의 행만, 이번에 올린 파일에 같은 (환자, 날짜)가 있는 행은 제외
+# (날짜 비교는 일 단위: 같은 날 재입실한 입실 구간들은 모두 업로드 쪽 또는 모두 저장소 쪽에서 가져옴)
+def _store_rows(loaded, day_column, id_labels, upload_codes, upload_dates):
+    loaded = _store_codes(loaded, id_labels)
+    uploaded = pd.MultiIndex.from_arrays([upload_codes.to_numpy(),
+                                          pd.to_datetime(upload_dates, errors="coerce").dt.normalize().to_numpy()])
+    keys = pd.MultiIndex.from_arrays([loaded["code"].to_numpy(), loaded[day_column].to_numpy()])
+    return loaded[loaded["code"].notna().to_numpy() & ~keys.isin(uploaded)].reset_index(drop=True)
+
+
+# 저장소에서 불러온 행을 표 뒤에 추가 (loaded: {컬럼: 값}, 불러온 행이 없으면 그대로)
+def _append_stored(df, loaded):
+    loaded = pd.DataFrame(loaded)
+    return df if loaded.empty else pd.concat([df, loaded], ignore_index=True)
+
+
+# 혈액배양 - 중환자실 입퇴실 매칭
+# files: {파일 구분: 업로드 파일(getvalue, name)} / profile: 컬럼 매핑
+# timings: 단계별 소요시간·행 수·메모리를 모을 list (선택, 읽기 → ID 정규화 → 날짜 처리 → 입실 구간·성별·생년월일 병합 → KONIS 등록여부 → 정리·분류)
+# store: 로컬 저장소 파일 경로 (선택, 저장소 동기화 단계가 날짜 처리 다음에 추가됨, konis_store 참고)
+# 반환: {"result": 매칭 결과 (compact_result 형식, 화면·파일용 표는 result_view), "summary": 건수 요약 (result_summary),
+#        "warnings": 경고 메시지 목록}
+def match_cultures(files, profile, timings=None, store=None):
+    profile = {**DEFAULT_PROFILE, **profile}
+    check_profile(files, profile, store=store)
+    warnings = []
+
+    culture_id, culture_date = profile["culture_id"], profile["culture_date"]
+    culture_ward, culture_result = profile["culture_ward"], profile["culture_result"]
+    icu_id, icu_in, icu_out = profile["icu_id"], profile["icu_in"], profile["icu_out"]
+    birth_source, birth_id_col, birth_col = profile["birth_source"], profile["birth_id"], profile["birth_col"]
+    gender_source, gender_id_col = profile["gender_source"], profile["gender_id"]
+    gender_col, combined_col = profile["gender_col"], profile["gender_combined_col"]
+    use_bsi = bool(files.get(BSI_SOURCE)) and bool(profile["bsi_id"])
+    bsi_id_col, bsi_date, bsi_pathogen, bsi_lcbi = profile["bsi_id"], profile["bsi_date"], profile["bsi_pathogen"], profile["bsi_lcbi"]
+
+    with timed_stage(timings, "read") as stage:
+        # 파일마다 선택한 컬럼만 읽기 (날짜 컬럼은 엑셀 날짜 값 그대로, 병동·분리균·성별 등은 범주형)
+        sources = [name for name in [CULTURE_SOURCE, ICU_SOURCE, BSI_SOURCE, INFO_SOURCE] if files.get(name)]
+        used_columns = {name: [] for name in sources}
+        date_columns = {name: [] for name in sources}
+        category_columns = {name: [] for name in sources}
+        used_columns[CULTURE_SOURCE] += [culture_id, culture_date, culture_ward, culture_result]
+        date_columns[CULTURE_SOURCE] += [culture_date]
+        category_columns[CULTURE_SOURCE] += [culture_ward, culture_result]
+        used_columns[ICU_SOURCE] += [icu_id, icu_in, icu_out]
+        date_columns[ICU_SOURCE] += [icu_in, icu_out]
+        if use_bsi:
+            used_columns[BSI_SOURCE] += [bsi_id_col, bsi_date, bsi_pathogen, bsi_lcbi]
+            date_columns[BSI_SOURCE] += [bsi_date]
+            category_columns[BSI_SOURCE] += [bsi_pathogen, bsi_lcbi]
+        if birth_col:
+            used_columns[birth_source] += [birth_id_col, birth_col]
+            date_columns[birth_source] += [birth_col]
+        used_columns[gender_source] += [gender_id_col, combined_col or gender_col]
+        if not combined_col:
+            category_columns[gender_source] += [gender_col]
+        frames = {
+            name: read_upload_columns(files[name], cols, date_columns[name], category_columns[name])
+            for name, cols in used_columns.items() if cols
+        }
+        culture_df = frames[CULTURE_SOURCE]
+        icu_df = frames[ICU_SOURCE]
+        bsi_df = frames[BSI_SOURCE] if use_bsi else pd.DataFrame()
+        gender_df = frames[gender_source]
+        birth_df = frames[birth_source] if birth_col else None
+        stage["rows"] = len(culture_df)
+
+    with timed_stage(timings, "keys") as stage:
+        # 환자 ID 정규화: 모든 파일의 ID 컬럼을 공통 정수 코드로 바꿔 병합·조회를 정수로 처리 (출력할 때 원래 ID로 복원)
+        id_columns = [(CULTURE_SOURCE, culture_id), (ICU_SOURCE, icu_id), (gender_source, gender_id_col)]
+        id_columns += [(BSI_SOURCE, bsi_id_col)] if use_bsi else []
+        id_columns += [(birth_source, birth_id_col)] if birth_col else []
+        id_columns = list(dict.fromkeys(id_columns))
+        codes, id_labels = encode_ids(*[frames[name][col] for name, col in id_columns])
+        for (name, col), code in zip(id_columns, codes):
+            frames[name][col] = code
+        stage["rows"] = len(id_labels)
+
+    with timed_stage(timings, "parse") as stage:
+        # 날짜 처리
+        icu_df[icu_in] = parse_dates_native(icu_df[icu_in])
+        icu_df[icu_out] = parse_dates_native(icu_df[icu_out])
+        culture_df[culture_date] = parse_dates_native(culture_df[culture_date])
+        if use_bsi and not bsi_df.empty:
+            bsi_df[bsi_date] = parse_days_native(bsi_df[bsi_date])
+        stage["rows"] = len(culture_df)
+
+    stored_patients = None
+    if store:
+        with timed_stage(timings, "store") as stage:
+            # 로컬 저장소: 이번에 올린 입실 구간·혈액배양·KONIS 등록·성별·생년월일을 저장(같은 환자·날짜는 갱신)하고,
+            # 업로드에 없는 입실 구간·KONIS 등록은 혈액배양 환자의 필요한 기간만 불러와 추가
+            site = str(profile["site"]).strip()
+            conn = open_store(store)
+            try:
+                genders = (split_gender(gender_df[combined_col], profile["gender_delimiter"], profile["gender_position"])
+                           if combined_col else gender_df[gender_col])
+                upsert_patient_genders(conn, site, restore_ids(gender_df[gender_id_col], id_labels), genders)
+                if birth_col:
+                    # 생년월일 컬럼을 잘못 고른 경우(대부분 날짜가 아님)는 저장하지 않음 (병합 단계와 같은 기준)
+                    births = parse_dates_native(birth_df[birth_col])
+                    if _date_like_ratio(birth_df[birth_col]) >= 0.5 and births.notna().mean() >= 0.5:
+                        upsert_patient_births(conn, site, restore_ids(birth_df[birth_id_col], id_labels), births)
+                upsert_icu_episodes(conn, site, restore_ids(icu_df[icu_id], id_labels), icu_df[icu_in], icu_df[icu_out])
+                upsert_cultures(conn, site, restore_ids(culture_df[culture_id], id_labels), culture_df[culture_date],
+                                culture_df[culture_result] if culture_result else None,
+                                culture_df[culture_ward] if culture_ward else None)
+                if use_bsi:
+                    upsert_konis_registrations(conn, site, restore_ids(bsi_df[bsi_id_col], id_labels), bsi_df[bsi_date],
+                                               bsi_df[bsi_pathogen], bsi_df[bsi_lcbi] if bsi_lcbi else None)
+
+                culture_days = pd.to_datetime(culture_df[culture_date], errors="coerce").dt.normalize()
+                if culture_days.notna().any():
+                    first, last = culture_days.min(), culture_days.max()
+                    patients = _store_patients(culture_df[culture_id], id_labels)
+                    stored_patients = _store_codes(load_patients(conn, site, patients), id_labels).dropna(subset=["code"]).set_index("code")
+                    episodes = _store_rows(load_icu_episodes(conn, site, first - pd.Timedelta(days=STORE_LOOKBACK_DAYS), last, patients),
+                                           "in_day", id_labels, icu_df[icu_id], icu_df[icu_in])
+                    icu_df = _append_stored(icu_df, {
+                        icu_id: episodes["code"], icu_in: episodes["in_time"], icu_out: episodes["out_day"],
+                    })
+                    if use_bsi:
+                        registrations = _store_rows(
+                            load_konis_registrations(conn, site, first - pd.Timedelta(days=KONIS_WINDOW_DAYS), last, patients),
+                            "onset_day", id_labels, bsi_df[bsi_id_col], bsi_df[bsi_date])
+                        loaded = {bsi_id_col: registrations["code"], bsi_date: registrations["onset_day"],
+                                  bsi_pathogen: registrations["pathogen"]}
+                        if bsi_lcbi:
+                            loaded[bsi_lcbi] = registrations["lcbi"]
+                        bsi_df = _append_stored(bsi_df, loaded)
+            finally:
+                conn.close()
+            stage["rows"] = len(icu_df)
+
+    with timed_stage(timings, "merge") as stage:
+        # 혈액배양별 중환자실 입실 구간 배정 (환자별 입실일 정렬 후 이진 탐색)
+        # 감시기간 포함 → 비고 없음 / 감시기간 이전 / 감시기간 이후 / 입실 기록 없음 → 시행부서 확인
+        dedup_cols = [culture_id, culture_date, culture_result] if culture_result else [culture_id, culture_date]
+        culture_df = culture_df.drop_duplicates(subset=dedup_cols)
+        merged = assign_icu_episodes(culture_df, icu_df, culture_id, culture_date, icu_id, icu_in, icu_out)
+
+        # result = matched(비고 없음) + unmatched(비고 있음)로 culture_df의 모든 데이터 유지
+        matched = merged[merged['surv_window'].isna()]
+        unmatched = merged[merged['surv_window'].notna()]
+        result = pd.concat([matched, unmatched], ignore_index=True, sort=False)
+        del merged, matched, unmatched  # 결과를 만든 중간 표는 바로 해제 (큰 파일에서 최대 메모리 감소)
+
+        # 성별 병합
+        if combined_col:
+            comb_df = gender_df[[gender_id_col, combined_col]].copy()
+            comb_df = comb_df.drop_duplicates(subset=[gender_id_col])
+            comb_df['gender'] = split_gender(comb_df[combined_col], profile["gender_delimiter"], profile["gender_position"]).astype("category")
+            result = result.merge(comb_df[[gender_id_col, 'gender']], left_on=culture_id, right_on=gender_id_col, how='left')
+        else:
+            gender_df = gender_df.drop_duplicates(subset=[gender_id_col])
+            gender_df = gender_df[[gender_id_col, gender_col]].rename(columns={gender_col: 'gender'})
+            result = result.merge(gender_df, left_on=culture_id, right_on=gender_id_col, how='left')
+
+        # 생년월일 병합 (선택적)
+        if birth_col:
+            for col in [birth_col, "생년월일"]:
+                if col in result.columns:
+                    result.drop(columns=[col], inplace=True)
+            try:
+                birth_df = birth_df[[birth_id_col, birth_col]].copy()
+                birth_df = birth_df.drop_duplicates(subset=[birth_id_col])
+
+                # 문자열 길이 기준 필터 (길이 8 이상이 50% 이상이어야 함)
+                if _date_like_ratio(birth_df[birth_col]) < 0.5:
+                    warnings.append("❌ 선택한 생년월일 컬럼의 값 대부분이 날짜 형식이 아닙니다. 컬럼 선택을 다시 확인해 주세요.")
+                else:
+                    # 날짜로 파싱 시도
+                    parsed_birth = parse_dates_native(birth_df[birth_col])
+                    valid_ratio = parsed_birth.notna().mean()
+
+                    if valid_ratio < 0.5:
+                        warnings.append("⚠️ 생년월일 컬럼의 값 중 다수가 날짜로 변환되지 않았습니다. 일부 정보가 누락되었을 수 있습니다.")
+                    else:
+                        birth_df[birth_col] = parsed_birth
+                        result = result.merge(birth_df, left_on=culture_id, right_on=birth_id_col, how='left')
+                        result.rename(columns={birth_col: "dob"}, inplace=True)
+
+            except Exception as e:
+                warnings.append(f"⚠️ 생년월일 병합에 실패했습니다: {e}")
+
+        # 이번에 올린 파일에 성별·생년월일이 없는 환자는 로컬 저장소 값으로 채움
+        if stored_patients is not None and not stored_patients.empty:
+            result["gender"] = result["gender"].astype(object).fillna(result[culture_id].map(stored_patients["gender"].dropna()))
+            if "dob" in result.columns:
+                result["dob"] = result["dob"].fillna(result[culture_id].map(stored_patients["birth_day"].dropna()))
+        stage["rows"] = len(result)
+
+    with timed_stage(timings, "konis") as stage:
+        # KONIS 등록여부 병합
+        if use_bsi and not bsi_df.empty:
+            konis_df = match_konis_registrations(
+                result, bsi_df, culture_id, culture_date,
+                bsi_id_col, bsi_date, bsi_pathogen, bsi_lcbi
+            )
+            result = pd.concat([result, konis_df], axis=1)
+        stage["rows"] = len(result)
+    del frames, culture_df, icu_df, bsi_df, gender_df, birth_df, stored_patients  # 입력 표는 더 이상 쓰지 않음
+
+    with timed_stage(timings, "classify") as stage:
+        # 날짜 포맷을 yyyy-mm-dd로 통일
+        date_cols = [icu_in, icu_out, culture_date]
+        if birth_col:
+            date_cols.append("dob")
+
+        for col in date_cols:
+            if col in result:
+                result[col] = format_dates(result[col], "%Y-%m-%d")
+
+        result = result.drop_duplicates(subset=dedup_cols)
+
+        # 기존 "비고" 컬럼이 존재하면 삭제
+        # 비고 컬럼 추가: NICU/신생아 포함 + ICU 입실정보가 없는 경우
+        if "비고" in result.columns:
+            result.drop(columns=["비고"], inplace=True)
+
+        if culture_ward:
+            result.loc[
+                result[culture_ward].str.contains("NICU|NR|신생아", na=False) & result[icu_in].isna(),
+                "surv_window"
+            ] = "입퇴실일 확인"
+
+        # 정렬 및 일련번호
+        result["order_sort"] = result["surv_window"].map(SURV_WINDOW_ORDER)
+        result_sorted = result.sort_values(
+            by=["order_sort", culture_date, icu_in],
+            ascending=[True, True, True],
+            na_position="last"
+        ).drop(columns=["order_sort"])
+        del result
+        result_sorted.insert(0, "No", range(1, len(result_sorted) + 1))
+
+        # 환자ID를 원래 표기의 문자열로 복원
+        result_sorted[culture_id] = restore_ids(result_sorted[culture_id], id_labels).astype(str)
+
+        # 결측 컬럼 처리
+        result_sorted["culture_result2"] = result_sorted[culture_result] if culture_result else None
+        result_sorted["culture_ward2"] = result_sorted[culture_ward] if culture_ward else None
+
+        column_rename_map = {
+            "No": "번호",
+            culture_id: "등록번호_ID",
+            "gender": "성별",
+            "dob": "생년월일",
+            icu_in: "입실일",
+            icu_out: "퇴실일",
+            culture_date: "혈액배양 의뢰일",
+            "culture_result2": "혈액배양 분리균",
+            "KONIS_reported": "KONIS WRAP 등록여부",
+            "KONIS_detail": "KONIS WRAP 상세내용",
+            "culture_ward2": "혈액배양 시행병동",
+            "surv_window": "비고"
+        }
+
+        for col in column_rename_map.keys():
+            if col not in result_sorted.columns:
+                result_sorted[col] = ""
+
+        # 필요한 컬럼만 선택 (외부/내부 타당도 조사용 표는 result_view로 만듦)
+        export_df = compact_result(result_sorted[list(column_rename_map.keys())].rename(columns=column_rename_map))
+        stage["rows"] = len(export_df)
+
+    return {"result": export_df, "summary": result_summary(export_df), "warnings": warnings}
+
+
+# 매칭 결과를 한 번만 보관할 압축 형식으로 변환 (문자열 컬럼은 모두 범주형: 성별·날짜·분리균·비고 등 반복 값이 많음)
+# 범주형에서는 빈 값이 모두 NaN이 되므로 빈 값이 None이던 컬럼을 attrs["none_columns"]에 기록
+def compact_result(export_df):
+    text_columns = [col for col in export_df.columns if export_df[col].dtype == object]
+    compact = export_df.astype({col: "category" for col in text_columns})
+    compact.attrs["none_columns"] = [col for col in text_columns
+                                     if any(value is None for value in export_df[col].to_numpy())]
+    return compact
+
+
+# 압축 결과 → 화면·파일용 표 (범주형은 문자열로, 빈 값은 원래 표기(None/NaN)로 되돌림)
+# view: "external"(외부 타당도 조사용) / "internal"(내부 타당도 조사용, 혈액배양 분리균 뒤에 빈 "BSI 분류" 컬럼)
+def result_view(result, view="external"):
+    df = result.astype({col: object for col in result.columns if isinstance(result[col].dtype, pd.CategoricalDtype)})
+    for col in result.attrs.get("none_columns", []):
+        df[col] = df[col].where(df[col].notna(), None)
+    if view == "internal":
+        df.insert(df.columns.get_loc("혈액배양 분리균") + 1, "BSI 분류", "")
+    return df
+
+
+# 감염환자 기록지 ID 추정 (KONIS WRAP 등록 증례 → 환자 ID 후보)
+# files: {KONIS_SOURCE, ICU_SOURCE, CULTURE_SOURCE: 업로드 파일} / profile: DEFAULT_WHO_PROFILE 형식
+# timings: 단계별 소요시간·행 수·메모리를 모을 list (선택, timed_stage 참고)
+# store: 로컬 저장소 파일 경로 (선택, match_cultures와 같은 저장소를 함께 씀)
+# 반환: 증례별 추정 ID 표
+def estimate_ids(files, profile, timings=None, store=None):
+    profile = {**DEFAULT_WHO_PROFILE, **profile}
+    check_profile(files, profile, WHO_REQUIRED_KEYS, store=store)
+
+    caseno, dob1, gender1 = profile["caseno"], profile["dob"], profile["gender"]
+    date_icu1, date_infection = profile["icu_date"], profile["infection_date"]
+    id2, date_icu2, date_icu2_out = profile["icu_id"], profile["icu_in"], profile["icu_out"]
+    id3, date_culture, result_culture = profile["culture_id"], profile["culture_date"], profile["culture_result"]
+    birth_source, birth_id_col, birth_col = profile["birth_source"], profile["birth_id"], profile["birth_col"]
+    gender_source, gender_id_col = profile["gender_source"], profile["gender_id"]
+    gender_col, combined_col = profile["gender_col"], profile["gender_combined_col"]
+
+    with timed_stage(timings, "read") as stage:
+        # 파일마다 선택한 컬럼만 읽기 (날짜 컬럼은 엑셀 날짜 값 그대로, 성별·분리균 등은 범주형)
+        used_columns = {
+            ICU_SOURCE: [id2, date_icu2, date_icu2_out],
+            CULTURE_SOURCE: [id3, date_culture, result_culture],
+        }
+        date_columns = {
+            ICU_SOURCE: [date_icu2, date_icu2_out],
+            CULTURE_SOURCE: [date_culture],
+        }
+        category_columns = {ICU_SOURCE: [], CULTURE_SOURCE: [result_culture]}
+        used_columns[birth_source] += [birth_id_col, birth_col]
+        date_columns[birth_source] += [birth_col]
+        used_columns[gender_source] += [gender_id_col, combined_col or gender_col]
+        if not combined_col:
+            category_columns[gender_source] += [gender_col]
+        cols1 = read_columns(files[KONIS_SOURCE])
+        optional1 = [col for col in WHO_OPTIONAL_COLUMNS if col in cols1]
+        df1 = read_upload_columns(files[KONIS_SOURCE], [caseno, dob1, gender1, date_icu1, date_infection] + optional1,
+                                  [dob1, date_icu1, date_infection], [gender1])
+        df2 = read_upload_columns(files[ICU_SOURCE], used_columns[ICU_SOURCE], date_columns[ICU_SOURCE],
+                                  category_columns[ICU_SOURCE])
+        df3 = read_upload_columns(files[CULTURE_SOURCE], used_columns[CULTURE_SOURCE], date_columns[CULTURE_SOURCE],
+                                  category_columns[CULTURE_SOURCE])
+        frames = {ICU_SOURCE: df2, CULTURE_SOURCE: df3}
+        birth_df = frames[birth_source]
+        gender_df = frames[gender_source]
+        stage["rows"] = len(df3)
+
+    with timed_stage(timings, "keys") as stage:
+        # 환자 ID 정규화 (혈액배양 파일 표기를 우선해 추정ID로 복원)
+        id_columns = list(dict.fromkeys([(CULTURE_SOURCE, id3), (ICU_SOURCE, id2),
+                                         (birth_source, birth_id_col), (gender_source, gender_id_col)]))
+        codes, id_labels = encode_ids(*[frames[name][col] for name, col in id_columns])
+        for (name, col), code in zip(id_columns, codes):
+            frames[name][col] = code
+        stage["rows"] = len(id_labels)
+
+    with timed_stage(timings, "parse") as stage:
+        if combined_col:
+            comb_df = gender_df[[gender_id_col, combined_col]].copy()
+            comb_df = comb_df.drop_duplicates(subset=[gender_id_col])
+            comb_df['gender'] = split_gender(comb_df[combined_col], profile["gender_delimiter"], profile["gender_position"]).astype("category")
+            gender_df = comb_df[[gender_id_col, 'gender']]
+        else:
+            gender_df = gender_df.drop_duplicates(subset=[gender_id_col])
+            gender_df = gender_df[[gender_id_col, gender_col]].rename(columns={gender_col: 'gender'})
+
+        # df 정리
+        columns_to_use = [caseno, dob1, gender1, date_icu1, date_infection]
+        columns_to_use += [col for col in WHO_OPTIONAL_COLUMNS if col in df1.columns]
+        df1 = df1[columns_to_use].copy()
+        df2 = df2[[id2, date_icu2, date_icu2_out]].copy() ## ICU
+        df3 = df3[[id3, date_culture, result_culture]].copy() ## culture
+        birth_df = birth_df.drop_duplicates(subset=[birth_id_col])
+        birth_df = birth_df[[birth_id_col, birth_col]].copy()
+        gender_df = gender_df[[gender_id_col, 'gender']]
+
+        # 날짜 변환 (0시 기준 datetime64, 결과 표에서만 날짜로 표시)
+        for col in [dob1, date_icu1, date_infection]:
+            df1[col] = parse_days_native(df1[col])
+        icu_times = parse_dates_native(df2[date_icu2])
+        df2[date_icu2] = pd.to_datetime(icu_times, errors="coerce").dt.normalize()
+        df2[date_icu2_out] = parse_days_native(df2[date_icu2_out])
+        culture_times = parse_dates_native(df3[date_culture])
+        df3[date_culture] = pd.to_datetime(culture_times, errors="coerce").dt.normalize()
+        birth_df[birth_col] = parse_days_native(birth_df[birth_col])
+        stage["rows"] = len(df3)
+
+    if store:
+        with timed_stage(timings, "store") as stage:
+            # 로컬 저장소: 이번에 올린 입실 구간·혈액배양·성별·생년월일을 저장(같은 환자·날짜는 갱신)하고,
+            # 업로드에 없는 혈액배양(감염발생일 기간)과 입실 구간(중환자실 입원일 기간), 성별·생년월일을 불러와 추가
+            site = str(profile["site"]).strip()
+            conn = open_store(store)
+            try:
+                upsert_patient_genders(conn, site, restore_ids(gender_df[gender_id_col], id_labels), gender_df["gender"])
+                upsert_patient_births(conn, site, restore_ids(birth_df[birth_id_col], id_labels), birth_df[birth_col])
+                upsert_icu_episodes(conn, site, restore_ids(df2[id2], id_labels), icu_times, df2[date_icu2_out])
+                upsert_cultures(conn, site, restore_ids(df3[id3], id_labels), culture_times, df3[result_culture])
+
+                # 이번에 올린 파일에 있는 환자(환자 코드가 있는 환자)의 기록만 불러옴
+                known = normalize_ids(pd.Series(id_labels, dtype=object))
+                patients = _store_codes(load_patients(conn, site, known), id_labels)
+                genders = patients[patients["gender"].notna() & ~patients["code"].isin(gender_df[gender_id_col])]
+                gender_df = _append_stored(gender_df, {gender_id_col: genders["code"], "gender": genders["gender"]})
+                births = patients[patients["birth_day"].notna() & ~patients["code"].isin(birth_df[birth_id_col])]
+                birth_df = _append_stored(birth_df, {birth_id_col: births["code"], birth_col: births["birth_day"]})
+                infection_days = df1[date_infection].dropna()
+                if not infection_days.empty:
+                    cultures = load_cultures(conn, site, infection_days.min(),
+                                             infection_days.max() + pd.Timedelta(days=KONIS_WINDOW_DAYS), known)
+                    cultures["culture_day"] = cultures["culture_time"].dt.normalize()
+                    cultures = _store_rows(cultures, "culture_day", id_labels, df3[id3], df3[date_culture])
+                    df3 = _append_stored(df3, {
+                        id3: cultures["code"], date_culture: cultures["culture_day"], result_culture: cultures["result"],
+                    })
+                icu_days = df1[date_icu1].dropna()
+                if not icu_days.empty:
+                    episodes = load_icu_episodes(conn, site, icu_days.min(), icu_days.max(), _store_patients(df3[id3], id_labels))
+                    episodes = episodes[episodes["in_day"] >= icu_days.min()]
+                    episodes = _store_rows(episodes, "in_day", id_labels, df2[id2], df2[date_icu2])
+                    df2 = _append_stored(df2, {
+                        id2: episodes["code"], date_icu2: episodes["in_day"], date_icu2_out: episodes["out_day"],
+                    })
+            finally:
+                conn.close()
+            stage["rows"] = len(df3)
+
+    with timed_stage(timings, "merge") as stage:
+        # 병합
+        merged = pd.merge(df3, df2, left_on=id3, right_on=id2, how='inner')
+
+        # 날짜 계산
+        merged['culture_date_day'] = merged[date_culture].copy()
+        merged['icu_in_day'] = merged[date_icu2].copy()
+        merged['icu_out_day'] = merged[date_icu2_out].copy()
+        merged['icu_day_start'] = merged['icu_in_day'] + pd.Timedelta(days=2)
+        merged['icu_day_end'] = merged['icu_out_day'] + pd.Timedelta(days=1)
+        merged = merged.drop_duplicates(subset=[id3, 'culture_date_day', 'icu_in_day'])
+
+        # 감시기간 포함 조건
+        condition_matched = (
+            (merged['icu_day_start'].notna()) &
+            (merged['culture_date_day'] >= merged['icu_day_start']) &
+            (
+                (merged['culture_date_day'] <= merged['icu_day_end']) |
+                (merged['icu_day_end'].isna())
+            )
+        )
+        merged2 = merged.loc[condition_matched].copy()
+        merged3 = pd.merge(merged2, birth_df, left_on=id3, right_on=birth_id_col, how='left')
+        merged3 = pd.merge(merged3, gender_df, left_on=id3, right_on=gender_id_col, how='left')
+        stage["rows"] = len(merged3)
+
+    with timed_stage(timings, "estimate") as stage:
+        # 성별, 생년월일 기준 병합
+        result_df = estimate_case_ids(df1, merged3, caseno, gender1, dob1, date_icu1, date_infection,
+                                      birth_col, id3, result_culture)
+        sub_cols = [col for col in df1.columns if col != caseno]
+        found = result_df["추정ID"] != ""
+        result_df.loc[found, "추정ID"] = restore_ids(result_df.loc[found, "추정ID"], id_labels)
+        final = pd.merge(df1[[caseno] + sub_cols], result_df, on=caseno, how='right').drop_duplicates()
+        for col in dict.fromkeys([dob1, date_icu1, date_infection]):
+            final[col] = to_days(final[col])
+        stage["rows"] = len(final)
+    return final
+
+
+# 비고 구분 (빈 비고는 IN_WINDOW_LABEL)
+def _remarks(result):
+    return result["비고"].astype(object).where(result["비고"].notna(), IN_WINDOW_LABEL)
+
+
+# 건수 요약 → {"전체": n, "감시기간 내": n, "감시기간 이전": n, ..., "KONIS 등록": n}
+def result_summary(result):
+    counts = _remarks(result).value_counts()
+    summary = {"전체": len(result)}
+    summary.update({label: int(counts.get(label, 0)) for label in REMARK_LABELS})
+    summary["KONIS 등록"] = int((result["KONIS WRAP 등록여부"] == "Y").sum())
+    return summary
+
+
+# 비고 구분·KONIS WRAP 등록여부로 결과 거르기 (None이면 거르지 않음, 압축 형식 그대로 반환)
+def filter_result(result, remarks=None, konis=None):
+    keep = pd.Series(True, index=result.index)
+    if remarks is not None:
+        keep &= _remarks(result).isin(remarks)
+    if konis is not None:
+        keep &= result["KONIS WRAP 등록여부"].isin(konis)
+    return result[keep]
+
+
+# 매칭 결과 표 하나를 파일 내용으로 변환 → (bytes, 확장자, MIME)
+def export_view(result, view, fmt_label):
+    return export_bytes(result_view(result, view).astype({"등록번호_ID": str}), fmt_label)
+
+
+# ID 추정 결과 건수 요약 → {"증례": n, "ID 추정": n, "후보 없음": n} (증례코드 기준)
+def estimate_summary(final, caseno):
+    cases = final[caseno].nunique()
+    found = final.loc[final["추정ID"] != "", caseno].nunique()
+    return {"증례": cases, "ID 추정": found, "후보 없음": cases - found}
+
+
+# 결과 파일 저장 → 저장한 파일 경로 목록
+def write_outputs(outcome, out_dir, fmt_label, prefix="matched_result"):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for view in RESULT_VIEWS:
+        data, ext, _ = export_view(outcome["result"], view, fmt_label)
+        path = os.path.join(out_dir, f"{prefix}_{view}.{ext}")
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="혈액배양 양성 환자 - 중환자실 입퇴실 매칭 (화면 없이 실행)")
+    parser.add_argument("--culture", required=True, help="혈액배양 파일")
+    parser.add_argument("--icu", required=True, help="중환자실 입퇴실 파일")
+    parser.add_argument("--bsi", help="KONIS WRAP 등록환자 파일 (선택)")
+    parser.add_argument("--info", help="추가 환자정보 파일 (선택)")
+    parser.add_argument("--profile", required=True, help="컬럼 매핑 프로필 (JSON, 화면에서 저장한 파일)")
+    parser.add_argument("--out-dir", default=".", help="결과 저장 폴더")
+    parser.add_argument("--format", default="xlsx", choices=[ext for ext, _ in EXPORT_FORMATS.values()], help="결과 파일 형식")
+    parser.add_argument("--store", help="로컬 저장소 파일 (선택, 입실 구간·혈액배양·KONIS 등록을 누적하고 이전 입실 구간을 불러옴)")
+    parser.add_argument("--site", help="기관 코드 (--store를 쓸 때 필수, 프로필의 site 대신 사용)")
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile)
+    if args.site:
+        profile["site"] = args.site
+    if args.store and not profile["site"]:
+        parser.error("--store를 쓰려면 --site 또는 프로필의 site로 기관 코드를 지정해야 합니다")
+
+    paths = {CULTURE_SOURCE: args.culture, ICU_SOURCE: args.icu, BSI_SOURCE: args.bsi, INFO_SOURCE: args.info}
+    files = {name: open_upload(path) for name, path in paths.items() if path}
+    outcome = match_cultures(files, profile, store=args.store)
+    for message in outcome["warnings"]:
+        print(message, file=sys.stderr)
+    for path in write_outputs(outcome, args.out_dir, format_label(args.format)):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+## 세션별 결과 보관 (Streamlit 서버 한 대를 여러 사용자가 함께 쓸 때 메모리 관리)
+##
+## put_result(세션 ID, "match", 결과) / get_result(세션 ID, "match") → 결과 또는 None
+##  - 결과는 st.session_state 대신 여기에 한 번만 보관하고 세션마다 크기를 셈 (session_bytes)
+##  - SESSION_IDLE_MINUTES 동안 화면을 다시 그리지 않은 세션의 결과는 삭제 (결과를 넣거나 꺼낼 때 정리)
+
+import os
+import threading
+import time
+
+import pandas as pd
+
+# 이 시간(분) 동안 쓰지 않은 세션의 결과를 삭제 (환경변수 KONIS_SESSION_IDLE_MINUTES로 변경)
+SESSION_IDLE_MINUTES = float(os.environ.get("KONIS_SESSION_IDLE_MINUTES", "60"))
+
+_sessions = {}  # 세션 → {"touched": 마지막 사용 시각, "results": {이름: (값, 바이트 수)}}
+_lock = threading.Lock()
+
+
+# 보관할 값의 크기 (DataFrame은 문자열 포함 실제 메모리, 파일 내용은 바이트 수, dict·list·tuple은 합계)
+def value_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(value_bytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_bytes(item) for item in value)
+    return 0
+
+
+# 오래 쓰지 않은 세션의 결과 삭제 → 삭제한 세션 수
+def evict_idle(now=None):
+    now = time.time() if now is None else now
+    with _lock:
+        idle = [session for session, entry in _sessions.items()
+                if now - entry["touched"] > SESSION_IDLE_MINUTES * 60]
+        for session in idle:
+            del _sessions[session]
+    return len(idle)
+
+
+def put_result(session, name, value):
+    evict_idle()
+    with _lock:
+        entry = _sessions.setdefault(session, {"touched": time.time(), "results": {}})
+        entry["touched"] = time.time()
+        entry["results"][name] = (value, value_bytes(value))
+
+
+# 보관된 결과 (없거나 오래되어 삭제되었으면 None)
+def get_result(session, name):
+    evict_idle()
+    with _lock:
+        entry = _sessions.get(session)
+        if entry is None or name not in entry["results"]:
+            return None
+        entry["touched"] = time.time()
+        return entry["results"][name][0]
+
+
+def drop_result(session, name):
+    with _lock:
+        entry = _sessions.get(session)
+        if entry is not None:
+            entry["results"].pop(name, None)
+
+
+# 세션 하나가 보관 중인 결과 크기 (바이트) / 서버 전체 합계
+def session_bytes(session):
+    with _lock:
+        entry = _sessions.get(session)
+        return sum(size for _, size in entry["results"].values()) if entry else 0
+
+
+def total_bytes():
+    with _lock:
+        return sum(size for entry in _sessions.values() for _, size in entry["results"].values())
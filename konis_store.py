@@ -0,0 +1,257 @@
+## 로컬 감시자료 저장소 (SQLite): 중환자실 입실 구간, 혈액배양, KONIS WRAP 등록과 환자 성별·생년월일을 조사기간마다 누적
+##
+## 업로드한 자료는 기관(site)·환자 ID(normalize_ids로 정리한 값)·날짜 기준으로 저장하고 같은 키는 갱신(upsert)
+## 매칭할 때는 같은 기관의 필요한 기간·환자 기록만 불러와, 입실내역을 조사기간보다 한참 앞선 기간부터 매번 다시 올리지 않아도 됨
+## (기관마다 환자 번호 체계가 달라 번호가 겹칠 수 있으므로 모든 표·조회를 기관으로 나눔)
+##
+## conn = open_store(path)
+## upsert_icu_episodes(conn, site, ids, in_days, out_days)
+## load_icu_episodes(conn, site, start, end, patients) → DataFrame (site, patient_id, patient_label, in_time, in_day, out_day)
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from konis_utils import normalize_ids
+
+# 화면(Streamlit 앱)에서 쓸 저장소 파일과 기관 코드 (환경변수 KONIS_STORE_PATH, KONIS_STORE_SITE)
+# 한 기관 전용으로 띄운 서버에서만 설정 (둘 다 설정하지 않으면 화면에 저장소 사용 옵션이 나오지 않음,
+# 여러 기관이 함께 쓰는 서버에서 사용자가 기관 코드를 입력해 다른 기관 자료를 불러오지 못하도록)
+STORE_PATH = os.environ.get("KONIS_STORE_PATH", "")
+STORE_SITE = os.environ.get("KONIS_STORE_SITE", "")
+
+# 날짜는 정렬·범위 조회가 되는 ISO 문자열로 저장
+DAY_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# site: 기관 코드, patient_id: 정리한 환자 ID (파일마다 다른 표기를 하나로), patient_label: 마지막으로 올린 파일의 원래 표기
+# 입실 구간은 입실 일시(in_time)를 키로 입실마다 한 행 (같은 날 퇴실 후 재입실해도 따로 저장), in_day·out_day는 기간 조회용
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    site TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    patient_label TEXT NOT NULL,
+    gender TEXT,
+    birth_day TEXT,
+    PRIMARY KEY (site, patient_id)
+);
+
+CREATE TABLE IF NOT EXISTS icu_episodes (
+    site TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    patient_label TEXT NOT NULL,
+    in_time TEXT NOT NULL,
+    in_day TEXT NOT NULL,
+    out_day TEXT,
+    PRIMARY KEY (site, patient_id, in_time)
+);
+CREATE INDEX IF NOT EXISTS icu_episodes_in_day ON icu_episodes (site, in_day);
+CREATE INDEX IF NOT EXISTS icu_episodes_out_day ON icu_episodes (site, out_day);
+
+CREATE TABLE IF NOT EXISTS cultures (
+    site TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    patient_label TEXT NOT NULL,
+    culture_time TEXT NOT NULL,
+    result TEXT NOT NULL DEFAULT '',
+    ward TEXT,
+    PRIMARY KEY (site, patient_id, culture_time, result)
+);
+CREATE INDEX IF NOT EXISTS cultures_culture_time ON cultures (site, culture_time);
+
+CREATE TABLE IF NOT EXISTS konis_registrations (
+    site TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    patient_label TEXT NOT NULL,
+    onset_day TEXT NOT NULL,
+    pathogen TEXT NOT NULL DEFAULT '',
+    lcbi TEXT,
+    PRIMARY KEY (site, patient_id, onset_day, pathogen)
+);
+CREATE INDEX IF NOT EXISTS konis_registrations_onset_day ON konis_registrations (site, onset_day);
+"""
+
+
+# 저장소 열기 (없으면 생성)
+# 여러 작업 프로세스가 함께 쓰므로 WAL 모드로 열고, 다른 프로세스가 쓰는 중이면 잠시 기다림
+def open_store(path):
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _format(series, fmt):
+    return pd.to_datetime(series, errors="coerce").dt.strftime(fmt)
+
+
+def _text(series):
+    return series.astype(object).where(series.notna(), None)
+
+
+def _check_site(site):
+    if not site or not str(site).strip():
+        raise ValueError("로컬 저장소를 쓰려면 기관 코드(site)를 지정해야 합니다")
+    return str(site).strip()
+
+
+# 저장할 행 정리: 모든 행에 기관 코드를 붙이고, 키(ID, 날짜 등)나 필수 값(required)이 없는 행은 제외,
+# 같은 키가 여러 번 나오면 마지막 행 사용
+def _rows(site, columns, keys, required=()):
+    df = pd.DataFrame(columns)
+    df.insert(0, "site", _check_site(site))
+    df = df[df[keys + list(required)].notna().all(axis=1)]
+    df = df.drop_duplicates(subset=keys, keep="last")
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)), list(df.columns)
+
+
+def _upsert(conn, table, rows, columns, keys):
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col not in keys)
+    with conn:
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+            rows,
+        )
+    return len(rows)
+
+
+# 환자 성별 저장 (같은 환자는 성별만 갱신) → 저장한 행 수
+def upsert_patient_genders(conn, site, ids, genders):
+    ids = pd.Series(ids).reset_index(drop=True)
+    rows, columns = _rows(site, {
+        "patient_id": normalize_ids(ids),
+        "patient_label": ids.astype(str),
+        "gender": _text(pd.Series(genders).reset_index(drop=True)),
+    }, ["patient_id"], ["gender"])
+    return _upsert(conn, "patients", rows, columns, ["site", "patient_id"])
+
+
+# 환자 생년월일 저장 (같은 환자는 생년월일만 갱신) → 저장한 행 수
+def upsert_patient_births(conn, site, ids, birth_days):
+    ids = pd.Series(ids).reset_index(drop=True)
+    rows, columns = _rows(site, {
+        "patient_id": normalize_ids(ids),
+        "patient_label": ids.astype(str),
+        "birth_day": _format(pd.Series(birth_days).reset_index(drop=True), DAY_FORMAT),
+    }, ["patient_id"], ["birth_day"])
+    return _upsert(conn, "patients", rows, columns, ["site", "patient_id"])
+
+
+# 입실 구간 저장 (ids: 원래 표기의 환자 ID, in_times/out_times: 입실·퇴실 일시) → 저장한 행 수
+def upsert_icu_episodes(conn, site, ids, in_times, out_times):
+    ids = pd.Series(ids).reset_index(drop=True)
+    in_times = pd.Series(in_times).reset_index(drop=True)
+    rows, columns = _rows(site, {
+        "patient_id": normalize_ids(ids),
+        "patient_label": ids.astype(str),
+        "in_time": _format(in_times, TIME_FORMAT),
+        "in_day": _format(in_times, DAY_FORMAT),
+        "out_day": _format(pd.Series(out_times).reset_index(drop=True), DAY_FORMAT),
+    }, ["patient_id", "in_time"])
+    return _upsert(conn, "icu_episodes", rows, columns, ["site", "patient_id", "in_time"])
+
+
+# 혈액배양 저장 (times: 의뢰 일시, results: 분리균, wards: 시행병동) → 저장한 행 수
+def upsert_cultures(conn, site, ids, times, results=None, wards=None):
+    ids = pd.Series(ids).reset_index(drop=True)
+    results = pd.Series(results if results is not None else [None] * len(ids)).reset_index(drop=True)
+    wards = pd.Series(wards if wards is not None else [None] * len(ids)).reset_index(drop=True)
+    rows, columns = _rows(site, {
+        "patient_id": normalize_ids(ids),
+        "patient_label": ids.astype(str),
+        "culture_time": _format(pd.Series(times).reset_index(drop=True), TIME_FORMAT),
+        "result": _text(results).fillna(""),
+        "ward": _text(wards),
+    }, ["patient_id", "culture_time", "result"])
+    return _upsert(conn, "cultures", rows, columns, ["site", "patient_id", "culture_time", "result"])
+
+
+# KONIS WRAP 등록 저장 (onset_days: 감염발생일, pathogens: 병원체명, lcbis: LCBI 종류) → 저장한 행 수
+def upsert_konis_registrations(conn, site, ids, onset_days, pathogens=None, lcbis=None):
+    ids = pd.Series(ids).reset_index(drop=True)
+    pathogens = pd.Series(pathogens if pathogens is not None else [None] * len(ids)).reset_index(drop=True)
+    lcbis = pd.Series(lcbis if lcbis is not None else [None] * len(ids)).reset_index(drop=True)
+    rows, columns = _rows(site, {
+        "patient_id": normalize_ids(ids),
+        "patient_label": ids.astype(str),
+        "onset_day": _format(pd.Series(onset_days).reset_index(drop=True), DAY_FORMAT),
+        "pathogen": _text(pathogens).fillna(""),
+        "lcbi": _text(lcbis),
+    }, ["patient_id", "onset_day", "pathogen"])
+    return _upsert(conn, "konis_registrations", rows, columns, ["site", "patient_id", "onset_day", "pathogen"])
+
+
+# 범위 조회 (site: 기관 코드, patients: 정리한 환자 ID 목록, None이면 그 기관의 전체 환자)
+# 환자 목록은 임시 테이블에 넣어 기본 키(기관, 환자 ID, 날짜) 인덱스로 조회
+# 처음 저장한 순서(rowid)대로 반환: KONIS 상세내용 상위 3건 등 파일 순서를 따르는 결과가 업로드 때와 같도록
+def _query(conn, table, site, where, params, patients):
+    where = ["t.site = ?"] + where
+    params = [_check_site(site)] + params
+    sql = f"SELECT t.* FROM {table} t"
+    if patients is not None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS query_patients (patient_id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM query_patients")
+        conn.executemany("INSERT OR IGNORE INTO query_patients VALUES (?)",
+                         ((patient,) for patient in pd.Series(patients).dropna().astype(str)))
+        sql += " JOIN query_patients p ON p.patient_id = t.patient_id"
+    sql += " WHERE " + " AND ".join(where) + " ORDER BY t.rowid"
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def _day(value, fmt=DAY_FORMAT):
+    return pd.Timestamp(value).strftime(fmt)
+
+
+# 환자 성별·생년월일 → birth_day는 datetime64
+def load_patients(conn, site, patients=None):
+    df = _query(conn, "patients", site, [], [], patients)
+    df["birth_day"] = pd.to_datetime(df["birth_day"], format=DAY_FORMAT)
+    return df
+
+
+# start~end 기간과 겹치는 입실 구간 (퇴실일 없음 = 재실 중) → in_time, in_day, out_day는 datetime64
+def load_icu_episodes(conn, site, start=None, end=None, patients=None):
+    where, params = [], []
+    if end is not None:
+        where.append("t.in_day <= ?")
+        params.append(_day(end))
+    if start is not None:
+        where.append("(t.out_day IS NULL OR t.out_day >= ?)")
+        params.append(_day(start))
+    df = _query(conn, "icu_episodes", site, where, params, patients)
+    df["in_time"] = pd.to_datetime(df["in_time"], format=TIME_FORMAT)
+    for col in ["in_day", "out_day"]:
+        df[col] = pd.to_datetime(df[col], format=DAY_FORMAT)
+    return df
+
+
+# start~end 날짜(끝 날짜 포함)에 의뢰한 혈액배양 → culture_time은 datetime64, 분리균이 없으면 NaN
+def load_cultures(conn, site, start=None, end=None, patients=None):
+    where, params = [], []
+    if start is not None:
+        where.append("t.culture_time >= ?")
+        params.append(_day(start))
+    if end is not None:
+        where.append("t.culture_time < ?")
+        params.append(_day(pd.Timestamp(end).normalize() + pd.Timedelta(days=1)))
+    df = _query(conn, "cultures", site, where, params, patients)
+    df["culture_time"] = pd.to_datetime(df["culture_time"], format=TIME_FORMAT)
+    df["result"] = df["result"].where(df["result"] != "")
+    return df
+
+
+# start~end 날짜에 감염이 발생한 KONIS WRAP 등록 → onset_day는 datetime64, 병원체명이 없으면 NaN
+def load_konis_registrations(conn, site, start=None, end=None, patients=None):
+    where, params = [], []
+    if start is not None:
+        where.append("t.onset_day >= ?")
+        params.append(_day(start))
+    if end is not None:
+        where.append("t.onset_day <= ?")
+        params.append(_day(end))
+    df = _query(conn, "konis_registrations", site, where, params, patients)
+    df["onset_day"] = pd.to_datetime(df["onset_day"], format=DAY_FORMAT)
+    df["pathogen"] = df["pathogen"].where(df["pathogen"] != "")
+    return df
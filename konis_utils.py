@@ -0,0 +1,443 @@
+## 세 앱(icu_culture_matcher, konis_wrap_who, icu_date_severance)에서 공통으로 쓰는 도우미 함수
+
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+KNOWN_DATE_FORMATS = [
+    "%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y", "%d/%m/%Y",
+    "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M", "%Y-%m-%d %H%M",
+    "%Y/%m/%d %H%M", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"
+]
+
+# 포맷 추론에 사용할 표본 크기
+DATE_SAMPLE_SIZE = 200
+
+# 변환 종류별로 기억해 둘 고유값 개수 (Streamlit 재실행 사이에도 모듈과 함께 유지됨)
+TRANSFORM_CACHE_SIZE = 100_000
+
+# 업로드 파일 파싱 결과를 보관할 최대 메모리 (MB, 환경변수 KONIS_UPLOAD_CACHE_MB로 변경)
+UPLOAD_CACHE_MB = int(os.environ.get("KONIS_UPLOAD_CACHE_MB", "512"))
+
+# 엑셀 날짜 일련번호(1900 날짜 체계)의 기준일
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+# 날짜 일련번호로 볼 숫자 범위 (1950-01-01 ~ 2099-12-31)
+# 범위 밖의 숫자(출생체중, 나이, 환자 번호 등)는 날짜로 바꾸지 않음
+EXCEL_SERIAL_MIN = 18264
+EXCEL_SERIAL_MAX = 73050
+
+_TIME_FIX_PATTERN = r'^(.*\s)(\d{2}):?(\d{2})(\d{2})$'
+_TIME_ONLY_PATTERN = r'^(\d{2})(\d{2})(\d{2})$'
+
+
+# 날짜 포맷 보정
+def fix_time_format(val):
+    val_str = str(val)
+
+    # 시간 정보가 붙은 형식에서 잘못된 6자리 숫자만 시간으로 고치기
+    # 예: "2025-03-08 075844" 또는 "2025-03-08 07:5844" → "2025-03-08 07:58:44"
+    match = re.match(r'(.*\s)(\d{2}):?(\d{2})(\d{2})$', val_str)
+    if match:
+        return f"{match.group(1)}{match.group(2)}:{match.group(3)}:{match.group(4)}"
+
+    # 혹시 그냥 6자리 숫자만 있는 경우에도 대응
+    match2 = re.match(r'(\d{2})(\d{2})(\d{2})$', val_str)
+    if match2:
+        return f"{match2.group(1)}:{match2.group(2)}:{match2.group(3)}"
+
+    return val_str
+
+
+# 셀 단위 날짜 파싱 (느린 경로: 컬럼 단위 변환에서 남은 값에만 사용)
+def parse_date_value(val):
+    if pd.isna(val): return pd.NaT
+    val = fix_time_format(val)
+    for fmt in KNOWN_DATE_FORMATS:
+        try:
+            return datetime.strptime(str(val), fmt)
+        except:
+            continue
+    try:
+        return pd.to_datetime(val, errors='coerce')
+    except:
+        return pd.NaT
+
+
+# 컬럼 전체에 시간 보정을 한 번에 적용 (fix_time_format과 같은 결과)
+def fix_time_format_series(values):
+    values = values.str.replace(_TIME_FIX_PATTERN, r'\1\2:\3:\4', regex=True)
+    return values.str.replace(_TIME_ONLY_PATTERN, r'\1:\2:\3', regex=True)
+
+
+# 표본에서 실제로 쓰인 포맷을 찾아 known_formats 순서대로 반환
+def infer_date_formats(values, sample_size=DATE_SAMPLE_SIZE):
+    if values.empty:
+        return []
+    step = max(len(values) // sample_size, 1)
+    sample = values.iloc[::step].head(sample_size)
+    found = []
+    for fmt in KNOWN_DATE_FORMATS:
+        parsed = pd.to_datetime(sample, format=fmt, errors="coerce")
+        if parsed.notna().any():
+            found.append(fmt)
+            sample = sample[parsed.isna()]
+            if sample.empty:
+                break
+    return found
+
+
+# 컬럼 단위 날짜 변환
+# 표본으로 포맷을 추론해 컬럼 전체를 한 번에 변환하고, 변환되지 않은 값만 셀 단위로 처리
+def parse_dates_column(series):
+    out = np.full(len(series), np.datetime64("NaT"), dtype="datetime64[ns]")
+    positions = np.flatnonzero(series.notna().to_numpy())
+    if len(positions) == 0:
+        return pd.Series(out, index=series.index, name=series.name)
+
+    values = fix_time_format_series(series.iloc[positions].astype(str).reset_index(drop=True))
+    for fmt in infer_date_formats(values):
+        parsed = pd.to_datetime(values, format=fmt, errors="coerce")
+        ok = parsed.notna().to_numpy()
+        out[positions[ok]] = parsed[ok].to_numpy()
+        positions, values = positions[~ok], values[~ok].reset_index(drop=True)
+        if len(positions) == 0:
+            return pd.Series(out, index=series.index, name=series.name)
+
+    result = pd.Series(out, index=series.index, name=series.name)
+    slow = series.iloc[positions].apply(parse_date_value)
+    try:
+        result.iloc[positions] = slow.to_numpy()
+    except (TypeError, ValueError):
+        # 시간대 정보가 있는 값 등 datetime64로 합칠 수 없는 경우 셀 단위 결과를 그대로 사용
+        result = result.astype(object)
+        result.iloc[positions] = slow.to_numpy()
+    return result
+
+
+_transform_caches = {}
+_transform_lock = threading.Lock()
+
+
+# 고유값 단위 변환
+# 컬럼을 factorize 해서 고유값마다 func를 한 번만 적용하고 결과를 전체 행에 펼침
+# key가 같은 변환의 결과는 크기 제한이 있는 캐시에 남겨 다음 실행에서 재사용
+# (캐시 항목은 입력 dtype·값의 타입·값으로 구분: 1, 1.0, True는 같은 값으로 취급되지 않음)
+# dtype을 주지 않으면 결과 값으로 dtype을 추론 (Int64 등 확장 dtype 입력은 결과 값이 같은 종류이면 입력 dtype 유지)
+def memo_transform(series, func, key, dtype=None):
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    if len(uniques) == 0:
+        return func(series)
+    uniques = list(uniques)
+    input_dtype = str(series.dtype)
+    entries = [(input_dtype, type(val).__name__, val) for val in uniques]
+
+    with _transform_lock:
+        cache = _transform_caches.setdefault(key, OrderedDict())
+        hits = {}
+        for entry in entries:
+            if entry in cache:
+                cache.move_to_end(entry)
+                hits[entry] = cache[entry]
+    misses = [entry for entry in entries if entry not in hits]
+    if misses:
+        computed = func(pd.Series([entry[-1] for entry in misses], dtype=series.dtype))
+        hits.update(zip(misses, computed.tolist()))
+        with _transform_lock:
+            for entry in misses:
+                cache[entry] = hits[entry]
+            while len(cache) > TRANSFORM_CACHE_SIZE:
+                cache.popitem(last=False)
+
+    mapped = pd.Series([hits[entry] for entry in entries], dtype=dtype)
+    if dtype is None and _keeps_input_dtype(series.dtype, uniques, mapped):
+        mapped = mapped.astype(series.dtype)
+        result = pd.Series(mapped.array.take(codes, allow_fill=True), index=series.index, name=series.name)
+    else:
+        result = pd.Series(mapped.to_numpy()[codes], index=series.index, name=series.name)
+    na_rows = codes == -1
+    if na_rows.any():
+        # 결측값은 종류(None, NaN, NaT 등)별로 func가 돌려주는 값을 그대로 사용
+        na_values = series[na_rows]
+        na_kinds = na_values.map(lambda v: type(v).__name__).to_numpy()
+        for kind in set(na_kinds):
+            sample = pd.concat([series[~na_rows].head(1), na_values[na_kinds == kind].head(1)])
+            result.iloc[np.flatnonzero(na_rows)[na_kinds == kind]] = func(sample).iloc[-1]
+    return result
+
+
+# 확장 dtype(Int64, boolean, string 등, 범주형 제외) 입력에서 결과 값이 입력 값과 같은 종류인지
+# (예: Int64 → 정수 결과는 Int64 유지, Int64 → 날짜 결과는 추론한 dtype 사용)
+def _keeps_input_dtype(input_dtype, uniques, mapped):
+    if not pd.api.types.is_extension_array_dtype(input_dtype) or isinstance(input_dtype, pd.CategoricalDtype):
+        return False
+    return pd.api.types.infer_dtype(mapped, skipna=True) == pd.api.types.infer_dtype(uniques, skipna=True)
+
+
+# 캐시 비우기 (메모리 확보용)
+def clear_transform_cache():
+    with _transform_lock:
+        _transform_caches.clear()
+
+
+# 날짜 자동 인식
+def parse_dates_safe(series):
+    return memo_transform(series, parse_dates_column, "parse_dates")
+
+
+# 셀 종류 구분: 엑셀 날짜 셀(datetime)과 날짜 일련번호(EXCEL_SERIAL_MIN~MAX 범위의 숫자) 셀
+def native_date_kinds(series):
+    values = series.astype(object)
+    is_datetime = values.map(lambda v: isinstance(v, datetime)).to_numpy(dtype=bool)
+    is_serial = values.map(
+        lambda v: isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool)
+        and EXCEL_SERIAL_MIN <= v < EXCEL_SERIAL_MAX + 1
+    ).to_numpy(dtype=bool)
+    return is_datetime, is_serial
+
+
+# 엑셀에서 읽은 날짜 컬럼 변환
+# 날짜 셀은 그대로, 일련번호는 기준일 + 일수로 바꾸고, 실제 문자열인 셀만 parse_dates_safe로 파싱
+def parse_dates_native(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    values = series.astype(object)
+    is_datetime, is_serial = native_date_kinds(values)
+    is_text = ~is_datetime & ~is_serial & values.notna().to_numpy()
+    if not is_datetime.any() and not is_serial.any():
+        return parse_dates_safe(series)
+
+    result = pd.Series(np.full(len(values), np.datetime64("NaT"), dtype="datetime64[ns]"),
+                       index=series.index, name=series.name)
+    if is_datetime.any():
+        result.iloc[np.flatnonzero(is_datetime)] = pd.to_datetime(values[is_datetime]).to_numpy()
+    if is_serial.any():
+        days = values[is_serial].astype(float)
+        result.iloc[np.flatnonzero(is_serial)] = (EXCEL_EPOCH + pd.to_timedelta(days, unit="D")).to_numpy()
+    if is_text.any():
+        parsed = parse_dates_safe(values[is_text].astype(str))
+        try:
+            result.iloc[np.flatnonzero(is_text)] = parsed.to_numpy()
+        except (TypeError, ValueError):
+            result = result.astype(object)
+            result.iloc[np.flatnonzero(is_text)] = parsed.to_numpy()
+    return result
+
+
+# parse_dates_native 후 날짜(일) 단위로 변환
+# datetime.date 객체 대신 시각을 0시로 맞춘 datetime64로 두어 비교·날짜 계산이 벡터 연산으로 처리됨
+# (화면·파일 출력에서 날짜 객체가 필요하면 to_days로 변환)
+def parse_days_native(series):
+    return pd.to_datetime(parse_dates_native(series), errors="coerce").dt.normalize()
+
+
+# datetime 컬럼을 날짜(일) 단위로 변환 (.dt.date)
+def to_days(series):
+    return memo_transform(series, lambda s: pd.to_datetime(s).dt.date, "to_days", object)
+
+
+# 날짜를 문자열로 표시 (예: "%Y-%m-%d")
+def format_dates(series, fmt):
+    return memo_transform(series, lambda s: pd.to_datetime(s, errors="coerce").dt.strftime(fmt), ("format_dates", fmt), object)
+
+
+# 결합된 컬럼(예: "M/3d")에서 성별만 분리
+def split_gender(series, delimiter, position):
+    idx = 0 if position == "앞" else -1
+    return memo_transform(series, lambda s: s.str.split(delimiter).str[idx], ("split_gender", delimiter, idx), object)
+
+
+# 환자 ID 표기 통일: 앞뒤 공백, 엑셀 숫자 변환으로 붙은 ".0", 숫자 ID 앞의 0 채움을 제거 (빈 값·결측은 결측)
+# 예: " 0012345", "12345.0", "12345" → "12345"
+def normalize_ids(series):
+    missing = series.isna().to_numpy()
+    ids = series.astype(str).str.strip()
+    ids = ids.str.replace(r"^(\d+)\.0+$", r"\1", regex=True)
+    is_number = ids.str.fullmatch(r"\d+")
+    ids = ids.where(~is_number, ids.str.lstrip("0").replace("", "0"))
+    return ids.mask(missing | (ids == "").to_numpy())
+
+
+# 여러 파일의 환자 ID 컬럼을 하나의 정수 코드 표로 변환 (표기가 달라도 같은 환자 → 같은 코드)
+# 반환: (입력 컬럼 순서대로 코드 컬럼(Int64, 결측 → <NA>), 코드 → 원래 ID 표기 배열)
+# 원래 표기는 먼저 넘긴 컬럼에서 처음 나온 값을 사용 (출력할 때 restore_ids로 복원)
+def encode_ids(*columns):
+    raw = pd.concat([pd.Series(col.to_numpy(dtype=object)) for col in columns], ignore_index=True)
+    raw_codes, raw_uniques = pd.factorize(raw)
+    ids_codes, canonical = pd.factorize(normalize_ids(pd.Series(raw_uniques, dtype=object)))
+
+    labels = np.empty(len(canonical), dtype=object)
+    known = ids_codes >= 0
+    labels[ids_codes[known][::-1]] = np.asarray(raw_uniques, dtype=object)[known][::-1]
+
+    codes = np.where(raw_codes >= 0, ids_codes[np.maximum(raw_codes, 0)], -1)
+    encoded = []
+    start = 0
+    for col in columns:
+        part = pd.array(codes[start:start + len(col)], dtype="Int64")
+        part[part < 0] = pd.NA
+        encoded.append(pd.Series(part, index=col.index, name=col.name))
+        start += len(col)
+    return encoded, labels
+
+
+# 정수 코드를 원래 환자 ID 표기로 (결측 → NaN)
+def restore_ids(codes, labels):
+    codes = pd.Series(codes).astype("Int64")
+    restored = np.full(len(codes), np.nan, dtype=object)
+    present = codes.notna().to_numpy()
+    restored[present] = labels[codes[present].to_numpy(dtype=np.int64)]
+    return pd.Series(restored, index=codes.index, name=codes.name)
+
+
+_upload_cache = OrderedDict()
+_upload_cache_bytes = 0
+_upload_lock = threading.Lock()
+
+
+# 업로드 파일 읽기 (xlsx 또는 csv)
+# 파일 내용 해시와 읽기 옵션이 같으면 Streamlit 재실행 때 다시 파싱하지 않고 보관된 결과를 복사해 반환
+# 보관 용량이 UPLOAD_CACHE_MB를 넘으면 가장 오래 쓰지 않은 결과부터 삭제
+def read_upload(file, **options):
+    global _upload_cache_bytes
+    data = file.getvalue()
+    is_csv = file.name.lower().endswith(".csv")
+    key = (hashlib.sha256(data).hexdigest(), is_csv, repr(sorted(options.items())))
+
+    with _upload_lock:
+        if key in _upload_cache:
+            _upload_cache.move_to_end(key)
+            return _upload_cache[key][0].copy()
+
+    df = pd.read_csv(io.BytesIO(data), **options) if is_csv else pd.read_excel(io.BytesIO(data), **options)
+    size = int(df.memory_usage(deep=True).sum())
+    with _upload_lock:
+        if key not in _upload_cache and size <= UPLOAD_CACHE_MB * 1024 * 1024:
+            _upload_cache[key] = (df.copy(), size)
+            _upload_cache_bytes += size
+            while _upload_cache_bytes > UPLOAD_CACHE_MB * 1024 * 1024:
+                _, (_, old_size) = _upload_cache.popitem(last=False)
+                _upload_cache_bytes -= old_size
+    return df
+
+
+# 업로드 캐시 비우기
+def clear_upload_cache():
+    global _upload_cache_bytes
+    with _upload_lock:
+        _upload_cache.clear()
+        _upload_cache_bytes = 0
+
+
+# 업로드 파일의 컬럼명(첫 행)만 읽기
+def read_columns(file):
+    return read_upload(file, nrows=0).columns
+
+
+# 업로드 파일에서 선택한 컬럼만 읽기
+# 날짜 컬럼(date_columns)은 엑셀 셀 값(datetime, 일련번호)을 그대로 두고 나머지는 문자열로 읽음
+# 값 종류가 적은 컬럼(category_columns: 병동, 분리균, 성별 등)은 범주형으로 읽어 메모리를 줄임
+def read_upload_columns(file, columns, date_columns=(), category_columns=()):
+    usecols = sorted(set(col for col in columns if col is not None), key=str)
+    dtype = {col: (object if col in date_columns else str) for col in usecols}
+    df = read_upload(file, usecols=usecols, dtype=dtype)
+    return df.astype({col: "category" for col in usecols if col in category_columns and col not in date_columns})
+
+
+# 결과 미리보기 쪽당 행 수 선택지
+PREVIEW_PAGE_SIZES = [50, 100, 500, 1000]
+
+
+# 표를 page_size 행씩 나눈 쪽 수 (빈 표도 1쪽)
+def page_count(df, page_size):
+    return max(-(-len(df) // page_size), 1)
+
+
+# 표의 한 쪽만 잘라 반환 → (쪽 표, 실제 쪽 번호, 전체 쪽 수) (page는 1부터, 범위를 벗어나면 첫/마지막 쪽)
+# 화면에는 이 쪽만 보내 결과 전체를 브라우저로 전송하지 않음
+def page_rows(df, page, page_size):
+    pages = page_count(df, page_size)
+    page = min(max(int(page), 1), pages)
+    return df.iloc[(page - 1) * page_size:page * page_size], page, pages
+
+
+# 업로드 파일을 이름이 붙은 BytesIO로 복사 (Streamlit 업로드 객체 대신 다른 프로세스로 넘길 때, None은 그대로)
+def copy_upload(file):
+    if file is None:
+        return None
+    upload = io.BytesIO(file.getvalue())
+    upload.name = file.name
+    return upload
+
+
+# 디스크의 파일을 업로드 파일처럼 열기 (화면 없이 실행할 때 read_upload에 그대로 전달)
+def open_upload(path):
+    with open(path, "rb") as f:
+        upload = io.BytesIO(f.read())
+    upload.name = os.path.basename(path)
+    return upload
+
+
+# 단계별 소요시간·메모리 기록 (timings: 기록을 모을 list, None이면 기록하지 않음)
+# with timed_stage(timings, "read") as stage: ...; stage["rows"] = len(df)
+#  → timings에 {"stage": "read", "seconds": 0.12, "rows": 1000, "peak_mb": 35.2} 추가
+# peak_mb는 memory_tracing 안에서만 기록 (단계 시작 시점보다 늘어난 최대 사용량)
+@contextmanager
+def timed_stage(timings, stage):
+    record = {"stage": stage, "seconds": 0.0, "rows": None, "peak_mb": None}
+    tracing = timings is not None and tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - started
+        if tracing:
+            record["peak_mb"] = (tracemalloc.get_traced_memory()[1] - baseline) / 2**20
+        if timings is not None:
+            timings.append(record)
+
+
+# 메모리 측정 켜기 (tracemalloc은 프로세스 전체에 적용되고 켜져 있는 동안 처리가 느려짐)
+@contextmanager
+def memory_tracing(enabled=True):
+    started = enabled and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+STAGE_COLUMNS = {"stage": "단계", "seconds": "소요시간(초)", "rows": "행 수", "peak_mb": "최대 메모리(MB)"}
+
+
+# 단계별 기록 → 화면 표시용 표
+def stage_table(timings):
+    table = pd.DataFrame(timings, columns=list(STAGE_COLUMNS))
+    table["seconds"] = table["seconds"].round(3)
+    table["peak_mb"] = table["peak_mb"].astype(float).round(1)
+    table["rows"] = table["rows"].astype("Int64")
+    return table.rename(columns=STAGE_COLUMNS)
+
+
+# 단계별 기록 → JSON 로그 한 줄 (fields: 기관, 작업 등 함께 남길 값)
+def stage_log_line(timings, **fields):
+    stages = [{key: (round(value, 4) if isinstance(value, float) else value) for key, value in record.items()}
+              for record in timings]
+    return json.dumps({**fields, "stages": stages}, ensure_ascii=False, default=str)
@@ -1,11 +1,14 @@
 ## py -m streamlit run konis_wrap_who_streamlit.py
 
-import pandas as pd
-import io
-from datetime import datetime, timedelta
-import re
 from collections import Counter
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from konis_utils import read_columns, read_upload_columns, copy_upload, timed_stage, stage_table, page_rows, page_count, PREVIEW_PAGE_SIZES
+from konis_sessions import put_result, get_result, drop_result, session_bytes, SESSION_IDLE_MINUTES
+from konis_jobs import start_job, wait_job, cancel_job, job_running, job_progress, store_stages, ESTIMATE_STAGES, JOB_DONE, JOB_FAILED
+from konis_store import STORE_PATH, STORE_SITE
+from konis_export import available_formats, export_bytes
+from konis_pipeline import estimate_ids, estimate_summary, dump_profile, DEFAULT_WHO_PROFILE, KONIS_SOURCE, ICU_SOURCE, CULTURE_SOURCE
 
 # 자동 컬럼 탐색
 def find_column(candidates, columns):
@@ -15,38 +18,6 @@ def find_column(candidates, columns):
                 return col
     return None
 
-# 날짜 포맷 보정
-def fix_time_format(val):
-    val_str = str(val)
-    match = re.match(r'(.*\s)(\d{2}):?(\d{2})(\d{2})$', val_str)
-    if match:
-        return f"{match.group(1)}{match.group(2)}:{match.group(3)}:{match.group(4)}"
-    match2 = re.match(r'(\d{2})(\d{2})(\d{2})$', val_str)
-    if match2:
-        return f"{match2.group(1)}:{match2.group(2)}:{match2.group(3)}"
-    return val_str
-
-# 날짜 파싱 함수
-def parse_dates_safe(series):
-    known_formats = [
-        "%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y", "%d/%m/%Y",
-        "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M", "%Y-%m-%d %H%M",
-        "%Y/%m/%d %H%M", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"
-    ]
-    def try_parse(val):
-        if pd.isna(val): return pd.NaT
-        val = fix_time_format(val)
-        for fmt in known_formats:
-            try:
-                return datetime.strptime(str(val), fmt)
-            except:
-                continue
-        try:
-            return pd.to_datetime(val, errors='coerce')
-        except:
-            return pd.NaT
-    return series.apply(try_parse)
-
 # 구분자 자동 감지
 def detect_delimiter(series):
     sample_values = series.dropna().astype(str).head(100)
@@ -77,41 +48,42 @@ file2 = st.file_uploader("👶 중환자실 입퇴실 파일", type=["xlsx", "cs
 file3 = st.file_uploader("🧫 혈액배양 파일", type=["xlsx", "csv"])
 
 if file1 and file2 and file3:
-    df1 = pd.read_excel(file1, dtype=str) if file1.name.endswith("xlsx") else pd.read_csv(file1, dtype=str)
-    df2 = pd.read_excel(file2, dtype=str) if file2.name.endswith("xlsx") else pd.read_csv(file2, dtype=str)
-    df3 = pd.read_excel(file3, dtype=str) if file3.name.endswith("xlsx") else pd.read_csv(file3, dtype=str)
+    # 1단계: 컬럼명(첫 행)만 읽어서 컬럼 선택 화면 구성
+    cols1 = read_columns(file1)
+    cols2 = read_columns(file2)
+    cols3 = read_columns(file3)
 
     st.subheader("🚨 KONIS WRAP 등록환자 파일 컬럼 선택")
-    caseno = st.selectbox("증례코드", df1.columns,
-                          index=df1.columns.get_loc(find_column(["증례코드"], df1.columns) or df1.columns[1]))
-    dob1 = st.selectbox("📅 생년월일", df1.columns, index=df1.columns.get_loc(find_column(["생년월일", "birthdate", "dob"], df1.columns) or df1.columns[0]))
-    gender1 = st.selectbox("👦👧 성별", df1.columns,
-                           index=df1.columns.get_loc(find_column(["성별", "gender", "sex"], df1.columns) or df1.columns[0]))
-    date_icu1 = st.selectbox("📅 중환자실 입원일", df1.columns,
-                             index=df1.columns.get_loc(find_column(["중환자실입원일", "admission", "입원"], df1.columns) or df1.columns[6]))
-    date_infection = st.selectbox("🌡️ 감염발생일", df1.columns,
-                                  index=df1.columns.get_loc(find_column(["감염발생일", "감염"], df1.columns) or df1.columns[10]))
+    caseno = st.selectbox("증례코드", cols1,
+                          index=cols1.get_loc(find_column(["증례코드"], cols1) or cols1[1]))
+    dob1 = st.selectbox("📅 생년월일", cols1, index=cols1.get_loc(find_column(["생년월일", "birthdate", "dob"], cols1) or cols1[0]))
+    gender1 = st.selectbox("👦👧 성별", cols1,
+                           index=cols1.get_loc(find_column(["성별", "gender", "sex"], cols1) or cols1[0]))
+    date_icu1 = st.selectbox("📅 중환자실 입원일", cols1,
+                             index=cols1.get_loc(find_column(["중환자실입원일", "admission", "입원"], cols1) or cols1[6]))
+    date_infection = st.selectbox("🌡️ 감염발생일", cols1,
+                                  index=cols1.get_loc(find_column(["감염발생일", "감염"], cols1) or cols1[10]))
 
     st.subheader("👶 중환자실 입퇴실 파일 컬럼 선택")
-    id2 = st.selectbox("🆔 환자ID", df2.columns,
-                       index=df2.columns.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], df2.columns) or df2.columns[0]))
-    date_icu2 = st.selectbox("📅 중환자실 입원일", df2.columns,
-                             index=df2.columns.get_loc(find_column(["입실"], df2.columns) or df2.columns[0]))
-    date_icu2_out = st.selectbox("📅 중환자실 퇴원일", df2.columns,
-                                 index=df2.columns.get_loc(find_column(["퇴실"], df2.columns) or df2.columns[0]))
+    id2 = st.selectbox("🆔 환자ID", cols2,
+                       index=cols2.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], cols2) or cols2[0]))
+    date_icu2 = st.selectbox("📅 중환자실 입원일", cols2,
+                             index=cols2.get_loc(find_column(["입실"], cols2) or cols2[0]))
+    date_icu2_out = st.selectbox("📅 중환자실 퇴원일", cols2,
+                                 index=cols2.get_loc(find_column(["퇴실"], cols2) or cols2[0]))
 
     st.subheader("🧫 혈액배양 파일 컬럼 선택")
-    id3 = st.selectbox("🆔 환자ID", df3.columns,
-                       index=df3.columns.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], df3.columns) or df3.columns[0]))
-    date_culture = st.selectbox("📅 혈액배양 시행일", df3.columns,
-                                index=df3.columns.get_loc(find_column(["시행일", "채취일", "검사일", "접수일"], df3.columns) or df3.columns[0]))
-    result_culture = st.selectbox("🦠 혈액배양 결과(분리균)", df3.columns,
-                                  index=df3.columns.get_loc(find_column(["미생물", "결과"], df3.columns) or df3.columns[0]))
-
-        # 병합에 사용할 전체 후보 파일
+    id3 = st.selectbox("🆔 환자ID", cols3,
+                       index=cols3.get_loc(find_column(["환자번호", "병록번호", "patientid", "patient_id"], cols3) or cols3[0]))
+    date_culture = st.selectbox("📅 혈액배양 시행일", cols3,
+                                index=cols3.get_loc(find_column(["시행일", "채취일", "검사일", "접수일"], cols3) or cols3[0]))
+    result_culture = st.selectbox("🦠 혈액배양 결과(분리균)", cols3,
+                                  index=cols3.get_loc(find_column(["미생물", "결과"], cols3) or cols3[0]))
+
+        # 병합에 사용할 전체 후보 파일 (파일, 컬럼명)
     all_column_sources = {
-        "중환자실 파일": df2,
-        "혈액배양 파일": df3
+        "중환자실 파일": (file2, cols2),
+        "혈액배양 파일": (file3, cols3)
     }
 
     all_column_options = ["중환자실 파일"] + [k for k in all_column_sources.keys() if k != "중환자실 파일"]
@@ -119,121 +91,137 @@ if file1 and file2 and file3:
     st.markdown("---")
     st.markdown("📅 생년월일 정보")
     birth_source = st.selectbox("📁 생년월일이 있는 파일", all_column_options, key="birth_src", index=0)
-    birth_df = all_column_sources[birth_source]
-    birth_id_col = st.selectbox("🆔 환자 ID 컬럼", birth_df.columns, key="birth_id", index=birth_df.columns.get_loc(find_column(["환자번호", "병록번호", "patientid"], birth_df.columns) or birth_df.columns[0]))
-    birth_col = st.selectbox("📅 생년월일 컬럼", birth_df.columns, key="birth_col", index=birth_df.columns.get_loc(find_column(["생년월일", "birthdate", "dob"], birth_df.columns) or birth_df.columns[0]))
+    birth_cols = all_column_sources[birth_source][1]
+    birth_id_col = st.selectbox("🆔 환자 ID 컬럼", birth_cols, key="birth_id", index=birth_cols.get_loc(find_column(["환자번호", "병록번호", "patientid"], birth_cols) or birth_cols[0]))
+    birth_col = st.selectbox("📅 생년월일 컬럼", birth_cols, key="birth_col", index=birth_cols.get_loc(find_column(["생년월일", "birthdate", "dob"], birth_cols) or birth_cols[0]))
 
     st.markdown("---")
     st.markdown("### 👦👧 성별 정보")
     gender_source = st.selectbox("📁 성별이 있는 파일", all_column_options, key="gender_src", index=0)
-    gender_df = all_column_sources[gender_source]
-    gender_id_col = st.selectbox("🆔 환자 ID 컬럼", gender_df.columns, key="gender_id", index=gender_df.columns.get_loc(find_column(["환자번호", "병록번호", "patientid"], gender_df.columns) or gender_df.columns[0]))
+    gender_file, gender_cols = all_column_sources[gender_source]
+    gender_id_col = st.selectbox("🆔 환자 ID 컬럼", gender_cols, key="gender_id", index=gender_cols.get_loc(find_column(["환자번호", "병록번호", "patientid"], gender_cols) or gender_cols[0]))
 
     gender_combined = st.checkbox("성별이 다른 정보(예: 나이)와 하나의 컬럼에 함께 있음")
     if gender_combined:
-        combined_col = st.selectbox("📑 결합된 컬럼명", gender_df.columns, key="combined_col", index=gender_df.columns.get_loc(find_column(["성별/나이", "S/A", "S|A"], gender_df.columns) or gender_df.columns[0]))
-        detected_delim = detect_delimiter(gender_df[combined_col])
+        combined_col = st.selectbox("📑 결합된 컬럼명", gender_cols, key="combined_col", index=gender_cols.get_loc(find_column(["성별/나이", "S/A", "S|A"], gender_cols) or gender_cols[0]))
+        detected_delim = detect_delimiter(read_upload_columns(gender_file, [combined_col])[combined_col])
         delimiter = st.text_input("🔹 구분자 (예: /)", value=detected_delim)
         position = st.radio("🔹 성별은 구분자를 기준으로 어디에 있나요?", ["앞", "뒤"], horizontal=True)
     else:
-        gender_col = st.selectbox("성별 컬럼", gender_df.columns, key="gender_col", index=gender_df.columns.get_loc(find_column(["성별", "gender", "sex"], gender_df.columns) or gender_df.columns[0]))
+        gender_col = st.selectbox("성별 컬럼", gender_cols, key="gender_col", index=gender_cols.get_loc(find_column(["성별", "gender", "sex"], gender_cols) or gender_cols[0]))
+
+    # 화면에서 선택한 컬럼 매핑 (명령줄·일괄 실행용 프로필과 같은 형식)
+    profile = {
+        "caseno": caseno, "dob": dob1, "gender": gender1, "icu_date": date_icu1, "infection_date": date_infection,
+        "icu_id": id2, "icu_in": date_icu2, "icu_out": date_icu2_out,
+        "culture_id": id3, "culture_date": date_culture, "culture_result": result_culture,
+        "birth_source": birth_source, "birth_id": birth_id_col, "birth_col": birth_col,
+        "gender_source": gender_source, "gender_id": gender_id_col,
+        "gender_col": None if gender_combined else gender_col,
+        "gender_combined_col": combined_col if gender_combined else None,
+    }
+    if gender_combined:
+        profile.update(gender_delimiter=delimiter, gender_position=position)
+
+    st.download_button("💾 컬럼 설정 저장 (일괄 실행용 프로필)", data=dump_profile(profile, DEFAULT_WHO_PROFILE),
+                       file_name="who_profile.json", mime="application/json")
+
+    export_format = st.radio("📄 다운로드 파일 형식", available_formats(), horizontal=True,
+                             help="결과가 큰 경우 CSV 또는 Parquet 형식이 더 빠르고 가볍습니다")
 
+    profile_stages = st.sidebar.checkbox("⏱️ 단계별 소요시간·메모리 측정", key="profile_stages",
+                                        help="처리 단계마다 걸린 시간, 행 수, 최대 메모리 사용량을 표시합니다 (측정하는 동안 처리가 조금 느려집니다)")
+    # 로컬 저장소는 한 기관 전용 서버(KONIS_STORE_PATH, KONIS_STORE_SITE 설정)에서만 사용
+    use_store = bool(STORE_PATH and STORE_SITE) and st.sidebar.checkbox(
+        "💾 로컬 저장소 사용", key="use_store",
+        help=f"올린 입실 구간·혈액배양·성별·생년월일을 이 서버의 로컬 저장소({STORE_SITE})에 누적하고, "
+             "이번에 올리지 않은 입실 구간·혈액배양을 저장소에서 불러와 함께 추정합니다")
+
+    # ID 추정은 서버 공용 프로세스 풀에서 실행 (위젯을 바꿔 화면이 다시 그려져도 작업은 이어짐, 진행 중인 이전 작업은 취소)
+    session = get_script_run_ctx().session_id
     if st.button("🔁 매칭 실행"):
-        if gender_combined:
-            comb_df = gender_df[[gender_id_col, combined_col]].copy()
-            comb_df = comb_df.drop_duplicates(subset=[gender_id_col])
-            if position == "앞":
-                comb_df['gender'] = comb_df[combined_col].str.split(delimiter).str[0]
-            else:
-                comb_df['gender'] = comb_df[combined_col].str.split(delimiter).str[-1]
-            gender_df = comb_df[[gender_id_col,'gender']]
+        if job_running(st.session_state.get("who_job")):
+            cancel_job(st.session_state["who_job"])
+        files = {KONIS_SOURCE: file1, ICU_SOURCE: file2, CULTURE_SOURCE: file3}
+        st.session_state["who_job"] = start_job(estimate_ids, {name: copy_upload(file) for name, file in files.items()},
+                                                {**profile, "site": STORE_SITE} if use_store else profile,
+                                                session=session, trace_memory=profile_stages,
+                                                stages=store_stages(ESTIMATE_STAGES) if use_store else ESTIMATE_STAGES,
+                                                store=STORE_PATH if use_store else None)
+
+    # 진행 상황 (1초마다 갱신, 작업이 끝나면 결과를 세션 결과 보관소로 옮기고 화면 전체를 다시 그림)
+    @st.fragment(run_every=1.0)
+    def show_who_job():
+        job = st.session_state["who_job"]
+        if job_running(job):
+            fraction, text = job_progress(job)
+            st.progress(fraction, text=text)
+            if st.button("⏹️ 작업 취소", disabled=job["cancel_event"].is_set()):
+                cancel_job(job)
+            return
+
+        del st.session_state["who_job"]
+        if job["status"] == JOB_DONE:
+            put_result(session, "who", job["result"])
+            st.session_state["who_summary"] = estimate_summary(job["result"], caseno)
+            st.session_state["who_page"] = 1
+            drop_result(session, "who_payloads")
+            st.session_state["who_timings"] = list(job["timings"])
+            st.session_state["who_done"] = True
+        elif job["status"] == JOB_FAILED:
+            st.session_state["who_notice"] = f"❌ ID 추정 중 오류가 발생했습니다: {job['error']}"
         else:
-            gender_df = gender_df.drop_duplicates(subset=[gender_id_col])
-            gender_df = gender_df[[gender_id_col, gender_col]].rename(columns={gender_col: 'gender'})
-    
-        # df 정리
-        columns_to_use = [caseno, dob1, gender1, date_icu1, date_infection]
-        optional_cols = ['재태연령(주)', '재태연령(일)', '출생체중', 'LCBI종류', '병원체명1', '병원체명2']
-        columns_to_use += [col for col in optional_cols if col in df1.columns]
-        df1 = df1[columns_to_use]
-        df2 = df2[[id2, date_icu2, date_icu2_out]] ## ICU
-        df3 = df3[[id3, date_culture, result_culture]] ## culture
-        birth_df = birth_df.drop_duplicates(subset=[birth_id_col])
-        birth_df = birth_df[[birth_id_col, birth_col]]
-        gender_df = gender_df[[gender_id_col, 'gender']]
-
-        # 날짜 변환
-        for col in [dob1, date_icu1, date_infection]:
-            df1[col] = parse_dates_safe(df1[col]).dt.date
-        for col in [date_icu2, date_icu2_out]:
-            df2[col] = parse_dates_safe(df2[col]).dt.date
-        df3[date_culture] = parse_dates_safe(df3[date_culture]).dt.date
-        birth_df[birth_col] = parse_dates_safe(birth_df[birth_col]).dt.date
-
-        # 병합
-        merged = pd.merge(df3, df2, left_on=id3, right_on=id2, how='inner')
-        
-        # 날짜 계산      
-        merged['culture_date_day'] = merged[date_culture].copy()
-        merged['icu_in_day'] = merged[date_icu2].copy()
-        merged['icu_out_day'] = merged[date_icu2_out].copy()
-        merged['icu_day_start'] = merged['icu_in_day'] + timedelta(days=2)
-        merged['icu_day_end'] = merged['icu_out_day'] + timedelta(days=1)
-        merged = merged.drop_duplicates(subset=[id3, 'culture_date_day', 'icu_in_day'])
-
-        # 감시기간 포함 조건
-        condition_matched = (
-            (merged['icu_day_start'].notna()) &
-            (merged['culture_date_day'] >= merged['icu_day_start']) &
-            (
-                (merged['culture_date_day'] <= merged['icu_day_end']) |
-                (merged['icu_day_end'].isna())
-            )
-        )
-        merged2 = merged.loc[condition_matched].copy()
-        merged3 = pd.merge(merged2, birth_df, left_on=id3, right_on=birth_id_col, how='left')
-        merged3 = pd.merge(merged3, gender_df, left_on=id3, right_on=gender_id_col, how='left')
-
-
-        # 성별, 생년월일 기준 병합
-        result = []
-        for i, row in df1.iterrows():
-            g, dob, icu_d, inf_d, case_id = row[gender1], row[dob1], row[date_icu1], row[date_infection], row[caseno]
-            candidates = merged3[
-                (merged3['gender'] == g) &
-                (merged3[birth_col] == dob) &
-                (merged3['icu_in_day'] == icu_d) &
-                (merged3['culture_date_day'] >= inf_d) &
-                (merged3['culture_date_day'] <= inf_d + timedelta(days=2))
-            ]
-            top_candidates = candidates[[id3, result_culture]].drop_duplicates().head(3)
-            if not top_candidates.empty:
-                for _, cand in top_candidates.iterrows():
-                    result.append({
-                        caseno: case_id,
-                        "추정ID": cand[id3],
-                        "추정ID분리균": cand[result_culture]
-                    })
-            else:
-                result.append({
-                    caseno: case_id,
-                    "추정ID": "",
-                    "추정ID분리균": ""
-                })
-
-        result_df = pd.DataFrame(result)
-        sub_cols = [col for col in df1.columns if col != caseno]
-        final = pd.merge(df1[[caseno] + sub_cols], result_df, on=caseno, how='right').drop_duplicates()
+            st.session_state["who_notice"] = "⏹️ ID 추정 작업을 취소했습니다."
+        st.rerun()
+
+    if "who_job" in st.session_state:
+        show_who_job()
+    if "who_notice" in st.session_state:
+        st.info(st.session_state.pop("who_notice"))
+
+    final = get_result(session, "who") if st.session_state.get("who_done", False) else None
+    if st.session_state.get("who_done", False) and final is None:
+        st.session_state["who_done"] = False
+        st.info(f"⌛ {SESSION_IDLE_MINUTES:g}분 이상 사용하지 않아 추정 결과를 삭제했습니다. 매칭을 다시 실행해 주세요.")
+
+    if final is not None:
+        timings = st.session_state["who_timings"]
 
         # final = final[["추정ID후보"] + [col for col in final.columns if col != "추정ID후보"]]
 
         st.success("✅ 추정 완료!")
-        st.dataframe(final, use_container_width=True, hide_index=True)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            final.to_excel(writer, index=False)
-        output.seek(0)
-        st.download_button("📥 결과 다운로드 (.xlsx)", data=output,
-                           file_name="NICU_감염환자자료_ids.xlsx",
-                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        for col, (label, count) in zip(st.columns(len(st.session_state["who_summary"])),
+                                       st.session_state["who_summary"].items()):
+            col.metric(label, f"{count:,}")
+
+        # 미리보기: 한 쪽만 화면에 보냄 (전체 결과는 다운로드 파일로 확인)
+        size_col, page_col = st.columns(2)
+        page_size = size_col.selectbox("쪽당 행 수", PREVIEW_PAGE_SIZES, index=1, key="who_page_size")
+        pages = page_count(final, page_size)
+        # 쪽당 행 수를 늘려 쪽 수가 줄면 입력값을 마지막 쪽으로 (입력란은 max_value를 넘는 값을 받지 않음)
+        if st.session_state.get("who_page", 1) > pages:
+            st.session_state["who_page"] = pages
+        page = page_col.number_input("쪽", min_value=1, max_value=pages, step=1, key="who_page")
+        page_df, page, pages = page_rows(final, page, page_size)
+        st.dataframe(page_df, use_container_width=True, hide_index=True)
+        first = (page - 1) * page_size
+        st.caption(f"{len(final):,}행 중 {first + min(len(page_df), 1):,}–{first + len(page_df):,}번째 ({page}/{pages}쪽)")
+
+        # 다운로드 파일은 결과·형식마다 한 번만 생성 (공용 프로세스 풀에서 만듦)
+        payloads = get_result(session, "who_payloads") or {}
+        if export_format not in payloads:
+            with st.spinner("다운로드 파일을 만드는 중..."), timed_stage(timings, "export") as stage:
+                payloads[export_format] = wait_job(start_job(export_bytes, final, export_format, session=session))
+                stage["rows"] = len(final)
+            put_result(session, "who_payloads", payloads)
+        data, ext, mime = payloads[export_format]
+        st.download_button(f"📥 결과 다운로드 (.{ext})", data=data,
+                           file_name=f"NICU_감염환자자료_ids.{ext}",
+                           mime=mime)
+        st.caption(f"이 화면에 보관 중인 결과·다운로드 파일: {session_bytes(session) / 1024 ** 2:.1f}MB "
+                   f"({SESSION_IDLE_MINUTES:g}분 동안 사용하지 않으면 삭제)")
+
+        # 단계별 소요시간·메모리 (사이드바에서 측정을 켠 경우)
+        if profile_stages:
+            with st.expander("⏱️ 단계별 소요시간·메모리"):
+                st.dataframe(stage_table(timings), hide_index=True)
@@ -0,0 +1,134 @@
+## 회귀 테스트 공통 자료: 작은 가상 혈액배양·입퇴실·KONIS 파일과 프로필
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from konis_pipeline import CULTURE_SOURCE, ICU_SOURCE, BSI_SOURCE, KONIS_SOURCE  # noqa: E402
+
+# 기준 결과(tests/data/*.csv)는 개선 전 앱(icu_culture_matcher.py, konis_wrap_who.py)에
+# 같은 파일을 올려 화면에 나온 표를 그대로 저장한 것
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+MATCHER_PROFILE = {
+    "culture_id": "환자번호", "culture_date": "시행일시", "culture_ward": "병동", "culture_result": "미생물명",
+    "icu_id": "환자번호", "icu_in": "입실일시", "icu_out": "퇴실일시",
+    "bsi_id": "환자번호", "bsi_date": "감염발생일", "bsi_pathogen": "병원체명", "bsi_lcbi": "LCBI종류",
+    "birth_source": CULTURE_SOURCE, "birth_id": "환자번호", "birth_col": "생년월일",
+    "gender_source": CULTURE_SOURCE, "gender_id": "환자번호", "gender_col": "성별",
+}
+WHO_PROFILE = {
+    "caseno": "증례코드", "dob": "생년월일", "gender": "성별", "icu_date": "중환자실입원일", "infection_date": "감염발생일",
+    "icu_id": "환자번호", "icu_in": "입실일시", "icu_out": "퇴실일시",
+    "culture_id": "환자번호", "culture_date": "시행일시", "culture_result": "미생물명",
+    "birth_source": ICU_SOURCE, "birth_id": "환자번호", "birth_col": "생년월일",
+    "gender_source": ICU_SOURCE, "gender_id": "환자번호", "gender_col": "성별",
+}
+
+
+# 혈액배양 파일: 시행일시는 여러 형식(잘못된 "HHMMSS", "HH:MMSS" 포함)과 엑셀 날짜 셀을 섞음
+def culture_frame():
+    rows = [
+        # 1001: 입실 2일째(감시기간 이전), 감시기간 안, 퇴실 2일 뒤(감시기간 이후)
+        ("1001", "2025-01-02 07:58:44", "S. aureus", "NICU", "M", "2024-12-30"),
+        ("1001", "2025-01-05 075844", "E. coli", "NICU", "M", "2024-12-30"),
+        ("1001", "2025/01/22", "E. coli", "NICU", "M", "2024-12-30"),
+        # 1002: 같은 날 재입실 (첫 입실의 감시기간 안, 두 번째 입실의 감시기간 안)
+        ("1002", "2025-02-04 07:5844", "K. pneumoniae", "NICU", "F", "2025-01-31"),
+        ("1002", pd.Timestamp("2025-02-10 13:00"), "K. pneumoniae", "NICU", "F", "2025-01-31"),
+        # 1003: 첫 입실 전
+        ("1003", "20250301", "CoNS", "NICU", "M", "2025-02-27"),
+        # 1004, 1005: 입퇴실 기록 없음 (NICU 병동 / 다른 병동)
+        ("1004", "2025-03-05 10:00", "Candida albicans", "NICU", "F", "2025-03-01"),
+        ("1005", "2025.03.06", "E. faecalis", "6W", "M", "2024-11-11"),
+        # 1006: 엑셀 날짜 일련번호로 적힌 입퇴실일
+        ("1006", "2025-04-12 09:30:00", "S. epidermidis", "NICU", "F", "2025-04-07"),
+    ]
+    return pd.DataFrame(rows, columns=["환자번호", "시행일시", "미생물명", "병동", "성별", "생년월일"], dtype=object)
+
+
+# 입퇴실 파일: 입실일시·퇴실일시에 문자열, 엑셀 날짜 셀, 날짜 일련번호를 섞음
+def icu_frame():
+    rows = [
+        ("1001", "2025-01-01 08:00", "2025-01-20 10:00", "M", "2024-12-30"),
+        ("1002", "2025-02-01 01:00", "2025-02-03 09:00", "F", "2025-01-31"),
+        ("1002", pd.Timestamp("2025-02-03 15:00"), "2025-02-15 11:00", "F", "2025-01-31"),
+        ("1003", "2025-03-10 120000", "2025-03-20", "M", "2025-02-27"),
+        ("1006", 45754, 45770, "F", "2025-04-07"),
+    ]
+    return pd.DataFrame(rows, columns=["환자번호", "입실일시", "퇴실일시", "성별", "생년월일"], dtype=object)
+
+
+# KONIS WRAP 등록환자 파일 (혈액배양과 매칭): 1001은 등록 4건 중 3건이 감염발생일+2일 안
+def bsi_frame():
+    rows = [
+        ("1001", "2025-01-04", "E. coli", "LCBI 1"),
+        ("1001", "2025-01-03", "Enterobacter", "LCBI2"),
+        ("1001", "2025-01-05", "E. coli", None),
+        ("1001", "2025-01-02", "S. aureus", "LCBI 3"),
+        ("1002", "2025-02-09", "K. pneumoniae", "LCBI 1"),
+    ]
+    return pd.DataFrame(rows, columns=["환자번호", "감염발생일", "병원체명", "LCBI종류"], dtype=object)
+
+
+# KONIS WRAP 증례 파일 (ID 추정): 후보 1명, 후보 없음, 후보 4명(상위 3명만 표시)
+def konis_frame():
+    rows = [
+        ("C1", "2024-12-30", "M", "2025-01-01", "2025-01-04", "LCBI 1", "E. coli"),
+        ("C2", "2020-01-01", "M", "2020-01-02", "2020-01-05", "", ""),
+        ("C3", "2025-05-01", "F", "2025-05-02", "2025-05-10", "LCBI 1", "S. aureus"),
+    ]
+    return pd.DataFrame(rows, columns=["증례코드", "생년월일", "성별", "중환자실입원일", "감염발생일",
+                                       "LCBI종류", "병원체명1"], dtype=object)
+
+
+# C3 후보: 생년월일·성별·입실일이 같은 네 명 (감염발생일~+2일 안의 배양 4건 중 파일 순서로 상위 3건)
+def who_extra_frames():
+    icu = pd.DataFrame([(pid, "2025-05-02 09:00", "2025-05-30", "F", "2025-05-01")
+                        for pid in ["2001", "2002", "2003", "2004"]],
+                       columns=["환자번호", "입실일시", "퇴실일시", "성별", "생년월일"], dtype=object)
+    culture = pd.DataFrame([("2001", "2025-05-12", "S. aureus", "NICU", "F", "2025-05-01"),
+                            ("2002", "2025-05-10 08:00", "S. aureus", "NICU", "F", "2025-05-01"),
+                            ("2002", "2025-05-11", "E. coli", "NICU", "F", "2025-05-01"),
+                            ("2003", "2025-05-11", "S. aureus", "NICU", "F", "2025-05-01"),
+                            ("2004", "2025-05-13", "S. aureus", "NICU", "F", "2025-05-01")],
+                           columns=["환자번호", "시행일시", "미생물명", "병동", "성별", "생년월일"], dtype=object)
+    return icu, culture
+
+
+# DataFrame을 업로드 파일처럼 (엑셀 bytes + name)
+def xlsx_upload(df, name):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    upload = io.BytesIO(buffer.getvalue())
+    upload.name = name
+    return upload
+
+
+@pytest.fixture
+def matcher_profile():
+    return dict(MATCHER_PROFILE)
+
+
+@pytest.fixture
+def who_profile():
+    return dict(WHO_PROFILE)
+
+
+@pytest.fixture
+def matcher_files():
+    return {CULTURE_SOURCE: xlsx_upload(culture_frame(), "culture.xlsx"),
+            ICU_SOURCE: xlsx_upload(icu_frame(), "icu.xlsx"),
+            BSI_SOURCE: xlsx_upload(bsi_frame(), "bsi.xlsx")}
+
+
+@pytest.fixture
+def who_files():
+    extra_icu, extra_culture = who_extra_frames()
+    return {KONIS_SOURCE: xlsx_upload(konis_frame(), "konis.xlsx"),
+            ICU_SOURCE: xlsx_upload(pd.concat([icu_frame(), extra_icu], ignore_index=True), "icu.xlsx"),
+            CULTURE_SOURCE: xlsx_upload(pd.concat([culture_frame(), extra_culture], ignore_index=True), "culture.xlsx")}
@@ -0,0 +1,55 @@
+## 날짜 파싱 (konis_utils.parse_dates_safe, parse_dates_native) 회귀 테스트
+import pandas as pd
+
+from konis_utils import parse_dates_safe, parse_dates_native
+
+# 개선 전 셀 단위 parse_dates_safe(icu_culture_matcher.py)의 결과
+BASELINE_DATES = [
+    ("2025-03-08", "2025-03-08 00:00:00"),
+    ("2025/03/08", "2025-03-08 00:00:00"),
+    ("08-03-2025", "2025-03-08 00:00:00"),
+    ("08/03/2025", "2025-03-08 00:00:00"),
+    ("2025-03-08 07:58", "2025-03-08 07:58:00"),
+    ("2025/03/08 07:58", "2025-03-08 07:58:00"),
+    ("2025-03-08 0758", "2025-03-08 07:58:00"),
+    ("2025/03/08 0758", "2025-03-08 07:58:00"),
+    ("2025-03-08 07:58:44", "2025-03-08 07:58:44"),
+    ("2025/03/08 07:58:44", "2025-03-08 07:58:44"),
+    ("2025-03-08 075844", "2025-03-08 07:58:44"),
+    ("2025-03-08 07:5844", "2025-03-08 07:58:44"),
+    ("2025/03/08 075844", "2025-03-08 07:58:44"),
+    ("20250308", "2025-03-08 00:00:00"),
+    ("2025.03.08", "2025-03-08 00:00:00"),
+    ("2025-03-08T07:58:44", "2025-03-08 07:58:44"),
+    ("", None),
+    ("unknown", None),
+    (None, None),
+]
+
+
+def _expected(values):
+    return pd.to_datetime(pd.Series(values, dtype=object))
+
+
+# 한 컬럼에 여러 형식이 섞여도 개선 전과 같은 결과
+def test_mixed_formats_match_baseline():
+    values, expected = zip(*BASELINE_DATES)
+    parsed = parse_dates_safe(pd.Series(values, dtype=object))
+    pd.testing.assert_series_equal(parsed, _expected(expected), check_names=False)
+
+
+# 표본에 없던 드문 형식(잘못된 "HHMMSS", "HH:MMSS" 시간)도 남은 행 처리에서 파싱
+def test_rare_formats_outside_sample():
+    common = pd.date_range("2024-01-01", periods=2000, freq="37min")
+    values = list(common.strftime("%Y-%m-%d %H:%M")) + ["2025-03-08 075844", "2025-03-08 07:5844", "08/03/2025"]
+    parsed = parse_dates_safe(pd.Series(values, dtype=object))
+    assert parsed.iloc[:len(common)].tolist() == list(common)
+    assert parsed.iloc[len(common):].astype(str).tolist() == ["2025-03-08 07:58:44", "2025-03-08 07:58:44", "2025-03-08 00:00:00"]
+
+
+# 엑셀에서 읽은 컬럼: 날짜 셀, 날짜 일련번호, 문자열이 섞인 경우
+def test_excel_cells_and_serials():
+    values = pd.Series([pd.Timestamp("2025-02-03 15:00"), 45754, 45770.5, "2025-03-10 120000", 3250, None], dtype=object)
+    parsed = parse_dates_native(values)
+    assert parsed.astype(str).tolist() == ["2025-02-03 15:00:00", "2025-04-07 00:00:00", "2025-04-23 12:00:00",
+                                           "2025-03-10 12:00:00", "NaT", "NaT"]
@@ -0,0 +1,25 @@
+## 감염환자 ID 추정 (konis_pipeline.estimate_ids) 회귀 테스트
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from konis_pipeline import estimate_ids
+
+
+# 후보 없는 증례에 빈 추정ID를 채울 때 dtype 경고가 없어야 함 (pandas 3에서는 TypeError)
+@pytest.mark.filterwarnings("error::FutureWarning")
+def test_empty_candidates_without_dtype_warning(who_files, who_profile):
+    final = estimate_ids(who_files, who_profile)
+    empty = final[final["증례코드"] == "C2"]
+    assert empty[["추정ID", "추정ID분리균"]].values.tolist() == [["", ""]]
+    assert (final.loc[final["증례코드"] != "C2", "추정ID"] != "").all()
+
+
+# 후보 1명, 후보 없음(빈 행), 후보 4건 중 상위 3건: 개선 전 앱(konis_wrap_who.py)의 결과와 같음
+def test_candidates_match_baseline(who_files, who_profile):
+    final = estimate_ids(who_files, who_profile)
+    final = final.astype(object).where(final.notna(), "").astype(str)
+    baseline = pd.read_csv(os.path.join(DATA_DIR, "baseline_who.csv"), dtype=str, keep_default_na=False)
+    pd.testing.assert_frame_equal(final, baseline)
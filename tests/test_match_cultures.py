@@ -0,0 +1,61 @@
+## 혈액배양 - 중환자실 입퇴실 매칭 (konis_pipeline.match_cultures) 회귀 테스트
+import os
+
+import pandas as pd
+
+from conftest import DATA_DIR
+from konis_pipeline import match_cultures, result_view
+
+# 혈액배양 한 건을 가리키는 컬럼 (기준 결과와 행을 맞출 때 사용)
+KEY = ["등록번호_ID", "혈액배양 의뢰일", "혈액배양 분리균"]
+
+
+# 화면·파일용 표를 문자열로 (빈 값은 "", 기준 결과 CSV와 같은 표기)
+def _table(df):
+    return df.astype(object).where(df.notna(), "").astype(str).reset_index(drop=True)
+
+
+def _result(files, profile):
+    return _table(result_view(match_cultures(files, profile)["result"], "external"))
+
+
+def _baseline():
+    return pd.read_csv(os.path.join(DATA_DIR, "baseline_match.csv"), dtype=str, keep_default_na=False)
+
+
+def _by_key(df, columns):
+    return df[KEY + columns].set_index(KEY).sort_index()
+
+
+# KONIS WRAP 등록여부·상세내용: 감염발생일~+2일 안의 등록을 파일 순서로 상위 3건, "LCBI n" 표기
+def test_konis_registrations_match_baseline(matcher_files, matcher_profile):
+    result = _result(matcher_files, matcher_profile)
+    columns = ["KONIS WRAP 등록여부", "KONIS WRAP 상세내용"]
+    pd.testing.assert_frame_equal(_by_key(result, columns), _by_key(_baseline(), columns))
+    detail = result.loc[(result["등록번호_ID"] == "1001") & (result["혈액배양 의뢰일"] == "2025-01-05"), "KONIS WRAP 상세내용"]
+    assert detail.tolist() == ["250104 E. coli LCBI 1 OR 250103 Enterobacter LCBI 2 OR 250105 E. coli "]
+
+
+# 개선 전 결과와 의도적으로 달라진 행 (KEY → 바뀐 값)
+# - 1002: 같은 날 재입실 후의 혈액배양은 파일의 첫 입실 구간이 아니라 두 번째 입실 구간에 배정 (감시기간 안)
+# - 1003: 첫 입실 전 혈액배양은 매칭되지 않고 감시기간 이전
+# - 1006: 엑셀 날짜 일련번호로 적힌 입퇴실일을 날짜로 읽음
+BASELINE_CHANGES = {
+    ("1002", "2025-02-10", "K. pneumoniae"): {"입실일": "2025-02-03", "퇴실일": "2025-02-15", "비고": ""},
+    ("1003", "2025-03-01", "CoNS"): {"비고": "감시기간 이전"},
+    ("1006", "2025-04-12", "S. epidermidis"): {"입실일": "2025-04-07", "퇴실일": "2025-04-23", "비고": ""},
+}
+
+
+# 입실 구간 배정: 감시기간 안·이전·이후, 같은 날 재입실, 입퇴실 기록 없음(NICU / 다른 병동)
+def test_icu_episodes_match_baseline(matcher_files, matcher_profile):
+    result = _result(matcher_files, matcher_profile)
+    columns = [col for col in result.columns if col not in KEY + ["번호"]]
+    expected = _by_key(_baseline(), columns)
+    for key, changes in BASELINE_CHANGES.items():
+        for col, value in changes.items():
+            expected.loc[key, col] = value
+    pd.testing.assert_frame_equal(_by_key(result, columns), expected)
+    assert result["번호"].tolist() == [str(n) for n in range(1, len(result) + 1)]
+    assert result["비고"].tolist() == ["", "", "", "", "입퇴실일 확인", "감시기간 이전", "감시기간 이전",
+                                      "감시기간 이후", "시행부서 확인"]
@@ -0,0 +1,39 @@
+## 로컬 저장소 (konis_store) 회귀 테스트
+import pandas as pd
+
+from conftest import icu_frame, bsi_frame, xlsx_upload
+from konis_pipeline import ICU_SOURCE, BSI_SOURCE, match_cultures, result_view
+from konis_store import open_store, upsert_icu_episodes, load_icu_episodes
+
+
+# 빈 환자 ID는 "nan" 환자로 저장하지 않고 제외
+def test_blank_ids_are_not_stored(tmp_path):
+    conn = open_store(str(tmp_path / "store.sqlite"))
+    saved = upsert_icu_episodes(conn, "A", ["123", None, float("nan"), " "],
+                                ["2025-01-01"] * 4, ["2025-01-05"] * 4)
+    loaded = load_icu_episodes(conn, "A", "2024-01-01", "2026-01-01")
+    assert saved == 1
+    assert loaded["patient_id"].tolist() == ["123"]
+
+
+# 같은 날 퇴실 후 재입실한 입실 구간은 입실마다 따로 저장
+def test_same_day_readmissions_are_kept(tmp_path):
+    conn = open_store(str(tmp_path / "store.sqlite"))
+    upsert_icu_episodes(conn, "A", ["123", "123"], ["2025-02-01 01:00", "2025-02-01 20:00"],
+                        ["2025-02-01 10:00", "2025-02-10 09:00"])
+    loaded = load_icu_episodes(conn, "A", "2025-01-01", "2025-12-31")
+    assert loaded["out_day"].dt.strftime("%Y-%m-%d").tolist() == ["2025-02-01", "2025-02-10"]
+
+
+# 저장소에 쌓인 입실 구간·KONIS 등록으로, 일부만 올린 파일에서도 전체를 올린 것과 같은 결과
+def test_trimmed_upload_with_store_matches_full_upload(tmp_path, matcher_files, matcher_profile):
+    store = str(tmp_path / "store.sqlite")
+    profile = {**matcher_profile, "site": "A"}
+    full = result_view(match_cultures(matcher_files, profile, store=store)["result"])
+
+    icu, bsi = icu_frame(), bsi_frame()
+    trimmed = {**matcher_files,
+               ICU_SOURCE: xlsx_upload(icu[icu["환자번호"].isin(["1003", "1006"])], "icu.xlsx"),
+               BSI_SOURCE: xlsx_upload(bsi[bsi["환자번호"] == "1002"], "bsi.xlsx")}
+    assert not result_view(match_cultures(trimmed, matcher_profile)["result"]).equals(full)
+    pd.testing.assert_frame_equal(result_view(match_cultures(trimmed, profile, store=store)["result"]), full)